@@ -0,0 +1,231 @@
+#!/usr/bin/env python3
+"""
+Benchmarks the stages of extract_kubeconfig on synthetic fleet kubeconfigs: YAML
+loading, context/cluster/user resolution, certificate decoding and output
+serialization. Every case runs on the YAML text and on the same kubeconfig as JSON.
+Results can be saved as a JSON baseline and later runs compared
+against it, failing when a stage got slower than the tolerance allows.
+
+Usage: python3 benchmarks/extract.py [--contexts 1,100] [--cert-sizes 1024]
+       [--formats yaml,json] [--save-baseline FILE] [--compare FILE]
+"""
+
+import argparse
+import base64
+import json
+import os
+import platform
+import random
+import statistics
+import sys
+import time
+
+import yaml
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import kubeconfig_plugin  # noqa: E402
+
+
+def generate_pem(rng: random.Random, size: int, label: str = "CERTIFICATE") -> str:
+    """
+    Generates a PEM block with a random body of roughly size bytes.
+    """
+    body = base64.b64encode(rng.randbytes(size)).decode("ascii")
+    lines = [body[i : i + 64] for i in range(0, len(body), 64)]  # noqa: E203
+    return (
+        f"-----BEGIN {label}-----\n" + "\n".join(lines) + f"\n-----END {label}-----\n"
+    )
+
+
+def generate_kubeconfig(contexts: int, cert_size: int, auth: str, seed: int = 0) -> str:
+    """
+    Generates a kubeconfig with the given number of contexts, each with its own
+    cluster and user, in the layout kubectl writes. Users authenticate with an inline
+    client certificate and key, or with a token. The current context is the middle
+    one.
+    """
+    rng = random.Random(seed)
+
+    def encode(pem: str) -> str:
+        return base64.b64encode(pem.encode("ascii")).decode("ascii")
+
+    lines = ["apiVersion: v1", "clusters:"]
+    for i in range(contexts):
+        lines += [
+            "- cluster:",
+            f"    certificate-authority-data: {encode(generate_pem(rng, cert_size))}",
+            f"    server: https://api.cluster-{i}.example.com:6443",
+            f"  name: cluster-{i}",
+        ]
+    lines.append("contexts:")
+    for i in range(contexts):
+        lines += [
+            "- context:",
+            f"    cluster: cluster-{i}",
+            f"    user: user-{i}",
+            f"  name: context-{i}",
+        ]
+    lines += [f"current-context: context-{contexts // 2}", "kind: Config", "users:"]
+    for i in range(contexts):
+        lines += [f"- name: user-{i}", "  user:"]
+        if auth == "inline":
+            cert = encode(generate_pem(rng, cert_size))
+            key = encode(generate_pem(rng, cert_size, "PRIVATE KEY"))
+            lines += [
+                f"    client-certificate-data: {cert}",
+                f"    client-key-data: {key}",
+            ]
+        else:
+            lines.append(f"    token: sha256~{rng.randbytes(32).hex()}")
+    return "\n".join(lines) + "\n"
+
+
+def measure(function, repeat: int) -> float:
+    samples = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        function()
+        samples.append(time.perf_counter() - start)
+    return statistics.median(samples)
+
+
+def benchmark_case(kubeconfig_text: str, repeat: int) -> dict:
+    # The selective loader only keeps the current entries, so resolve on a full load
+    # to measure the lookups over every entry.
+    kubeconfig = kubeconfig_plugin.load_yaml(kubeconfig_text)
+    current_context = kubeconfig["current-context"]
+
+    def resolve():
+        index = kubeconfig_plugin.KubeconfigIndex(kubeconfig)
+        context = index.context(current_context)["context"]
+        return index.cluster(context["cluster"]), index.user(context["user"])
+
+    cluster_entry, user_entry = resolve()
+    blobs = [
+        value
+        for value in (
+            cluster_entry["cluster"].get("certificate-authority-data"),
+            user_entry["user"].get("client-certificate-data"),
+            user_entry["user"].get("client-key-data"),
+        )
+        if value is not None
+    ]
+
+    def decode():
+        # Measure real decoding rather than the blob cache.
+        kubeconfig_plugin._decode_pem_blob.cache_clear()
+        for blob in blobs:
+            kubeconfig_plugin.decode_pem(blob, "benchmark")
+
+    result, output = kubeconfig_plugin._extract_kubeconfig(kubeconfig_text)
+    if result != "success":
+        raise RuntimeError(f"Extraction failed: {output.error}")
+
+    return {
+        "load": measure(
+            lambda: kubeconfig_plugin.load_kubeconfig(kubeconfig_text), repeat
+        ),
+        "resolve": measure(resolve, repeat),
+        "decode": measure(decode, repeat),
+        "serialize": measure(
+            lambda: kubeconfig_plugin.kubeconfig_output_schema.serialize(output),
+            repeat,
+        ),
+        "total": measure(
+            lambda: kubeconfig_plugin._extract_kubeconfig(kubeconfig_text), repeat
+        ),
+    }
+
+
+def compare(results: dict, baseline: dict, tolerance: float, min_delta: float) -> list:
+    """
+    Returns a description of every stage that is slower than its baseline by more
+    than the tolerance factor and min_delta seconds.
+    """
+    regressions = []
+    for case, stages in results.items():
+        for stage, seconds in stages.items():
+            reference = baseline.get(case, {}).get(stage)
+            if reference is None:
+                continue
+            if seconds > reference * tolerance and seconds - reference > min_delta:
+                regressions.append(
+                    f"{case} {stage}: {seconds * 1000:.2f}ms, baseline"
+                    f" {reference * 1000:.2f}ms"
+                )
+    return regressions
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--contexts", default="1,10,100,1000,10000")
+    parser.add_argument("--cert-sizes", default="1024,4096")
+    parser.add_argument("--auth", default="inline,token")
+    parser.add_argument("--formats", default="yaml,json")
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--save-baseline", metavar="FILE")
+    parser.add_argument("--compare", metavar="FILE")
+    parser.add_argument(
+        "--tolerance",
+        type=float,
+        default=1.25,
+        help="Allowed slowdown factor against the baseline.",
+    )
+    parser.add_argument(
+        "--min-delta-ms",
+        type=float,
+        default=1.0,
+        help="Slowdowns below this are treated as noise.",
+    )
+    args = parser.parse_args()
+
+    results = {}
+    for contexts in [int(c) for c in args.contexts.split(",")]:
+        for cert_size in [int(s) for s in args.cert_sizes.split(",")]:
+            for auth in args.auth.split(","):
+                text = generate_kubeconfig(contexts, cert_size, auth)
+                for text_format in args.formats.split(","):
+                    # YAML case names are kept as they were for existing baselines.
+                    case = f"contexts={contexts},cert={cert_size},auth={auth}"
+                    if text_format == "json":
+                        case += ",format=json"
+                        case_text = json.dumps(yaml.safe_load(text))
+                    else:
+                        case_text = text
+                    results[case] = benchmark_case(case_text, args.repeat)
+                    print(
+                        f"{case} ({len(case_text)} bytes): "
+                        + ", ".join(
+                            f"{stage} {seconds * 1000:.3f}ms"
+                            for stage, seconds in results[case].items()
+                        ),
+                        file=sys.stderr,
+                    )
+
+    report = {
+        "python": platform.python_version(),
+        "parse_mode": kubeconfig_plugin.parse_mode,
+        "results": results,
+    }
+    if args.save_baseline:
+        with open(args.save_baseline, "w") as f:
+            json.dump(report, f, indent=2)
+    else:
+        print(json.dumps(report, indent=2))
+
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)["results"]
+        regressions = compare(
+            results, baseline, args.tolerance, args.min_delta_ms / 1000
+        )
+        for regression in regressions:
+            print(f"REGRESSION {regression}", file=sys.stderr)
+        if regressions:
+            return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,130 @@
+#!/usr/bin/env python3
+"""
+Measures the cold start of the kubeconfig plugin: the time to import the plugin module
+and the end-to-end time of running the kubeconfig step on kubeconfig_example.yaml in a
+fresh interpreter, started like the container entry point does. Results can be saved
+as a JSON baseline and later runs compared against it, failing when a median got
+slower than the tolerance allows.
+
+Usage: python3 benchmarks/startup.py [--runs N] [--save-baseline FILE]
+       [--compare FILE] [--tolerance FACTOR]
+"""
+
+import argparse
+import compileall
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+IMPORT_SNIPPET = (
+    "import time\n"
+    "start = time.perf_counter()\n"
+    "import kubeconfig_plugin\n"
+    "print(time.perf_counter() - start)\n"
+)
+
+
+def measure_import(runs: int) -> list:
+    samples = []
+    for _ in range(runs):
+        output = subprocess.run(
+            [sys.executable, "-c", IMPORT_SNIPPET],
+            cwd=ROOT,
+            check=True,
+            capture_output=True,
+            text=True,
+        ).stdout
+        samples.append(float(output) * 1000)
+    return samples
+
+
+def measure_run(runs: int) -> list:
+    command = [
+        sys.executable,
+        "-m",
+        "kubeconfig_plugin",
+        "-s",
+        "kubeconfig",
+        "-f",
+        os.path.join(ROOT, "kubeconfig_example.yaml"),
+    ]
+    samples = []
+    for _ in range(runs):
+        start = time.perf_counter()
+        subprocess.run(command, cwd=ROOT, check=True, capture_output=True)
+        samples.append((time.perf_counter() - start) * 1000)
+    return samples
+
+
+def compare(results: dict, baseline: dict, tolerance: float, min_delta: float) -> list:
+    """
+    Returns a description of every median that is slower than its baseline by more
+    than the tolerance factor and min_delta milliseconds.
+    """
+    regressions = []
+    for name, value in results.items():
+        reference = baseline.get(name)
+        if reference is None:
+            continue
+        if value > reference * tolerance and value - reference > min_delta:
+            regressions.append(f"{name}: {value:.1f}, baseline {reference:.1f}")
+    return regressions
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--runs", type=int, default=10)
+    parser.add_argument("--save-baseline", metavar="FILE")
+    parser.add_argument("--compare", metavar="FILE")
+    parser.add_argument(
+        "--tolerance",
+        type=float,
+        default=1.15,
+        help="Allowed slowdown factor against the baseline.",
+    )
+    parser.add_argument(
+        "--min-delta-ms",
+        type=float,
+        default=5.0,
+        help="Slowdowns below this are treated as noise.",
+    )
+    parser.add_argument(
+        "--json", action="store_true", help="Print the results as JSON."
+    )
+    args = parser.parse_args()
+
+    # The container image is built with the bytecode caches, so measure with them too.
+    compileall.compile_dir(ROOT, maxlevels=0, quiet=1)
+    results = {
+        "import_ms": statistics.median(measure_import(args.runs)),
+        "run_ms": statistics.median(measure_run(args.runs)),
+    }
+    report = {"python": platform.python_version(), "results": results}
+    if args.save_baseline:
+        with open(args.save_baseline, "w") as f:
+            json.dump(report, f, indent=2)
+    if args.json:
+        print(json.dumps(report))
+    else:
+        for name, value in results.items():
+            print(f"{name}: {value:.1f}")
+
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)["results"]
+        regressions = compare(results, baseline, args.tolerance, args.min_delta_ms)
+        for regression in regressions:
+            print(f"REGRESSION {regression}", file=sys.stderr)
+        if regressions:
+            return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,149 @@
+"""
+The kubeconfig_batch step, which extracts a list of kubeconfigs in a thread or
+process pool.
+"""
+
+import os
+import typing
+from dataclasses import dataclass
+
+from arcaflow_plugin_sdk import schema, validation
+
+import kubeconfig_plugin
+from kubeconfig_plugin import (
+    Connection,
+    Dependencies,
+    ExecutorType,
+    StepErrorOutput,
+    StepResult,
+    _extract_tracked,
+    _pool_class,
+    step,
+)
+
+
+@dataclass
+class BatchInputParams:
+    """
+    This is the input data structure for the batch kubeconfig step.
+    """
+
+    kubeconfigs: typing.Annotated[
+        typing.List[str],
+        validation.min(1),
+        schema.name("Kubeconfigs"),
+        schema.description("List of input kubeconfig strings"),
+    ]
+    executor: typing.Annotated[
+        ExecutorType,
+        schema.name("Executor"),
+        schema.description(
+            "Pool the kubeconfigs are extracted in, either thread or process"
+        ),
+    ] = ExecutorType.THREAD
+    workers: typing.Annotated[
+        typing.Optional[int],
+        validation.min(1),
+        schema.name("Workers"),
+        schema.description("Number of pool workers, defaults to the CPU count"),
+    ] = None
+
+
+@dataclass
+class BatchItemResult:
+    """
+    This is the result for one kubeconfig of a batch. Exactly one of the fields is set.
+    """
+
+    connection: typing.Annotated[
+        typing.Optional[Connection],
+        schema.name("Kubernetes connection"),
+        schema.description("Kubernetes connection if the extraction succeeded"),
+    ] = None
+    error: typing.Annotated[
+        typing.Optional[str],
+        schema.name("Failure Error"),
+        schema.description("Reason for failure if the extraction failed"),
+    ] = None
+
+
+@dataclass
+class BatchSuccessOutput:
+    """
+    This is the output data structure for the batch step, with one result per input
+    kubeconfig in input order.
+    """
+
+    results: typing.Annotated[
+        typing.List[BatchItemResult],
+        schema.name("Results"),
+        schema.description("Per kubeconfig results in input order"),
+    ]
+
+
+@step(
+    id="kubeconfig_batch",
+    name="kubeconfig batch",
+    description=(
+        "Inputs a list of kubeconfigs and extracts the kubernetes cluster details of"
+        " each in a thread or process pool"
+    ),
+    outputs={"success": BatchSuccessOutput, "error": StepErrorOutput},
+)
+def extract_kubeconfig_batch(
+    params: BatchInputParams,
+) -> typing.Tuple[str, typing.Union[BatchSuccessOutput, StepErrorOutput]]:
+    print(
+        f"==>> Parsing and extracting kubernetes cluster details of"
+        f" {len(params.kubeconfigs)} kubeconfigs ..."
+    )
+
+    # Identical kubeconfigs are extracted once, and cached ones not at all.
+    keys = [
+        kubeconfig_plugin.result_cache.key(kubeconfig)
+        for kubeconfig in params.kubeconfigs
+    ]
+    results: typing.Dict[str, StepResult] = {}
+    pending: typing.Dict[str, str] = {}
+    for key, kubeconfig in zip(keys, params.kubeconfigs):
+        if key in results or key in pending:
+            continue
+        cached = kubeconfig_plugin.result_cache.get(key)
+        if cached is not None:
+            results[key] = cached
+        else:
+            pending[key] = kubeconfig
+
+    try:
+        extracted = _map_extract(params, pending.values())
+        for key, (result, dependencies) in zip(pending.keys(), extracted):
+            kubeconfig_plugin.result_cache.put(key, result, dependencies)
+            results[key] = result
+    except Exception as e:
+        return "error", StepErrorOutput(
+            f"Failure to run the batch {params.executor.value} pool. Exception: {e}"
+        )
+
+    items = []
+    for key in keys:
+        output_id, output_data = results[key]
+        if output_id == "success":
+            items.append(BatchItemResult(connection=output_data.connection))
+        else:
+            items.append(BatchItemResult(error=output_data.error))
+    return "success", BatchSuccessOutput(items)
+
+
+def _map_extract(
+    params: BatchInputParams, kubeconfigs: typing.Collection[str]
+) -> typing.Iterable[typing.Tuple[StepResult, Dependencies]]:
+    """
+    Extracts the kubeconfigs in the configured pool, returning results in input order.
+    """
+    if len(kubeconfigs) <= 1 or params.workers == 1:
+        return [_extract_tracked(kubeconfig) for kubeconfig in kubeconfigs]
+    workers = min(params.workers or os.cpu_count() or 1, len(kubeconfigs))
+    # Larger chunks amortize the inter-process round trips of the process pool.
+    chunksize = max(1, len(kubeconfigs) // (workers * 4))
+    with _pool_class(params.executor)(max_workers=workers) as pool:
+        return list(pool.map(_extract_tracked, kubeconfigs, chunksize=chunksize))
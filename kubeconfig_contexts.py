@@ -0,0 +1,235 @@
+"""
+The kubeconfig_all_contexts step, which extracts the connections of every context
+of a kubeconfig.
+"""
+
+import dataclasses
+import hashlib
+import typing
+from dataclasses import dataclass
+
+from arcaflow_plugin_sdk import schema, validation
+
+from kubeconfig_plugin import (
+    KubeconfigError,
+    KubeconfigIndex,
+    StepErrorOutput,
+    _extract_connection,
+    _load_config,
+    _unexpected_error,
+    step,
+)
+
+
+def _slots(cls: type) -> type:
+    """
+    Recreates a dataclass with __slots__ for its fields, as dataclass(slots=True)
+    does on Python 3.10 and later. The field defaults stay in the dataclass fields
+    and __init__.
+    """
+    names = tuple(f.name for f in dataclasses.fields(cls))
+    namespace = dict(cls.__dict__)
+    for name in names + ("__dict__", "__weakref__"):
+        namespace.pop(name, None)
+    namespace["__slots__"] = names
+    return type(cls)(cls.__name__, cls.__bases__, namespace)
+
+
+@dataclass
+class AllContextsInputParams:
+    """
+    This is the input data structure for the all contexts kubeconfig step.
+    """
+
+    kubeconfig: typing.Annotated[
+        str,
+        validation.min(1),
+        schema.name("kubeconfig"),
+        schema.description("input kubeconfig string"),
+    ]
+
+
+@_slots
+@dataclass
+class ContextConnection:
+    """
+    This is the connection of one context. Certificates and keys are referenced by
+    their id in the blob table of the output. Either host or error is set.
+    """
+
+    context: typing.Annotated[
+        str,
+        schema.name("Context"),
+        schema.description("Name of the context"),
+    ]
+    host: typing.Annotated[
+        typing.Optional[str],
+        schema.name("Server"),
+        schema.description("Kubernetes API URL"),
+    ] = None
+    username: typing.Annotated[
+        typing.Optional[str],
+        schema.name("Username"),
+        schema.description("Username to authenticate with."),
+    ] = None
+    password: typing.Annotated[
+        typing.Optional[str],
+        schema.name("Password"),
+        schema.description("Password to authenticate with."),
+    ] = None
+    serverName: typing.Annotated[
+        typing.Optional[str],
+        schema.name("TLS server name"),
+        schema.description("Server name to verify TLS certificate against."),
+    ] = None
+    cert_id: typing.Annotated[
+        typing.Optional[str],
+        schema.name("Client certificate"),
+        schema.description("Blob id of the client cert in PEM format"),
+    ] = None
+    key_id: typing.Annotated[
+        typing.Optional[str],
+        schema.name("Client key"),
+        schema.description("Blob id of the client key in PEM format"),
+    ] = None
+    cacert_id: typing.Annotated[
+        typing.Optional[str],
+        schema.name("CA certificate"),
+        schema.description("Blob id of the CA certificate in PEM format"),
+    ] = None
+    bearerToken: typing.Annotated[
+        typing.Optional[str],
+        schema.name("Token"),
+        schema.description("Secret token of the user/service account"),
+    ] = None
+    fingerprint: typing.Annotated[
+        typing.Optional[str],
+        schema.name("Fingerprint"),
+        schema.description(
+            "SHA-256 of the server, TLS server name, CA certificate and credentials."
+            " Connections with the same fingerprint can share clients."
+        ),
+    ] = None
+    error: typing.Annotated[
+        typing.Optional[str],
+        schema.name("Failure Error"),
+        schema.description("Reason for failure if the extraction failed"),
+    ] = None
+
+
+@dataclass
+class AllContextsOutput:
+    """
+    This is the output data structure for the all contexts step, with one connection
+    per context in kubeconfig order.
+    """
+
+    contexts: typing.Annotated[
+        typing.List[ContextConnection],
+        schema.name("Contexts"),
+        schema.description("Connections of all contexts in kubeconfig order"),
+    ]
+    blobs: typing.Annotated[
+        typing.Dict[str, str],
+        schema.name("Blobs"),
+        schema.description(
+            "Certificates and keys in PEM format by id, each stored once however"
+            " many contexts use it"
+        ),
+    ]
+    current_context: typing.Annotated[
+        typing.Optional[str],
+        schema.name("Current context"),
+        schema.description("Name of the current context, if set"),
+    ] = None
+
+
+@step(
+    id="kubeconfig_all_contexts",
+    name="kubeconfig all contexts",
+    description=(
+        "Inputs a kubeconfig, parses it once and extracts the kubernetes cluster"
+        " details of every context"
+    ),
+    outputs={"success": AllContextsOutput, "error": StepErrorOutput},
+)
+def extract_all_contexts(
+    params: AllContextsInputParams,
+) -> typing.Tuple[str, typing.Union[AllContextsOutput, StepErrorOutput]]:
+    print("==>> Parsing and extracting kubernetes cluster details of all contexts ...")
+    return _extract_all_contexts(params.kubeconfig)
+
+
+def _extract_all_contexts(
+    kubeconfig_text: str, base_dir: typing.Optional[str] = None
+) -> typing.Tuple[str, typing.Union[AllContextsOutput, StepErrorOutput]]:
+    """
+    Parses the whole kubeconfig once and extracts the connection of every context
+    with the same rules as the kubeconfig step. Problems with a single context are
+    reported in its connection's error.
+    """
+    try:
+        kubeconfig = _load_config(kubeconfig_text, full=True)
+        index = KubeconfigIndex(kubeconfig)
+        blob_ids: typing.Dict[str, str] = {}
+        contexts = [
+            _context_connection(index, name, base_dir, blob_ids)
+            for name in index.section("contexts")
+        ]
+    except KubeconfigError as e:
+        return "error", StepErrorOutput(str(e))
+    except Exception as e:
+        return "error", _unexpected_error(e)
+    current_context = kubeconfig.get("current-context", None)
+    return "success", AllContextsOutput(
+        contexts=contexts,
+        blobs={blob_id: pem for pem, blob_id in blob_ids.items()},
+        current_context=None if current_context is None else str(current_context),
+    )
+
+
+def _context_connection(
+    index: KubeconfigIndex,
+    name: typing.Any,
+    base_dir: typing.Optional[str],
+    blob_ids: typing.Dict[str, str],
+) -> ContextConnection:
+    try:
+        result, output = _extract_connection(index, name, base_dir)
+    except KubeconfigError as e:
+        return ContextConnection(str(name), error=str(e))
+    except Exception as e:
+        return ContextConnection(
+            str(name), error=f"Failure to extract context. Exception: {e}"
+        )
+    if result == "error":
+        return ContextConnection(str(name), error=output.error)
+    connection = output.connection
+    return ContextConnection(
+        str(name),
+        host=connection.host,
+        username=connection.username,
+        password=connection.password,
+        serverName=connection.serverName,
+        cert_id=_blob_id(connection.cert, blob_ids),
+        key_id=_blob_id(connection.key, blob_ids),
+        cacert_id=_blob_id(connection.cacert, blob_ids),
+        bearerToken=connection.bearerToken,
+        fingerprint=connection.fingerprint,
+    )
+
+
+def _blob_id(
+    pem: typing.Optional[str], blob_ids: typing.Dict[str, str]
+) -> typing.Optional[str]:
+    """
+    Returns the id of the PEM text in the blob table, adding it when it is new. Ids
+    are derived from the content, so they are stable across invocations.
+    """
+    if pem is None:
+        return None
+    blob_id = blob_ids.get(pem)
+    if blob_id is None:
+        blob_id = hashlib.sha256(pem.encode("utf-8")).hexdigest()[:16]
+        blob_ids[pem] = blob_id
+    return blob_id
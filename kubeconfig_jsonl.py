@@ -0,0 +1,144 @@
+"""
+The --jsonl mode of the plugin, which runs the kubeconfig step on a stream of
+inputs.
+"""
+
+import collections
+import contextlib
+import json
+import os
+import random
+import sys
+import time
+import typing
+
+from kubeconfig_plugin import (
+    ErrorOutput,
+    ExecutorType,
+    _pool_class,
+    _result_json,
+    extract_kubeconfig,
+    kubeconfig_input_schema,
+)
+
+
+def run_jsonl(
+    input_stream: typing.TextIO,
+    output_stream: typing.TextIO,
+    workers: int = 1,
+    executor: ExecutorType = ExecutorType.THREAD,
+) -> typing.Dict[str, float]:
+    """
+    Runs the kubeconfig step for every line of the input stream, each holding one
+    JSON serialized InputParams object, and writes one JSON result per line in input
+    order as soon as it is ready. At most twice the number of workers lines are in
+    flight and the latency percentiles come from a fixed-size sample, so memory
+    stays bounded for inputs of any length. Returns a throughput summary.
+    """
+    latencies = LatencyReservoir()
+    start = time.perf_counter()
+
+    def write(result: typing.Tuple[str, float]):
+        line, latency = result
+        output_stream.write(line + "\n")
+        output_stream.flush()
+        latencies.add(latency)
+
+    lines = (line for line in input_stream if line.strip())
+    # The step prints a banner to stdout, which would corrupt the output when that
+    # is stdout too.
+    with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+        if workers <= 1:
+            for line in lines:
+                write(_process_jsonl_line(line))
+        else:
+            with _pool_class(executor)(max_workers=workers) as pool:
+                in_flight = collections.deque()
+                for line in lines:
+                    in_flight.append(pool.submit(_process_jsonl_line, line))
+                    if len(in_flight) >= workers * 2:
+                        write(in_flight.popleft().result())
+                while in_flight:
+                    write(in_flight.popleft().result())
+
+    elapsed = time.perf_counter() - start
+    return {
+        "items": latencies.count,
+        "seconds": elapsed,
+        "items_per_second": latencies.count / elapsed if elapsed > 0 else 0.0,
+        "p50_ms": latencies.percentile(50) * 1000,
+        "p99_ms": latencies.percentile(99) * 1000,
+    }
+
+
+class LatencyReservoir:
+    """
+    This is a uniform random sample of at most size latencies out of a stream of any
+    length, using reservoir sampling. Percentiles are exact while the stream fits
+    into the sample.
+    """
+
+    def __init__(self, size: int = 10000, seed: int = 0):
+        self.size = size
+        self.count = 0
+        self._samples: typing.List[float] = []
+        self._random = random.Random(seed)
+
+    def add(self, value: float):
+        self.count += 1
+        if len(self._samples) < self.size:
+            self._samples.append(value)
+            return
+        index = self._random.randrange(self.count)
+        if index < self.size:
+            self._samples[index] = value
+
+    def percentile(self, percentile: float) -> float:
+        return _percentile(sorted(self._samples), percentile)
+
+
+def _process_jsonl_line(line: str) -> typing.Tuple[str, float]:
+    start = time.perf_counter()
+    try:
+        params = kubeconfig_input_schema.unserialize(json.loads(line))
+        output_id, output_data = extract_kubeconfig(params)
+    except Exception as e:
+        output_id, output_data = "error", ErrorOutput(f"Invalid input line: {e}")
+    line = _result_json((output_id, output_data))
+    return line, time.perf_counter() - start
+
+
+def _percentile(sorted_values: typing.List[float], percentile: float) -> float:
+    if not sorted_values:
+        return 0.0
+    index = round(percentile / 100 * (len(sorted_values) - 1))
+    return sorted_values[index]
+
+
+def main(argv: typing.List[str]) -> int:
+    import argparse
+
+    parser = argparse.ArgumentParser(
+        description="Run the kubeconfig step on a JSONL stream of inputs."
+    )
+    parser.add_argument(
+        "--jsonl",
+        required=True,
+        metavar="FILE",
+        help="File with one JSON input object per line. Pass - to read from stdin.",
+    )
+    parser.add_argument("--workers", type=int, default=1)
+    parser.add_argument(
+        "--executor",
+        choices=[e.value for e in ExecutorType],
+        default=ExecutorType.THREAD.value,
+    )
+    args = parser.parse_args(argv)
+    executor = ExecutorType(args.executor)
+    if args.jsonl == "-":
+        summary = run_jsonl(sys.stdin, sys.stdout, args.workers, executor)
+    else:
+        with open(args.jsonl, "r") as f:
+            summary = run_jsonl(f, sys.stdout, args.workers, executor)
+    print(json.dumps(summary), file=sys.stderr)
+    return 0
@@ -0,0 +1,276 @@
+"""
+The kubeconfig_merged step, which merges several kubeconfigs like kubectl.
+"""
+
+import bisect
+import collections
+import functools
+import os
+import threading
+import typing
+from dataclasses import dataclass
+
+from arcaflow_plugin_sdk import schema
+
+import kubeconfig_plugin
+from kubeconfig_plugin import (
+    KubeconfigError,
+    KubeconfigIndex,
+    StepErrorOutput,
+    SuccessOutput,
+    _extract_connection,
+    _resolve_path,
+    _unexpected_error,
+    config_volume_path,
+    load_yaml,
+    read_credential_file,
+    step,
+)
+
+
+@dataclass
+class MergedInputParams:
+    """
+    This is the input data structure for the merged kubeconfig step. At least one of
+    the fields must be set. Documents are merged before files.
+    """
+
+    kubeconfigs: typing.Annotated[
+        typing.Optional[typing.List[str]],
+        schema.name("Kubeconfigs"),
+        schema.description("Kubeconfig documents to merge, in priority order"),
+    ] = None
+    kubeconfig_paths: typing.Annotated[
+        typing.Optional[str],
+        schema.name("Kubeconfig paths"),
+        schema.description(
+            "KUBECONFIG style list of kubeconfig files to merge, in priority order."
+            " Relative paths are resolved against the /config volume, and paths"
+            " outside of it are rejected."
+        ),
+    ] = None
+
+
+_section_names = ("contexts", "clusters", "users")
+
+
+class _Fragment:
+    """
+    This is one parsed kubeconfig of a merge, with a name index per section.
+    """
+
+    def __init__(
+        self, current_context: typing.Any, sections: typing.Dict[str, typing.Dict]
+    ):
+        self.current_context = current_context
+        self.sections = sections
+
+
+@functools.lru_cache(maxsize=256)
+def _load_fragment(text: str, name: str, base_dir: typing.Optional[str]) -> _Fragment:
+    """
+    Parses and indexes a kubeconfig fragment. Fragments are cached by their content,
+    so each one is only parsed once. Relative file references are made absolute
+    against base_dir, like kubectl does for files, so they stay correct after merging.
+    """
+    try:
+        kubeconfig = load_yaml(text)
+    except KubeconfigError:
+        raise
+    except Exception as e:
+        raise KubeconfigError(
+            f"Exception occurred while loading YAML of {name}. Input is not valid"
+            f" YAML. Exception: {e}"
+        )
+    if kubeconfig is None:
+        kubeconfig = {}
+    if not isinstance(kubeconfig, dict):
+        raise KubeconfigError(f"{name} is not a kubeconfig file")
+    index = KubeconfigIndex(kubeconfig, require_sections=False)
+    sections = {section: index.section(section) for section in _section_names}
+    if base_dir is not None:
+        for section, item_key, fields in _path_fields:
+            for entry_name, entry in sections[section].items():
+                item = entry.get(item_key, None)
+                if isinstance(item, dict):
+                    sections[section][entry_name] = {
+                        **entry,
+                        item_key: _resolve_item_paths(item, fields, base_dir),
+                    }
+    return _Fragment(kubeconfig.get("current-context", None) or None, sections)
+
+
+# Sections, item keys and item fields holding file paths.
+_path_fields = (
+    ("clusters", "cluster", ("certificate-authority",)),
+    ("users", "user", ("client-certificate", "client-key", "tokenFile")),
+)
+
+
+def _resolve_item_paths(
+    item: typing.Dict[str, typing.Any], fields: typing.Tuple[str, ...], base_dir: str
+) -> typing.Dict[str, typing.Any]:
+    item = dict(item)
+    for field_name in fields:
+        if isinstance(item.get(field_name, None), str):
+            item[field_name] = _resolve_path(item[field_name], base_dir)
+    exec_config = item.get("exec", None)
+    if isinstance(exec_config, dict) and os.sep in str(exec_config.get("command")):
+        item["exec"] = {
+            **exec_config,
+            "command": _resolve_path(exec_config["command"], base_dir),
+        }
+    return item
+
+
+class KubeconfigMerge:
+    """
+    This is a name index over several kubeconfig fragments, merged with kubectl's
+    rules: the first fragment that sets a current-context or defines a context,
+    cluster or user name wins. Updating the merge with a new list of fragments only
+    re-indexes the positions whose fragment changed.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self._fragments: typing.List[_Fragment] = []
+        # Per section and name, the sorted positions of the fragments defining it.
+        self._providers: typing.Dict[str, typing.Dict[typing.Any, typing.List[int]]] = {
+            section: {} for section in _section_names
+        }
+
+    def update(self, fragments: typing.List[_Fragment]) -> int:
+        """
+        Merges the given fragments and returns the number of re-indexed positions.
+        """
+        if len(fragments) != len(self._fragments):
+            self._fragments = [None] * len(fragments)
+            self._providers = {section: {} for section in _section_names}
+        changed = 0
+        for position, fragment in enumerate(fragments):
+            previous = self._fragments[position]
+            if previous is fragment:
+                continue
+            changed += 1
+            if previous is not None:
+                self._remove(position, previous)
+            self._add(position, fragment)
+            self._fragments[position] = fragment
+        return changed
+
+    @property
+    def current_context(self) -> typing.Any:
+        for fragment in self._fragments:
+            if fragment.current_context is not None:
+                return fragment.current_context
+        return None
+
+    def context(self, name: typing.Any) -> typing.Optional[typing.Dict]:
+        return self._entry("contexts", name)
+
+    def cluster(self, name: typing.Any) -> typing.Optional[typing.Dict]:
+        return self._entry("clusters", name)
+
+    def user(self, name: typing.Any) -> typing.Optional[typing.Dict]:
+        return self._entry("users", name)
+
+    def _entry(self, section: str, name: typing.Any) -> typing.Optional[typing.Dict]:
+        try:
+            positions = self._providers[section].get(name)
+        except TypeError:
+            # A list or mapping as the name can't match any entry.
+            return None
+        if not positions:
+            return None
+        return self._fragments[positions[0]].sections[section][name]
+
+    def _add(self, position: int, fragment: _Fragment):
+        for section in _section_names:
+            providers = self._providers[section]
+            for name in fragment.sections[section]:
+                bisect.insort(providers.setdefault(name, []), position)
+
+    def _remove(self, position: int, fragment: _Fragment):
+        for section in _section_names:
+            providers = self._providers[section]
+            for name in fragment.sections[section]:
+                providers[name].remove(position)
+                if not providers[name]:
+                    del providers[name]
+
+
+# Merges are kept per input source so that repeated invocations only re-merge the
+# fragments that changed.
+_merges: typing.OrderedDict[typing.Any, KubeconfigMerge] = collections.OrderedDict()
+_merges_lock = threading.Lock()
+
+
+def _merge_for(source: typing.Any) -> KubeconfigMerge:
+    with _merges_lock:
+        merge = _merges.get(source)
+        if merge is None:
+            merge = KubeconfigMerge()
+            _merges[source] = merge
+            while len(_merges) > 16:
+                _merges.popitem(last=False)
+        else:
+            _merges.move_to_end(source)
+        return merge
+
+
+@step(
+    id="kubeconfig_merged",
+    name="kubeconfig merged",
+    description=(
+        "Inputs several kubeconfigs, merges them like kubectl and extracts the"
+        " kubernetes cluster details of the current context"
+    ),
+    outputs={"success": SuccessOutput, "error": StepErrorOutput},
+)
+def extract_merged_kubeconfig(
+    params: MergedInputParams,
+) -> typing.Tuple[str, typing.Union[SuccessOutput, StepErrorOutput]]:
+    print("==>> Merging and extracting kubernetes cluster details ...")
+
+    if not params.kubeconfigs and not params.kubeconfig_paths:
+        return "error", StepErrorOutput(
+            "Either kubeconfigs or kubeconfig_paths must be set"
+        )
+    try:
+        fragments = [
+            _load_fragment(text, f"kubeconfig {i}", None)
+            for i, text in enumerate(params.kubeconfigs or [])
+        ]
+        paths = [
+            config_volume_path(path, "kubeconfig_paths")
+            for path in (params.kubeconfig_paths or "").split(os.pathsep)
+            if path
+        ]
+        for path in paths:
+            # Like kubectl, files in the list that do not exist are skipped.
+            if not os.path.exists(path):
+                continue
+            text = read_credential_file(path, "kubeconfig").decode("utf-8")
+            fragments.append(_load_fragment(text, path, os.path.dirname(path)))
+        if not fragments:
+            return "error", StepErrorOutput(
+                f"None of the kubeconfig files {', '.join(paths)} exist"
+            )
+
+        source = (len(params.kubeconfigs or []), tuple(paths))
+        merge = _merge_for(source)
+        with merge.lock:
+            merge.update(fragments)
+            current_context = merge.current_context
+            if current_context is None:
+                return "error", StepErrorOutput(
+                    "The provided kubeconfig file does not have a current-context"
+                    " set. Please set a current context to use."
+                )
+            return _extract_connection(
+                merge, current_context, kubeconfig_plugin.config_dir
+            )
+    except KubeconfigError as e:
+        return "error", StepErrorOutput(str(e))
+    except Exception as e:
+        return "error", _unexpected_error(e)
@@ -0,0 +1,145 @@
+"""
+The kubeconfig_minified step, which outputs the current context of a kubeconfig
+with its file references inlined.
+"""
+
+import base64
+import copy
+import typing
+from dataclasses import dataclass
+
+import yaml
+from arcaflow_plugin_sdk import schema, validation
+
+import kubeconfig_plugin
+from kubeconfig_plugin import (
+    KubeconfigError,
+    KubeconfigIndex,
+    StepErrorOutput,
+    _load_config,
+    _resolve_context,
+    _resolve_path,
+    _unexpected_error,
+    read_credential_file,
+    step,
+)
+
+
+@dataclass
+class MinifyInputParams:
+    """
+    This is the input data structure for the minified kubeconfig step.
+    """
+
+    kubeconfig: typing.Annotated[
+        str,
+        validation.min(1),
+        schema.name("kubeconfig"),
+        schema.description("input kubeconfig string"),
+    ]
+
+
+@dataclass
+class MinifiedOutput:
+    """
+    This is the output data structure for the minified kubeconfig step.
+    """
+
+    kubeconfig: typing.Annotated[
+        str,
+        schema.name("Minified kubeconfig"),
+        schema.description(
+            "Kubeconfig with only the current context and its cluster and user, with"
+            " file references inlined"
+        ),
+    ]
+
+
+class _FlatDumper(getattr(yaml, "CSafeDumper", yaml.SafeDumper)):
+    """
+    This dumps shared objects in full rather than as anchors and aliases, so the
+    minified kubeconfig is a plain document.
+    """
+
+    def ignore_aliases(self, data):
+        return True
+
+
+# Per section: the file reference fields inlined into data fields when flattening.
+_flatten_fields = {
+    "cluster": (("certificate-authority", "certificate-authority-data"),),
+    "user": (
+        ("client-certificate", "client-certificate-data"),
+        ("client-key", "client-key-data"),
+    ),
+}
+
+
+@step(
+    id="kubeconfig_minified",
+    name="kubeconfig minified",
+    description=(
+        "Inputs a kubeconfig and outputs a kubeconfig with only the current context"
+        " and its cluster and user, with file references inlined, like kubectl"
+        " config view --minify --flatten"
+    ),
+    outputs={"success": MinifiedOutput, "error": StepErrorOutput},
+)
+def minify_kubeconfig(
+    params: MinifyInputParams,
+) -> typing.Tuple[str, typing.Union[MinifiedOutput, StepErrorOutput]]:
+    print("==>> Minifying kubeconfig ...")
+    try:
+        kubeconfig = _load_config(params.kubeconfig)
+        current_context = kubeconfig.get("current-context", None)
+        if current_context is None:
+            return "error", StepErrorOutput(
+                "The provided kubeconfig file does not have a current-context set."
+                " Please set a current context to use."
+            )
+        context_entry, cluster_entry, user_entry = _resolve_context(
+            KubeconfigIndex(kubeconfig), current_context
+        )
+        minified = {
+            "apiVersion": kubeconfig.get("apiVersion", "v1"),
+            "kind": "Config",
+            "clusters": [
+                _flatten_entry(cluster_entry, "cluster", kubeconfig_plugin.config_dir)
+            ],
+            "contexts": [copy.deepcopy(context_entry)],
+            "current-context": current_context,
+            "preferences": copy.deepcopy(kubeconfig.get("preferences") or {}),
+            "users": [_flatten_entry(user_entry, "user", kubeconfig_plugin.config_dir)],
+        }
+        text = yaml.dump(minified, Dumper=_FlatDumper, sort_keys=False)
+    except KubeconfigError as e:
+        return "error", StepErrorOutput(str(e))
+    except Exception as e:
+        return "error", _unexpected_error(e)
+    return "success", MinifiedOutput(text)
+
+
+def _flatten_entry(
+    entry: typing.Dict[str, typing.Any], section: str, base_dir: str
+) -> typing.Dict[str, typing.Any]:
+    """
+    Returns a copy of a cluster or user entry with its certificate and key file
+    references replaced by base64 data fields, and a tokenFile by a token. Data
+    fields that are already set take precedence, as in kubectl.
+    """
+    entry = copy.deepcopy(entry)
+    fields = entry[section]
+    if not isinstance(fields, dict):
+        return entry
+    for file_field, data_field in _flatten_fields[section]:
+        path = fields.pop(file_field, None)
+        if path is None or fields.get(data_field) is not None:
+            continue
+        data = read_credential_file(_resolve_path(path, base_dir), file_field)
+        fields[data_field] = base64.b64encode(data).decode("ascii")
+    if section == "user" and "tokenFile" in fields:
+        path = fields.pop("tokenFile")
+        if fields.get("token") is None:
+            data = read_credential_file(_resolve_path(path, base_dir), "tokenFile")
+            fields["token"] = data.decode("utf-8").strip()
+    return entry
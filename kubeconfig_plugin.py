@@ -1,13 +1,38 @@
 #!/usr/bin/env python3
-import base64
+import binascii
+import collections
+import contextvars
+import copy
+import datetime
+import enum
+import functools
+import hashlib
+import json
+import mmap
+import os
+import re
 import sys
-import traceback
+import threading
+import time
 import typing
 from dataclasses import dataclass, field
 
 import yaml
 from arcaflow_plugin_sdk import plugin, schema, validation
 
+if typing.TYPE_CHECKING:
+    from kubeconfig_merge import KubeconfigMerge
+
+if __name__ == "__main__":
+    # The step and mode modules import this module by name. Register it so that
+    # they share it rather than running it a second time.
+    sys.modules.setdefault("kubeconfig_plugin", sys.modules[__name__])
+
+
+class ProfileMode(enum.Enum):
+    CPROFILE = "cprofile"
+    TRACEMALLOC = "tracemalloc"
+
 
 @dataclass
 class InputParams:
@@ -15,12 +40,80 @@ class InputParams:
     This is the input data structure for the kubeconfig plugin.
     """
 
-    kubeconfig: typing.Annotated[str, validation.min(1)] = field(
+    kubeconfig: typing.Annotated[typing.Optional[str], validation.min(1)] = field(
+        default=None,
         metadata={
             "name": "kubeconfig",
             "description": "input kubeconfig string",
-        }
+        },
+    )
+    metrics: bool = field(
+        default=False,
+        metadata={
+            "name": "Metrics",
+            "description": "Report per-phase timings and byte counts in the output",
+        },
     )
+    profile: typing.Optional[ProfileMode] = field(
+        default=None,
+        metadata={
+            "name": "Profile",
+            "description": (
+                "Profile this invocation with cprofile or tracemalloc and report the"
+                " result in the output metrics. Bypasses the result cache."
+            ),
+        },
+    )
+    kubeconfig_compressed: typing.Annotated[typing.Optional[str], validation.min(1)] = (
+        field(
+            default=None,
+            metadata={
+                "name": "Compressed kubeconfig",
+                "description": (
+                    "Base64 encoded gzip or zstd compressed kubeconfig, instead of"
+                    " kubeconfig. zstd needs the zstandard package."
+                ),
+            },
+        )
+    )
+    kubeconfig_path: typing.Annotated[typing.Optional[str], validation.min(1)] = field(
+        default=None,
+        metadata={
+            "name": "Kubeconfig path",
+            "description": (
+                "Path of a kubeconfig file, instead of kubeconfig. Relative paths are"
+                " resolved against the /config volume."
+            ),
+        },
+    )
+
+
+@dataclass
+class Metrics:
+    """
+    This is the instrumentation data of a step invocation.
+    """
+
+    phases: typing.Annotated[
+        typing.Dict[str, float],
+        schema.name("Phases"),
+        schema.description("Monotonic time spent per phase in milliseconds"),
+    ]
+    input_bytes: typing.Annotated[
+        int,
+        schema.name("Input bytes"),
+        schema.description("Size of the input kubeconfig in bytes"),
+    ]
+    output_bytes: typing.Annotated[
+        int,
+        schema.name("Output bytes"),
+        schema.description("Size of the JSON serialized output in bytes"),
+    ]
+    profile: typing.Annotated[
+        typing.Optional[str],
+        schema.name("Profile"),
+        schema.description("cProfile or tracemalloc report of the invocation"),
+    ] = None
 
 
 @dataclass
@@ -74,6 +167,14 @@ class Connection:
         schema.name("Token"),
         schema.description("Secret token of the user/service account"),
     ] = None
+    fingerprint: typing.Annotated[
+        typing.Optional[str],
+        schema.name("Fingerprint"),
+        schema.description(
+            "SHA-256 of the server, TLS server name, CA certificate and credentials."
+            " Connections with the same fingerprint can share clients."
+        ),
+    ] = None
 
 
 @dataclass
@@ -87,12 +188,18 @@ class SuccessOutput:
         schema.name("Kubernetes connection"),
         schema.description("Kubernetes connection confirmation."),
     ]
+    metrics: typing.Annotated[
+        typing.Optional[Metrics],
+        schema.name("Metrics"),
+        schema.description("Instrumentation data, when requested in the input"),
+    ] = None
 
 
 @dataclass
-class ErrorOutput:
+class StepErrorOutput:
     """
-    This is the output data structure in the error case.
+    This is the output data structure in the error case of the steps other than the
+    kubeconfig step.
     """
 
     error: str = field(
@@ -103,11 +210,1008 @@ class ErrorOutput:
     )
 
 
-kubeconfig_input_schema = plugin.build_object_schema(InputParams)
-kubeconfig_output_schema = plugin.build_object_schema(SuccessOutput)
+@dataclass
+class ErrorOutput(StepErrorOutput):
+    """
+    This is the output data structure in the error case of the kubeconfig step. The
+    other steps declare StepErrorOutput, so the metrics are not part of their schema.
+    """
+
+    metrics: typing.Optional[Metrics] = field(
+        default=None,
+        metadata={
+            "name": "Metrics",
+            "description": "Instrumentation data, when requested in the input",
+        },
+    )
+
+
+class ExecutorType(enum.Enum):
+    THREAD = "thread"
+    PROCESS = "process"
+
+
+StepResult = typing.Tuple[str, typing.Union[SuccessOutput, ErrorOutput]]
+# Path, inode, modification time in nanoseconds and size of a file a result depends on.
+# Files that did not exist have a size of -1.
+FileSignature = typing.Tuple[str, int, int, int]
+Dependencies = typing.Tuple[FileSignature, ...]
+
+
+class ResultCache:
+    """
+    This is a content-addressed cache of finished kubeconfig step results. Entries are
+    keyed by the SHA-256 of the kubeconfig text and evicted in least recently used
+    order once either the entry count or the approximate byte size limit is reached.
+    When a directory is given, results are also persisted there so that separate
+    plugin processes can reuse them, within the same limits. Results that depend on
+    credential files are stored with the files' signatures and invalidated once any
+    of the files change.
+    """
+
+    def __init__(
+        self,
+        max_entries: int = 256,
+        max_bytes: int = 64 * 1024 * 1024,
+        directory: typing.Optional[str] = None,
+    ):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.directory = directory
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+        self._entries: typing.OrderedDict[
+            str, typing.Tuple[StepResult, int, Dependencies]
+        ] = collections.OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def key(kubeconfig_text: str, base_dir: typing.Optional[str] = None) -> str:
+        """
+        Returns the key of the kubeconfig text. It also covers the plugin source, the
+        directory relative paths are resolved against and the parse settings, so that
+        persisted entries of other versions or settings are never used.
+        """
+        digest = hashlib.sha256(
+            f"{_plugin_version()}\0{base_dir or config_dir}\0{parse_mode}"
+            f"\0{tuple(load_limits)}\0".encode("utf-8")
+        )
+        digest.update(kubeconfig_text.encode("utf-8"))
+        return digest.hexdigest()
+
+    def get(self, key: str) -> typing.Optional[StepResult]:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+        if entry is not None:
+            result, _, dependencies = entry
+            if _dependencies_current(dependencies):
+                with self._lock:
+                    self.hits += 1
+                return _copy_result(result)
+            with self._lock:
+                if self._entries.get(key) is entry:
+                    del self._entries[key]
+                    self._bytes -= entry[1]
+                self.invalidations += 1
+        loaded = self._load(key)
+        if loaded is None or not _dependencies_current(loaded[1]):
+            with self._lock:
+                self.misses += 1
+            return None
+        with self._lock:
+            self.hits += 1
+        self._store(key, *loaded)
+        return _copy_result(loaded[0])
+
+    def put(
+        self,
+        key: str,
+        result: StepResult,
+        dependencies: typing.Optional[Dependencies] = (),
+    ):
+        if dependencies is None:
+            # The result depends on something that cannot be validated, such as an
+            # exec credential plugin.
+            return
+        self._store(key, _copy_result(result), dependencies)
+        self._save(key, result, dependencies)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._bytes = 0
+            self.hits = 0
+            self.misses = 0
+            self.evictions = 0
+            self.invalidations = 0
+
+    def stats(self) -> typing.Dict[str, int]:
+        with self._lock:
+            return {
+                "entries": len(self._entries),
+                "bytes": self._bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "invalidations": self.invalidations,
+            }
+
+    def _store(self, key: str, result: StepResult, dependencies: Dependencies):
+        size = _result_size(result)
+        if self.max_entries <= 0 or size > self.max_bytes:
+            return
+        with self._lock:
+            previous = self._entries.pop(key, None)
+            if previous is not None:
+                self._bytes -= previous[1]
+            self._entries[key] = (result, size, dependencies)
+            self._bytes += size
+            while len(self._entries) > self.max_entries or self._bytes > self.max_bytes:
+                _, (_, evicted_size, _) = self._entries.popitem(last=False)
+                self._bytes -= evicted_size
+                self.evictions += 1
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.directory, key + ".json")
+
+    def _load(
+        self, key: str
+    ) -> typing.Optional[typing.Tuple[StepResult, Dependencies]]:
+        if self.directory is None:
+            return None
+        try:
+            with open(self._path(key), "r") as f:
+                data = json.load(f)
+            if data["output_id"] == "success":
+                output_schema = kubeconfig_output_schema
+            else:
+                output_schema = kubeconfig_error_schema
+            result = data["output_id"], output_schema.unserialize(data["output_data"])
+            dependencies = tuple(tuple(d) for d in data.get("dependencies", ()))
+        except Exception:
+            # A missing or unreadable entry is just a miss.
+            return None
+        try:
+            # The modification time orders the entries for _prune_directory.
+            os.utime(self._path(key))
+        except OSError:
+            pass
+        return result, dependencies
+
+    def _save(self, key: str, result: StepResult, dependencies: Dependencies):
+        if self.directory is None or self.max_entries <= 0:
+            return
+        output_id, output_data = result
+        if output_id == "success":
+            serialized = kubeconfig_output_schema.serialize(output_data)
+        else:
+            serialized = kubeconfig_error_schema.serialize(output_data)
+        import tempfile
+
+        try:
+            os.makedirs(self.directory, mode=0o700, exist_ok=True)
+            # Write to a private temporary file and rename it so that concurrent
+            # processes never observe a partially written entry.
+            fd, tmp_path = tempfile.mkstemp(dir=self.directory, suffix=".tmp")
+            with os.fdopen(fd, "w") as f:
+                json.dump(
+                    {
+                        "output_id": output_id,
+                        "output_data": serialized,
+                        "dependencies": dependencies,
+                    },
+                    f,
+                )
+            os.replace(tmp_path, self._path(key))
+            self._prune_directory()
+        except OSError as e:
+            print(f"Failed to write kubeconfig cache entry: {e}", file=sys.stderr)
+
+    def _prune_directory(self):
+        """
+        Removes the least recently used persisted entries beyond the entry count and
+        byte limits. Entries are touched when loaded, so the modification time orders
+        them by use.
+        """
+        entries = []
+        with os.scandir(self.directory) as it:
+            for entry in it:
+                if not entry.name.endswith(".json"):
+                    continue
+                try:
+                    st = entry.stat()
+                except OSError:
+                    continue
+                entries.append((st.st_mtime_ns, st.st_size, entry.path))
+        entries.sort(reverse=True)
+        total_bytes = 0
+        for count, (_, size, path) in enumerate(entries, 1):
+            total_bytes += size
+            if count > self.max_entries or total_bytes > self.max_bytes:
+                try:
+                    os.unlink(path)
+                except OSError:
+                    pass
+
+
+@functools.lru_cache(maxsize=1)
+def _plugin_version() -> str:
+    with open(os.path.abspath(__file__), "rb") as f:
+        return hashlib.sha256(f.read()).hexdigest()
+
+
+def _dependencies_current(dependencies: Dependencies) -> bool:
+    for path, *signature in dependencies:
+        try:
+            st = os.stat(path)
+        except FileNotFoundError:
+            if signature[2] == -1:
+                continue
+            return False
+        except OSError:
+            return False
+        if [st.st_ino, st.st_mtime_ns, st.st_size] != signature:
+            return False
+    return True
+
+
+def _copy_result(result: StepResult) -> StepResult:
+    output_id, output_data = result
+    output_data = copy.copy(output_data)
+    if isinstance(output_data, SuccessOutput):
+        output_data.connection = copy.copy(output_data.connection)
+    return output_id, output_data
+
+
+def _result_size(result: StepResult) -> int:
+    _, output_data = result
+    if isinstance(output_data, SuccessOutput):
+        values = vars(output_data.connection).values()
+    else:
+        values = vars(output_data).values()
+    return sum(len(v) for v in values if isinstance(v, str))
+
+
+result_cache = ResultCache(
+    max_entries=int(os.environ.get("KUBECONFIG_PLUGIN_CACHE_ENTRIES", "256")),
+    max_bytes=int(
+        os.environ.get("KUBECONFIG_PLUGIN_CACHE_BYTES", str(64 * 1024 * 1024))
+    ),
+    directory=os.environ.get("KUBECONFIG_PLUGIN_CACHE_DIR") or None,
+)
+
+
+# Loader used by the selective parse mode. The libyaml based loader is much faster when
+# PyYAML was built with it.
+class LoadLimits(typing.NamedTuple):
+    max_bytes: int
+    max_nodes: int
+    max_alias_nodes: int
+    max_depth: int
+
+
+load_limits = LoadLimits(
+    max_bytes=int(os.environ.get("KUBECONFIG_PLUGIN_MAX_BYTES", 256 * 1024 * 1024)),
+    max_nodes=int(os.environ.get("KUBECONFIG_PLUGIN_MAX_NODES", 10_000_000)),
+    max_alias_nodes=int(os.environ.get("KUBECONFIG_PLUGIN_MAX_ALIAS_NODES", 100_000)),
+    max_depth=int(os.environ.get("KUBECONFIG_PLUGIN_MAX_DEPTH", 100)),
+)
+
+
+class _GuardedComposer(yaml.composer.Composer):
+    """
+    This is a YAML composer that enforces load_limits while composing, before any
+    Python object is constructed, and raises KubeconfigError when one is exceeded.
+    Nodes reached through an alias count with the size of the aliased node, as they
+    would after expansion, so alias bombs fail after a bounded amount of work.
+    Recursive aliases are rejected. It also keeps documents too deep for libyaml's
+    recursive composer, which crashes the interpreter, away from it.
+    """
+
+    def _reset_guard(self):
+        self.guard_nodes = 0
+        self.guard_alias_nodes = 0
+        self._guard_depth = 0
+        self._guard_weights: typing.Dict[str, int] = {}
+        self._guard_open: typing.Set[str] = set()
+
+    def compose_node(self, parent, index):
+        event = self.peek_event()
+        if isinstance(event, yaml.AliasEvent):
+            self.guard_alias(event.anchor)
+            return super().compose_node(parent, index)
+        start = self.guard_enter(event.anchor)
+        node = super().compose_node(parent, index)
+        self.guard_leave(event.anchor, start)
+        return node
+
+    def guard_enter(self, anchor: typing.Optional[str]) -> int:
+        """
+        Counts a node being composed and returns the node count before it.
+        """
+        self._guard_depth += 1
+        if self._guard_depth > load_limits.max_depth:
+            raise KubeconfigError(
+                f"Kubeconfig is nested deeper than the limit of {load_limits.max_depth}"
+                " levels"
+            )
+        self.guard_count(1)
+        if anchor is not None:
+            self._guard_open.add(anchor)
+        return self.guard_nodes - 1
+
+    def guard_leave(self, anchor: typing.Optional[str], start: int):
+        self._guard_depth -= 1
+        if anchor is not None:
+            self._guard_open.discard(anchor)
+            self._guard_weights[anchor] = self.guard_nodes - start
+
+    def guard_alias(self, anchor: str):
+        if anchor in self._guard_open:
+            raise KubeconfigError(f"Kubeconfig contains a recursive alias *{anchor}")
+        weight = self._guard_weights.get(anchor, 1)
+        self.guard_alias_nodes += weight
+        if self.guard_alias_nodes > load_limits.max_alias_nodes:
+            raise KubeconfigError(
+                "Kubeconfig aliases expand to more than the limit of"
+                f" {load_limits.max_alias_nodes} nodes"
+            )
+        self.guard_count(weight)
+
+    def guard_count(self, nodes: int):
+        self.guard_nodes += nodes
+        if self.guard_nodes > load_limits.max_nodes:
+            raise KubeconfigError(
+                f"Kubeconfig has more than the limit of {load_limits.max_nodes} nodes"
+            )
+
+
+class _GuardedSafeLoader(_GuardedComposer, yaml.SafeLoader):
+    def __init__(self, stream):
+        yaml.SafeLoader.__init__(self, stream)
+        self._reset_guard()
+
+
+if hasattr(yaml, "CSafeLoader"):
+
+    class _GuardedCSafeLoader(_GuardedComposer, yaml.CSafeLoader):
+        """
+        This loader composes libyaml's events in Python, so that load_limits apply.
+        """
+
+        def __init__(self, stream):
+            yaml.CSafeLoader.__init__(self, stream)
+            yaml.composer.Composer.__init__(self)
+            self._reset_guard()
+
+    _SelectiveLoader = _GuardedCSafeLoader
+else:
+    _SelectiveLoader = _GuardedSafeLoader
+
+# Either "selective", which only builds the objects for the current context, or "full",
+# which loads the whole document with the pure Python loader, like yaml.safe_load.
+parse_mode = os.environ.get("KUBECONFIG_PLUGIN_PARSE_MODE", "selective")
+
+
+def load_kubeconfig(kubeconfig_text: str) -> typing.Any:
+    """
+    Loads the kubeconfig text. In the selective parse mode only the current context,
+    cluster and user entries are turned into Python objects, everything else is
+    skipped at the YAML event level. Inputs the selective parser cannot handle fall
+    back to the equivalent of ``yaml.safe_load`` so that results and error messages
+    are unchanged. Both enforce load_limits.
+    """
+    _check_size(kubeconfig_text)
+    kubeconfig = _load_json(kubeconfig_text)
+    if kubeconfig is not None:
+        return kubeconfig
+    if parse_mode == "selective":
+        try:
+            return _load_selective(kubeconfig_text)
+        except KubeconfigError:
+            raise
+        except Exception:
+            pass
+    return load_yaml(kubeconfig_text)
+
+
+def load_yaml(text: str, loader_class: type = _GuardedSafeLoader) -> typing.Any:
+    """
+    Loads a single YAML document like yaml.safe_load, raising KubeconfigError when
+    it exceeds load_limits.
+    """
+    _check_size(text)
+    loaded = _load_json(text)
+    if loaded is not None:
+        return loaded
+    loader = loader_class(text)
+    try:
+        return loader.get_single_data()
+    finally:
+        loader.dispose()
+
+
+_json_object_start = re.compile(r"\s*\{")
+
+
+def _load_json(text: str) -> typing.Optional[typing.Dict[str, typing.Any]]:
+    """
+    Decodes text that is a JSON object, as written by kubectl and oc with -o json,
+    with orjson when it is installed or the json module otherwise. JSON is valid
+    YAML, so this only skips the slower YAML parser. Returns None, leaving the text
+    to the YAML loader, for anything the decoder rejects and for documents the YAML
+    loader could read differently or reject, so results and errors are unchanged.
+    """
+    if not _json_object_start.match(text) or not _yaml_compatible_json_text(text):
+        return None
+    try:
+        loaded = _json_decoder()(text)
+    except Exception:
+        return None
+    if not isinstance(loaded, dict) or not _yaml_compatible_json(loaded):
+        return None
+    return loaded
+
+
+# Without backslashes, a quote followed by whitespace and a colon can only end a key.
+_json_space_before_colon = re.compile(r'"[ \t\r\n]+:')
+
+
+def _yaml_compatible_json_text(text: str) -> bool:
+    """
+    Checks for text YAML reads differently from JSON: escapes, such as surrogate
+    pairs, some non-ASCII characters and DEL, tabs, which the pure Python YAML
+    scanner rejects at the start of a line, and keys separated from their colon by
+    whitespace, which YAML does not read as keys across lines.
+    """
+    return (
+        text.isascii()
+        and "\\" not in text
+        and "\x7f" not in text
+        and "\t" not in text
+        and not _json_space_before_colon.search(text)
+    )
+
+
+@functools.lru_cache(maxsize=1)
+def _json_decoder() -> typing.Callable[[str], typing.Any]:
+    try:
+        import orjson
+    except ImportError:
+        return json.loads
+    return orjson.loads
 
 
-@plugin.step(
+# YAML only reads keys of up to 1024 characters, including quotes, as keys.
+_MAX_JSON_KEY_LENGTH = 1000
+
+
+def _yaml_compatible_json(document: typing.Dict[str, typing.Any]) -> bool:
+    """
+    Checks a decoded JSON document for values the YAML loader reads differently:
+    floats, which YAML 1.1 reads as strings unless they have a dot and a signed
+    exponent, and long keys. Documents exceeding the load_limits fail the check
+    too, so that the YAML loader reports the limit exactly as it would. Nodes and
+    depth are counted the way the guarded YAML composer counts them.
+    """
+    nodes = 1
+    stack = [(document, 1)]
+    while stack:
+        container, depth = stack.pop()
+        if type(container) is dict:
+            nodes += 2 * len(container)
+            if container and len(max(container, key=len)) > _MAX_JSON_KEY_LENGTH:
+                return False
+            children = container.values()
+        else:
+            nodes += len(container)
+            children = container
+        if container and depth >= load_limits.max_depth:
+            return False
+        if nodes > load_limits.max_nodes:
+            return False
+        for child in children:
+            child_type = type(child)
+            if child_type is dict or child_type is list:
+                stack.append((child, depth + 1))
+            elif child_type is float:
+                return False
+    return True
+
+
+def _check_size(text: str):
+    # Strings that are ASCII, as kubeconfigs usually are, know their UTF-8 size.
+    _check_byte_size(len(text) if text.isascii() else len(text.encode("utf-8")))
+
+
+def _check_byte_size(size: int):
+    if size > load_limits.max_bytes:
+        raise KubeconfigError(
+            f"Kubeconfig is {size} bytes, more than the limit of"
+            f" {load_limits.max_bytes} bytes"
+        )
+
+
+class _SelectiveParseError(Exception):
+    """
+    This exception signals that the input needs the full loader.
+    """
+
+
+def _load_selective(kubeconfig_text: str) -> typing.Dict[str, typing.Any]:
+    # The first pass builds the small top-level values and the contexts and skips the
+    # clusters and users, which is where the large certificate blobs live.
+    kubeconfig = _selective_pass(kubeconfig_text, lambda key: key not in _blob_sections)
+    if "kind" not in kubeconfig or "current-context" not in kubeconfig:
+        return kubeconfig
+
+    # The current context can be anywhere in the document, so the cluster and user
+    # names are only known after the first pass.
+    wanted = {"clusters": None, "users": None}
+    context_entries = kubeconfig.get("contexts")
+    if isinstance(context_entries, list):
+        for entry in context_entries:
+            if (
+                isinstance(entry, dict)
+                and entry.get("name") == kubeconfig["current-context"]
+            ):
+                context = entry.get("context")
+                if isinstance(context, dict):
+                    wanted = {
+                        "clusters": context.get("cluster"),
+                        "users": context.get("user"),
+                    }
+    kubeconfig.update(
+        _selective_pass(
+            kubeconfig_text, lambda key: key in _blob_sections, wanted=wanted
+        )
+    )
+    return kubeconfig
+
+
+_blob_sections = ("clusters", "users")
+
+
+def _selective_pass(
+    kubeconfig_text: str,
+    include: typing.Callable[[typing.Any], bool],
+    wanted: typing.Optional[typing.Dict[str, typing.Any]] = None,
+) -> typing.Dict[str, typing.Any]:
+    """
+    Walks the YAML events of a single document with a top-level mapping and builds the
+    values of the keys accepted by ``include``. Entries of the sections in ``wanted``
+    are only built when their name matches the wanted name or they have no name, so
+    that name errors are still reported.
+    """
+    loader = _SelectiveLoader(kubeconfig_text)
+    anchors: typing.Dict[str, yaml.Node] = {}
+    result = {}
+    try:
+        loader.get_event()
+        if not loader.check_event(yaml.DocumentStartEvent):
+            raise _SelectiveParseError()
+        loader.get_event()
+        if not loader.check_event(yaml.MappingStartEvent):
+            raise _SelectiveParseError()
+        loader.guard_enter(loader.get_event().anchor)
+        while not loader.check_event(yaml.MappingEndEvent):
+            key_node = _compose_event_node(loader, anchors)
+            if not isinstance(key_node, yaml.ScalarNode):
+                raise _SelectiveParseError()
+            key = loader.construct_object(key_node, deep=True)
+            if not include(key):
+                _skip_event_node(loader)
+            elif (
+                wanted is not None
+                and key in wanted
+                and loader.check_event(yaml.SequenceStartEvent)
+            ):
+                result[key] = _select_entries(loader, anchors, wanted[key])
+            else:
+                result[key] = loader.construct_object(
+                    _compose_event_node(loader, anchors), deep=True
+                )
+        loader.get_event()
+        loader.get_event()
+        if not loader.check_event(yaml.StreamEndEvent):
+            raise _SelectiveParseError()
+        return result
+    finally:
+        loader.dispose()
+
+
+def _select_entries(loader, anchors, name: typing.Any) -> typing.List[typing.Any]:
+    loader.get_event()
+    entries = []
+    while not loader.check_event(yaml.SequenceEndEvent):
+        node = _compose_event_node(loader, anchors)
+        if not isinstance(node, yaml.MappingNode):
+            raise _SelectiveParseError()
+        name_nodes = [
+            value
+            for key, value in node.value
+            if isinstance(key, yaml.ScalarNode) and key.value == "name"
+        ]
+        if not name_nodes or loader.construct_object(name_nodes[-1], deep=True) == name:
+            entries.append(loader.construct_object(node, deep=True))
+    loader.get_event()
+    return entries
+
+
+def _compose_event_node(loader, anchors: typing.Dict[str, yaml.Node]) -> yaml.Node:
+    """
+    Composes the next node from the loader's events. libyaml based loaders do not
+    expose their composer for single nodes, so this mirrors yaml.composer.Composer.
+    """
+    event = loader.get_event()
+    if isinstance(event, yaml.AliasEvent):
+        if event.anchor not in anchors:
+            # The anchor was in a skipped part of the document.
+            raise _SelectiveParseError()
+        loader.guard_alias(event.anchor)
+        return anchors[event.anchor]
+    start = loader.guard_enter(event.anchor)
+    if isinstance(event, yaml.ScalarEvent):
+        tag = event.tag
+        if tag is None or tag == "!":
+            tag = loader.resolve(yaml.ScalarNode, event.value, event.implicit)
+        node = yaml.ScalarNode(
+            tag, event.value, event.start_mark, event.end_mark, style=event.style
+        )
+    elif isinstance(event, yaml.SequenceStartEvent):
+        tag = event.tag
+        if tag is None or tag == "!":
+            tag = loader.resolve(yaml.SequenceNode, None, event.implicit)
+        node = yaml.SequenceNode(
+            tag, [], event.start_mark, None, flow_style=event.flow_style
+        )
+        if event.anchor is not None:
+            anchors[event.anchor] = node
+        while not loader.check_event(yaml.SequenceEndEvent):
+            node.value.append(_compose_event_node(loader, anchors))
+        node.end_mark = loader.get_event().end_mark
+    elif isinstance(event, yaml.MappingStartEvent):
+        tag = event.tag
+        if tag is None or tag == "!":
+            tag = loader.resolve(yaml.MappingNode, None, event.implicit)
+        node = yaml.MappingNode(
+            tag, [], event.start_mark, None, flow_style=event.flow_style
+        )
+        if event.anchor is not None:
+            anchors[event.anchor] = node
+        while not loader.check_event(yaml.MappingEndEvent):
+            key = _compose_event_node(loader, anchors)
+            node.value.append((key, _compose_event_node(loader, anchors)))
+        node.end_mark = loader.get_event().end_mark
+    else:
+        raise _SelectiveParseError()
+    loader.guard_leave(event.anchor, start)
+    if event.anchor is not None:
+        anchors[event.anchor] = node
+    return node
+
+
+def _skip_event_node(loader):
+    """
+    Skips the events of the next top-level value. Its nodes count towards the node
+    and depth limits, checked inline as this is the hot path of the selective parse.
+    Aliases are not expanded here and count as a single node.
+    """
+    depth = 0
+    events = 0
+    # The top-level mapping and its values are at depth 1 and 2.
+    max_depth = load_limits.max_depth - 1
+    while True:
+        event = loader.get_event()
+        events += 1
+        if isinstance(event, (yaml.SequenceStartEvent, yaml.MappingStartEvent)):
+            depth += 1
+            if depth > max_depth:
+                loader.guard_count(events)
+                raise KubeconfigError(
+                    "Kubeconfig is nested deeper than the limit of"
+                    f" {load_limits.max_depth} levels"
+                )
+        elif isinstance(event, (yaml.SequenceEndEvent, yaml.MappingEndEvent)):
+            depth -= 1
+            events -= 1
+        elif depth >= max_depth:
+            raise KubeconfigError(
+                "Kubeconfig is nested deeper than the limit of"
+                f" {load_limits.max_depth} levels"
+            )
+        if depth == 0:
+            loader.guard_count(events)
+            return
+
+
+class KubeconfigError(Exception):
+    """
+    This exception is raised for kubeconfig content problems. Its message is returned
+    to the user as the step error.
+    """
+
+
+def _unexpected_error(e: Exception) -> ErrorOutput:
+    """
+    Returns the step error for an unexpected exception, including its traceback.
+    Call this from an except block.
+    """
+    import traceback
+
+    return ErrorOutput(
+        f"Failure to parse kubeconfig. Exception: {e}. Traceback: "
+        + traceback.format_exc()
+    )
+
+
+class KubeconfigIndex:
+    """
+    This is a name to entry index over the contexts, clusters and users sections of a
+    parsed kubeconfig. Each section is walked once, on first use, and every name seen
+    more than once is recorded in ``duplicates``. As with a linear scan, the last
+    entry with a given name wins. Without require_sections, missing sections are
+    treated as empty, as kubectl does for kubeconfig fragments.
+    """
+
+    # Per section: the error when the section is missing and the error when an entry
+    # has no name.
+    _sections = {
+        "contexts": (
+            "'contexts' field missing from kubeconfig.",
+            "{} section missing from context entry in kubeconfig",
+        ),
+        "clusters": (
+            "Clusters section missing from kubeconfig file",
+            "{} section missing from clusters entry in kubeconfig",
+        ),
+        "users": (
+            "'users' section not found in kubeconfig",
+            "{} section in the users section not found in the kubeconfig",
+        ),
+    }
+
+    def __init__(
+        self, kubeconfig: typing.Dict[str, typing.Any], require_sections: bool = True
+    ):
+        self._kubeconfig = kubeconfig
+        self._require_sections = require_sections
+        self._indexes: typing.Dict[str, typing.Dict[str, typing.Any]] = {}
+        self.duplicates: typing.Dict[str, typing.Set[str]] = {}
+
+    def context(self, name: str) -> typing.Optional[typing.Dict[str, typing.Any]]:
+        return self._lookup("contexts", name)
+
+    def cluster(self, name: str) -> typing.Optional[typing.Dict[str, typing.Any]]:
+        return self._lookup("clusters", name)
+
+    def user(self, name: str) -> typing.Optional[typing.Dict[str, typing.Any]]:
+        return self._lookup("users", name)
+
+    def _lookup(
+        self, section: str, name: typing.Any
+    ) -> typing.Optional[typing.Dict[str, typing.Any]]:
+        index = self.section(section)
+        try:
+            return index.get(name)
+        except TypeError:
+            # A list or mapping as the name can't match any entry, as with the scan.
+            return None
+
+    def section(self, section: str) -> typing.Dict[str, typing.Any]:
+        index = self._indexes.get(section)
+        if index is None:
+            index = self._build(section)
+            self._indexes[section] = index
+        return index
+
+    def _build(self, section: str) -> typing.Dict[str, typing.Any]:
+        missing_section, missing_name = self._sections[section]
+        try:
+            entries = self._kubeconfig[section]
+        except KeyError:
+            if self._require_sections:
+                raise KubeconfigError(missing_section)
+            entries = None
+        if entries is None and not self._require_sections:
+            entries = []
+        index = {}
+        duplicates = set()
+        for entry in entries:
+            try:
+                name = entry["name"]
+            except KeyError as e:
+                raise KubeconfigError(missing_name.format(e))
+            try:
+                if name in index:
+                    duplicates.add(name)
+            except TypeError:
+                # Entries named by a list or mapping can't be referenced by name.
+                continue
+            index[name] = entry
+        if duplicates:
+            self.duplicates[section] = duplicates
+            print(
+                f"Warning: duplicate {section} names in kubeconfig:"
+                f" {', '.join(sorted(map(str, duplicates)))}"
+            )
+        return index
+
+
+schema_snapshot_path = os.environ.get(
+    "KUBECONFIG_PLUGIN_SCHEMA_SNAPSHOT",
+    os.path.join(
+        os.path.dirname(os.path.abspath(__file__)), "kubeconfig_plugin.schema"
+    ),
+)
+# Pickled schemas of the snapshot by step id, loaded on first use. A new snapshot is
+# built from introspected schemas, never from an existing snapshot.
+_schema_snapshot: typing.Optional[typing.Dict[str, bytes]] = (
+    {} if __name__ == "__main__" and "--build-schema-snapshot" in sys.argv else None
+)
+
+
+def step(
+    id: str,
+    name: str,
+    description: str,
+    outputs: typing.Dict[str, type],
+) -> typing.Callable[[typing.Callable], schema.StepType]:
+    """
+    This is plugin.step, except that the input and output schemas are taken from the
+    schema snapshot when it was built from this exact source. The snapshot is built
+    with plugin.step, so its checks have passed for that source.
+    """
+
+    def step_decorator(func: typing.Callable) -> schema.StepType:
+        schemas = _snapshot_schemas(id)
+        if schemas is None:
+            return plugin.step(id, name, description, outputs)(func)
+        input_schema, output_schemas = schemas
+        return schema.StepType(
+            id,
+            display=schema.DisplayValue(name=name, description=description),
+            input=input_schema,
+            outputs={
+                output_id: schema.StepOutputType(output_schemas[output_id])
+                for output_id in outputs
+            },
+            handler=func,
+        )
+
+    return step_decorator
+
+
+def _snapshot_schemas(
+    step_id: str,
+) -> typing.Optional[
+    typing.Tuple[schema.ScopeType, typing.Dict[str, schema.ScopeType]]
+]:
+    global _schema_snapshot
+    if _schema_snapshot is None:
+        _schema_snapshot = _load_schema_snapshot(schema_snapshot_path)
+    data = _schema_snapshot.get(step_id)
+    if data is None:
+        return None
+    import io
+
+    # The C unpickler alone imports in a fraction of the time of the pickle module.
+    import _pickle
+
+    unpickler = _pickle.Unpickler(io.BytesIO(data))
+    # Classes are stored by module and name, so that the snapshot works whether this
+    # module runs as __main__ or is imported.
+    unpickler.persistent_load = _snapshot_class
+    try:
+        return unpickler.load()
+    except Exception as e:
+        print(
+            f"Warning: ignoring the schema snapshot of {step_id}: {e}", file=sys.stderr
+        )
+        return None
+
+
+def _snapshot_class(class_id: typing.Tuple[str, str]) -> type:
+    import importlib
+
+    module, name = class_id
+    return getattr(importlib.import_module(module), name)
+
+
+def _snapshot_source_hash() -> str:
+    """
+    Hashes the plugin modules, the Python version and the SDK schema module, which
+    together determine the step schemas.
+    """
+    digest = hashlib.sha256()
+    directory = os.path.dirname(os.path.abspath(__file__))
+    for name in sorted(os.listdir(directory)):
+        if not (name.startswith("kubeconfig_") and name.endswith(".py")):
+            continue
+        with open(os.path.join(directory, name), "rb") as f:
+            digest.update(name.encode() + b"\0" + f.read())
+    stat = os.stat(schema.__file__)
+    digest.update(f"{sys.version_info[:2]}:{stat.st_size}".encode())
+    return digest.hexdigest()
+
+
+def _load_schema_snapshot(path: str) -> typing.Dict[str, bytes]:
+    if not os.path.exists(path):
+        return {}
+    import _pickle
+
+    try:
+        with open(path, "rb") as f:
+            snapshot = _pickle.load(f)
+        source = snapshot["source"]
+        steps = snapshot["steps"]
+    except Exception as e:
+        print(f"Warning: ignoring schema snapshot {path}: {e}", file=sys.stderr)
+        return {}
+    if source != _snapshot_source_hash():
+        print(
+            f"Warning: ignoring schema snapshot {path} built from another source",
+            file=sys.stderr,
+        )
+        return {}
+    return steps
+
+
+def build_schema_snapshot(path: str):
+    """
+    Saves the input and output schemas of every step with the hash of the plugin
+    source to path, for loading at startup instead of introspecting the dataclasses.
+    """
+    import io
+    import pickle
+    import tempfile
+
+    plugin_modules = {module for _, module, _ in _steps}
+
+    def persistent_id(obj):
+        if not isinstance(obj, type):
+            return None
+        module = obj.__module__
+        if sys.modules.get(module) is sys.modules.get("kubeconfig_plugin"):
+            module = "kubeconfig_plugin"
+        if module in plugin_modules:
+            return module, obj.__qualname__
+        return None
+
+    steps = {}
+    for step_id, step_schema in _plugin_schema([]).steps.items():
+        buffer = io.BytesIO()
+        pickler = pickle.Pickler(buffer, pickle.HIGHEST_PROTOCOL)
+        pickler.persistent_id = persistent_id
+        pickler.dump(
+            (
+                step_schema.input,
+                {
+                    output_id: output.schema
+                    for output_id, output in step_schema.outputs.items()
+                },
+            )
+        )
+        steps[step_id] = buffer.getvalue()
+    fd, tmp_path = tempfile.mkstemp(
+        dir=os.path.dirname(os.path.abspath(path)), suffix=".tmp"
+    )
+    try:
+        with os.fdopen(fd, "wb") as f:
+            pickle.dump({"source": _snapshot_source_hash(), "steps": steps}, f)
+        os.chmod(tmp_path, 0o644)
+        os.replace(tmp_path, path)
+    except BaseException:
+        os.unlink(tmp_path)
+        raise
+
+
+@step(
     id="kubeconfig",
     name="kubeconfig plugin",
     description=(
@@ -120,24 +1224,305 @@ def extract_kubeconfig(
 ) -> typing.Tuple[str, typing.Union[SuccessOutput, ErrorOutput]]:
     print("==>> Parsing and extracting kubernetes cluster details ...")
 
+    if params.metrics or params.profile is not None:
+        return _extract_instrumented(params)
+    try:
+        kubeconfig_text, base_dir = input_kubeconfig(params)
+    except KubeconfigError as e:
+        return "error", ErrorOutput(str(e))
+    key = result_cache.key(kubeconfig_text, base_dir)
+    cached = result_cache.get(key)
+    if cached is not None:
+        return cached
+    result, dependencies = _extract_tracked(kubeconfig_text, base_dir)
+    result_cache.put(key, result, dependencies)
+    return result
+
+
+# The schemas of the kubeconfig step, which the step decorator already has.
+kubeconfig_input_schema = extract_kubeconfig.input
+kubeconfig_output_schema = extract_kubeconfig.outputs["success"]
+kubeconfig_error_schema = extract_kubeconfig.outputs["error"]
+
+
+def input_kubeconfig(params: InputParams) -> typing.Tuple[str, typing.Optional[str]]:
+    """
+    Returns the kubeconfig text of the step input from whichever of the inline,
+    compressed and path fields is set, and the directory its relative paths resolve
+    against: the file's directory for a path, or None for config_dir.
+    """
+    sources = [
+        source
+        for source in (
+            params.kubeconfig,
+            params.kubeconfig_compressed,
+            params.kubeconfig_path,
+        )
+        if source is not None
+    ]
+    if len(sources) != 1:
+        raise KubeconfigError(
+            "Exactly one of kubeconfig, kubeconfig_compressed and kubeconfig_path"
+            " must be set"
+        )
+    if params.kubeconfig is not None:
+        return params.kubeconfig, None
+    if params.kubeconfig_compressed is not None:
+        return decompress_kubeconfig(params.kubeconfig_compressed), None
+    path = config_volume_path(params.kubeconfig_path, "kubeconfig_path")
+    return read_kubeconfig_file(path), os.path.dirname(path)
+
+
+def config_volume_path(path: str, field: str) -> str:
+    """
+    Resolves a path given in the step input against config_dir, following symbolic
+    links, and rejects paths that end up outside of it.
+    """
+    root = os.path.realpath(config_dir)
+    resolved = os.path.realpath(os.path.join(root, path))
+    if os.path.commonpath([root, resolved]) != root:
+        raise KubeconfigError(f"{field} {path} is outside of {config_dir}")
+    return resolved
+
+
+max_decompressed_chars = int(
+    os.environ.get("KUBECONFIG_PLUGIN_MAX_DECOMPRESSED_CHARS", 256 * 1024 * 1024)
+)
+_DECOMPRESS_CHUNK = 1024 * 1024
+
+
+def decompress_kubeconfig(encoded: str) -> str:
+    """
+    Decodes a base64 encoded gzip or zstd compressed kubeconfig. The payload is
+    decompressed and decoded as a stream in chunks, so only the compressed data and
+    the resulting text are held in full, and output beyond max_decompressed_chars is
+    rejected.
+    """
     try:
+        data = binascii.a2b_base64(encoded)
+    except binascii.Error as e:
+        raise KubeconfigError(f"Invalid base64 in kubeconfig_compressed: {e}")
+    import io
+
+    if data.startswith(b"\x1f\x8b"):
+        import gzip
+
+        stream = gzip.GzipFile(fileobj=io.BytesIO(data))
+    elif data.startswith(b"\x28\xb5\x2f\xfd"):
         try:
-            kubeconfig = yaml.safe_load(params.kubeconfig)
-        except Exception as e:
-            return "error", ErrorOutput(
-                "Exception occurred while loading YAML. Input is not valid YAML."
-                f" Exception: {e}"
+            import zstandard
+        except ImportError:
+            raise KubeconfigError(
+                "kubeconfig_compressed is zstd compressed, which needs the"
+                " zstandard package"
             )
+        stream = zstandard.ZstdDecompressor().stream_reader(io.BytesIO(data))
+    else:
+        raise KubeconfigError("kubeconfig_compressed is not gzip or zstd compressed")
+
+    parts = []
+    size = 0
+    try:
+        with io.TextIOWrapper(stream, encoding="utf-8", newline="") as text:
+            while True:
+                part = text.read(_DECOMPRESS_CHUNK)
+                if not part:
+                    break
+                size += len(part)
+                if size > max_decompressed_chars:
+                    raise KubeconfigError(
+                        "kubeconfig_compressed decompresses to more than"
+                        f" {max_decompressed_chars} characters"
+                    )
+                parts.append(part)
+    except KubeconfigError:
+        raise
+    except Exception as e:
+        raise KubeconfigError(f"Failed to decompress kubeconfig_compressed: {e}")
+    return "".join(parts)
+
+
+def read_kubeconfig_file(path: str) -> str:
+    """
+    Reads a kubeconfig file through mmap, decoding the mapped pages directly into
+    the text without an intermediate bytes copy. Files over the size limit are
+    rejected before they are mapped.
+    """
+    try:
+        with open(path, "rb") as f:
+            size = os.fstat(f.fileno()).st_size
+            if size == 0:
+                return ""
+            _check_byte_size(size)
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+                return str(mapped, "utf-8")
+    except OSError as e:
+        raise KubeconfigError(f"Failed to read kubeconfig file {path}: {e.strerror}")
+    except UnicodeDecodeError as e:
+        raise KubeconfigError(f"Failed to read kubeconfig file {path}: {e}")
+
+
+class _PhaseRecorder:
+    """
+    This records the monotonic time spent in each phase of an instrumented
+    extraction. Each mark closes the phase that started at the previous mark.
+    """
+
+    def __init__(self):
+        self.phases: typing.Dict[str, float] = {}
+        self.restart()
+
+    def restart(self):
+        self._last = time.perf_counter()
+
+    def mark(self, phase: str):
+        now = time.perf_counter()
+        self.phases[phase] = self.phases.get(phase, 0.0) + (now - self._last) * 1000
+        self._last = now
+
+
+# Only set for instrumented invocations, so uninstrumented ones pay a single lookup
+# per phase.
+_phase_recorder: contextvars.ContextVar[typing.Optional[_PhaseRecorder]] = (
+    contextvars.ContextVar("_phase_recorder", default=None)
+)
+
+
+def _mark_phase(phase: str):
+    recorder = _phase_recorder.get()
+    if recorder is not None:
+        recorder.mark(phase)
+
+
+def _extract_instrumented(params: InputParams) -> StepResult:
+    """
+    Runs the kubeconfig step with per-phase timing and, if requested, a profiler, and
+    attaches the metrics to the output.
+    """
+    recorder = _PhaseRecorder()
+    token = _phase_recorder.set(recorder)
+    profile_report = None
+    kubeconfig_text = ""
+    try:
+        kubeconfig_text, base_dir = input_kubeconfig(params)
+        recorder.mark("input")
+        if params.profile is None:
+            key = result_cache.key(kubeconfig_text, base_dir)
+            result = result_cache.get(key)
+            recorder.mark("cache_lookup")
+            if result is None:
+                result, dependencies = _extract_tracked(kubeconfig_text, base_dir)
+                result_cache.put(key, result, dependencies)
+        else:
+            result, profile_report = _profile(params.profile, kubeconfig_text, base_dir)
+    except KubeconfigError as e:
+        result = "error", ErrorOutput(str(e))
+    finally:
+        _phase_recorder.reset(token)
 
-        # Kubeconfig files have the kind set as Config
+    output_id, output_data = result
+    recorder.restart()
+    if output_id == "success":
+        serialized = kubeconfig_output_schema.serialize(output_data)
+    else:
+        serialized = kubeconfig_error_schema.serialize(output_data)
+    output_bytes = len(json.dumps(serialized).encode("utf-8"))
+    recorder.mark("serialize")
+    output_data.metrics = Metrics(
+        phases=recorder.phases,
+        input_bytes=len(kubeconfig_text.encode("utf-8")),
+        output_bytes=output_bytes,
+        profile=profile_report,
+    )
+    return output_id, output_data
+
+
+def _profile(
+    mode: ProfileMode, kubeconfig_text: str, base_dir: typing.Optional[str]
+) -> typing.Tuple[StepResult, str]:
+    import io
+
+    report = io.StringIO()
+    if mode == ProfileMode.CPROFILE:
+        import cProfile
+        import pstats
+
+        profiler = cProfile.Profile()
+        profiler.enable()
         try:
-            kind = kubeconfig["kind"]
-        except KeyError:
-            return "error", ErrorOutput(
-                "The provided file is not a kubeconfig file (missing 'kind' field)"
-            )
-        if kind != "Config":
-            return "error", ErrorOutput("The provided file is not a kubeconfig file")
+            result, _ = _extract_tracked(kubeconfig_text, base_dir)
+        finally:
+            profiler.disable()
+        pstats.Stats(profiler, stream=report).sort_stats("cumulative").print_stats(30)
+    else:
+        import tracemalloc
+
+        tracemalloc.start()
+        try:
+            result, _ = _extract_tracked(kubeconfig_text, base_dir)
+            snapshot = tracemalloc.take_snapshot()
+            _, peak = tracemalloc.get_traced_memory()
+        finally:
+            tracemalloc.stop()
+        report.write(f"Peak traced memory: {peak} bytes\n")
+        for stat in snapshot.statistics("lineno")[:20]:
+            report.write(f"{stat}\n")
+    return result, report.getvalue()
+
+
+class _ExtractionDependencies:
+    """
+    This collects what the result of an extraction in progress depends on besides the
+    kubeconfig text: the signatures of the credential files read, whether the result
+    may be cached at all, and when the exec credentials it got need a refresh.
+    """
+
+    def __init__(self):
+        self.files: typing.List[FileSignature] = []
+        self.cacheable = True
+        self.expires: typing.Optional[float] = None
+
+
+_extraction_dependencies: contextvars.ContextVar[
+    typing.Optional[_ExtractionDependencies]
+] = contextvars.ContextVar("_extraction_dependencies", default=None)
+
+
+def _extract_tracked(
+    kubeconfig_text: str, base_dir: typing.Optional[str] = None
+) -> typing.Tuple[StepResult, typing.Optional[Dependencies]]:
+    """
+    Extracts the kubeconfig and also returns the signatures of the credential files
+    the result depends on, or None if the result must not be cached.
+    """
+    result, dependencies = _extract_with_dependencies(kubeconfig_text, base_dir)
+    if not dependencies.cacheable:
+        return result, None
+    return result, tuple(dependencies.files)
+
+
+def _extract_with_dependencies(
+    kubeconfig_text: str, base_dir: typing.Optional[str] = None
+) -> typing.Tuple[StepResult, _ExtractionDependencies]:
+    dependencies = _ExtractionDependencies()
+    token = _extraction_dependencies.set(dependencies)
+    try:
+        result = _extract_kubeconfig(kubeconfig_text, base_dir)
+    finally:
+        _extraction_dependencies.reset(token)
+    return result, dependencies
+
+
+def _extract_kubeconfig(
+    kubeconfig_text: str, base_dir: typing.Optional[str] = None
+) -> StepResult:
+    """
+    Parses the kubeconfig text and extracts the current context's connection. This
+    is the uncached extraction logic behind the kubeconfig step. Relative credential
+    file paths are resolved against base_dir, which defaults to config_dir.
+    """
+    try:
+        kubeconfig = _load_config(kubeconfig_text)
 
         # Get the current context, then search for the values for that context in the
         # context section
@@ -148,125 +1533,717 @@ def extract_kubeconfig(
                 " Please set a current context to use."
             )
 
-        try:
-            contexts = kubeconfig["contexts"]
-        except KeyError:
-            return "error", ErrorOutput("'contexts' field missing from kubeconfig.")
+        return _extract_connection(
+            KubeconfigIndex(kubeconfig), current_context, base_dir
+        )
+    except KubeconfigError as e:
+        return "error", ErrorOutput(str(e))
+    except Exception as e:
+        # This is the catch-all case.
+        # The goal is for all other errors to be addressed individually.
+        return "error", _unexpected_error(e)
 
-        context = None
-        for ctx in contexts:
-            try:
-                if ctx["name"] == current_context:
-                    context = ctx["context"]
-            except KeyError as e:
-                return "error", ErrorOutput(
-                    f"{e} section missing from context entry in kubeconfig"
-                )
-        if context is None:
-            return "error", ErrorOutput(
-                f"Failed to find a context named {current_context} in the kubeconfig"
-                " file."
-            )
 
-        try:
-            current_cluster = context["cluster"]
-            current_user = context["user"]
-        except KeyError as e:
-            return "error", ErrorOutput(
-                f"{e} field missing from kubeconfig current context"
-            )
+def _load_config(
+    kubeconfig_text: str, full: bool = False
+) -> typing.Dict[str, typing.Any]:
+    """
+    Loads the kubeconfig text and checks that it is a kubeconfig document, raising
+    KubeconfigError otherwise. Unless full is set, the current context's entries may
+    be the only ones loaded.
+    """
+    try:
+        if full:
+            kubeconfig = load_yaml(kubeconfig_text, _SelectiveLoader)
+        else:
+            kubeconfig = load_kubeconfig(kubeconfig_text)
+        _mark_phase("load")
+    except KubeconfigError:
+        raise
+    except Exception as e:
+        raise KubeconfigError(
+            "Exception occurred while loading YAML. Input is not valid YAML."
+            f" Exception: {e}"
+        )
 
-        # Now find the cluster for that current context
-        try:
-            clusters = kubeconfig["clusters"]
-        except KeyError:
-            return "error", ErrorOutput("Clusters section missing from kubeconfig file")
+    # Kubeconfig files have the kind set as Config
+    try:
+        kind = kubeconfig["kind"]
+    except KeyError:
+        raise KubeconfigError(
+            "The provided file is not a kubeconfig file (missing 'kind' field)"
+        )
+    if kind != "Config":
+        raise KubeconfigError("The provided file is not a kubeconfig file")
+    return kubeconfig
 
-        cluster = None
-        for cl in clusters:
-            try:
-                if cl["name"] == current_cluster:
-                    try:
-                        cluster = cl["cluster"]
-                    except KeyError:
-                        return "error", ErrorOutput(
-                            "cluster section missing from section of current cluster"
-                            f" {current_cluster}"
-                        )
-            except KeyError as e:
-                return "error", ErrorOutput(
-                    f"{e} section missing from clusters entry in kubeconfig"
-                )
-        if cluster is None:
-            return "error", ErrorOutput(
-                f"Failed to find a cluster named {current_cluster} in the kubeconfig"
-                " file."
-            )
 
-        # Now find the user for current context's user for authentication.
-        try:
-            users = kubeconfig["users"]
-        except KeyError:
-            return "error", ErrorOutput("'users' section not found in kubeconfig")
+class _ResolveError(KubeconfigError):
+    pass
 
-        user = None
-        for u in users:
-            try:
-                if u["name"] == current_user:
-                    user = u["user"]
-            except KeyError as e:
-                return "error", ErrorOutput(
-                    f"{e} section in the users section not found in the kubeconfig"
-                )
-        if user is None:
-            return "error", ErrorOutput(
-                f"Failed to find a user named {current_user} in the kubeconfig file."
-            )
 
-        # Ensure the server is in the kubeconfig
-        try:
-            server = cluster["server"]
-        except KeyError:
-            return "error", ErrorOutput(
-                f"Failed to find server in cluster kubeconfig file {current_cluster}"
-                " cluster section"
-            )
-        # Populate output values from the user and server sections.
-        output = SuccessOutput(
-            Connection(host=server),
+def _resolve_context(
+    index: typing.Union[KubeconfigIndex, "KubeconfigMerge"], current_context: typing.Any
+) -> typing.Tuple[
+    typing.Dict[str, typing.Any],
+    typing.Dict[str, typing.Any],
+    typing.Dict[str, typing.Any],
+]:
+    """
+    Returns the context, cluster and user entries of the current context, raising
+    _ResolveError when one is missing or has no context, cluster or user section.
+    """
+    context_entry = index.context(current_context)
+    if context_entry is None:
+        raise _ResolveError(
+            f"Failed to find a context named {current_context} in the"
+            " kubeconfig file."
+        )
+    try:
+        context = context_entry["context"]
+    except KeyError as e:
+        raise _ResolveError(f"{e} section missing from context entry in kubeconfig")
+
+    try:
+        current_cluster = context["cluster"]
+        current_user = context["user"]
+    except KeyError as e:
+        raise _ResolveError(f"{e} field missing from kubeconfig current context")
+
+    # Now find the cluster for that current context
+    cluster_entry = index.cluster(current_cluster)
+    if cluster_entry is None:
+        raise _ResolveError(
+            f"Failed to find a cluster named {current_cluster} in the"
+            " kubeconfig file."
+        )
+    if "cluster" not in cluster_entry:
+        raise _ResolveError(
+            "cluster section missing from section of current cluster"
+            f" {current_cluster}"
         )
-        output.connection.cacert = base64_decode(
-            cluster.get("certificate-authority-data", None)
+
+    # Now find the user for current context's user for authentication.
+    user_entry = index.user(current_user)
+    if user_entry is None:
+        raise _ResolveError(
+            f"Failed to find a user named {current_user} in the kubeconfig file."
         )
-        output.connection.cert = base64_decode(
-            user.get("client-certificate-data", None)
+    if "user" not in user_entry:
+        raise _ResolveError(
+            "'user' section in the users section not found in the kubeconfig"
         )
-        output.connection.key = base64_decode(user.get("client-key-data", None))
-        output.connection.username = user.get("username", None)
-        output.connection.password = user.get("password", None)
-        output.connection.bearerToken = user.get("token", None)
+    return context_entry, cluster_entry, user_entry
 
-        return "success", output
-    except Exception as e:
-        # This is the catch-all case.
-        # The goal is for all other errors to be addressed individually.
+
+def _extract_connection(
+    index: typing.Union[KubeconfigIndex, "KubeconfigMerge"],
+    current_context: typing.Any,
+    base_dir: typing.Optional[str],
+) -> StepResult:
+    """
+    Resolves the current context through the index and builds its connection. It
+    raises KubeconfigError for content problems and lets other exceptions through to
+    the caller's catch-all handling.
+    """
+    try:
+        context_entry, cluster_entry, user_entry = _resolve_context(
+            index, current_context
+        )
+    except _ResolveError as e:
+        return "error", ErrorOutput(str(e))
+    current_cluster = context_entry["context"]["cluster"]
+    cluster = cluster_entry["cluster"]
+    user = user_entry["user"]
+
+    # Ensure the server is in the kubeconfig
+    try:
+        server = cluster["server"]
+    except KeyError:
         return "error", ErrorOutput(
-            f"Failure to parse kubeconfig. Exception: {e}. Traceback: "
-            + traceback.format_exc()
+            f"Failed to find server in cluster kubeconfig file {current_cluster}"
+            " cluster section"
         )
+    # Populate output values from the user and server sections.
+    output = SuccessOutput(
+        Connection(host=server),
+    )
+    _mark_phase("resolve")
+    # Inline data takes precedence over file references, as in kubectl.
+    if base_dir is None:
+        base_dir = config_dir
+    output.connection.cacert = _pem_credential(
+        cluster, "certificate-authority-data", "certificate-authority", base_dir
+    )
+    output.connection.cert = _pem_credential(
+        user, "client-certificate-data", "client-certificate", base_dir
+    )
+    output.connection.key = _pem_credential(
+        user, "client-key-data", "client-key", base_dir
+    )
+    output.connection.serverName = cluster.get("tls-server-name", None)
+    output.connection.username = user.get("username", None)
+    output.connection.password = user.get("password", None)
+    output.connection.bearerToken = user.get("token", None)
+    if output.connection.bearerToken is None and "tokenFile" in user:
+        token_file = _resolve_path(user["tokenFile"], base_dir)
+        output.connection.bearerToken = (
+            read_credential_file(token_file, "tokenFile").decode("utf-8").strip()
+        )
+    if user.get("exec", None) is not None and (
+        output.connection.bearerToken is None and output.connection.cert is None
+    ):
+        credential = run_exec_credential(user["exec"], cluster, base_dir)
+        output.connection.bearerToken = credential.token
+        output.connection.cert = credential.client_certificate_data
+        output.connection.key = credential.client_key_data
+    output.connection.fingerprint = connection_fingerprint(output.connection)
+    _mark_phase("credentials")
+
+    return "success", output
+
+
+def connection_fingerprint(connection: Connection) -> str:
+    """
+    Returns the SHA-256 hex digest of the connection's server URL, TLS server name,
+    CA certificate and a digest of its credentials. Connections with equal
+    fingerprints reach the same server with the same trust and credentials, so they
+    can share clients and TLS sessions. The credentials cannot be read back from the
+    fingerprint, but weak passwords can be guessed from it like from any hash.
+    """
+    fields = [
+        connection.host,
+        connection.serverName,
+        connection.cacert,
+        _credential_digest(connection),
+    ]
+    return hashlib.sha256(json.dumps(fields).encode("utf-8")).hexdigest()
+
+
+def _credential_digest(connection: Connection) -> str:
+    fields = [
+        connection.cert,
+        connection.key,
+        connection.bearerToken,
+        connection.username,
+        connection.password,
+    ]
+    return hashlib.sha256(json.dumps(fields).encode("utf-8")).hexdigest()
+
+
+class ConnectionPool:
+    """
+    This is a bounded pool of clients keyed by connection fingerprint, so that
+    callers in a long-running process reuse a warm client for every connection
+    reaching the same server with the same credentials. Clients are created by the
+    factory on first use, outside the pool's lock, and concurrent requests for the
+    same fingerprint share a single creation. Clients are evicted in least recently
+    used order; evicted clients that have a close method are closed.
+    """
+
+    def __init__(
+        self, factory: typing.Callable[[Connection], typing.Any], max_entries: int = 16
+    ):
+        self.factory = factory
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self._clients: typing.OrderedDict[str, typing.Any] = collections.OrderedDict()
+        self._in_flight: typing.Dict[str, typing.Any] = {}
+        self._lock = threading.Lock()
+
+    def get(self, connection: Connection) -> typing.Any:
+        """
+        Returns the pooled client for the connection, creating it when needed. The
+        fingerprint is computed from the connection's fields rather than taken from
+        its fingerprint field.
+        """
+        import concurrent.futures
+
+        key = connection_fingerprint(connection)
+        with self._lock:
+            client = self._clients.get(key)
+            if client is not None:
+                self._clients.move_to_end(key)
+                self.hits += 1
+                return client
+            future = self._in_flight.get(key)
+            leader = future is None
+            if leader:
+                future = concurrent.futures.Future()
+                self._in_flight[key] = future
+                self.misses += 1
+            else:
+                self.hits += 1
+        if not leader:
+            return future.result()
+        try:
+            client = self.factory(connection)
+        except BaseException as e:
+            with self._lock:
+                del self._in_flight[key]
+            future.set_exception(e)
+            raise
+        evicted = []
+        with self._lock:
+            del self._in_flight[key]
+            self._clients[key] = client
+            while len(self._clients) > self.max_entries:
+                evicted.append(self._clients.popitem(last=False)[1])
+        future.set_result(client)
+        for old_client in evicted:
+            _close_client(old_client)
+        return client
+
+    def discard(self, connection: Connection):
+        """
+        Removes and closes the client of the connection, for example after it failed.
+        """
+        with self._lock:
+            client = self._clients.pop(connection_fingerprint(connection), None)
+        if client is not None:
+            _close_client(client)
+
+    def close(self):
+        with self._lock:
+            clients = list(self._clients.values())
+            self._clients.clear()
+        for client in clients:
+            _close_client(client)
+
+    def __len__(self) -> int:
+        with self._lock:
+            return len(self._clients)
 
 
-def base64_decode(encoded):
+def _close_client(client: typing.Any):
+    close = getattr(client, "close", None)
+    if close is not None:
+        close()
+
+
+def decode_pem(encoded: typing.Optional[str], field: str) -> typing.Optional[str]:
+    """
+    Decodes a base64 encoded PEM blob from the kubeconfig field of the given name.
+    Blobs are validated strictly and must contain a PEM block, otherwise a
+    KubeconfigError is raised. Decoded blobs are cached, so CA bundles shared between
+    clusters are only decoded once.
+    """
     if encoded is None:
         return None
-    return base64.b64decode(encoded).decode("ascii")
+    try:
+        return _decode_pem_blob(encoded)
+    except (binascii.Error, ValueError) as e:
+        raise KubeconfigError(f"Invalid {field} in kubeconfig: {e}")
 
 
-if __name__ == "__main__":
-    sys.exit(
-        plugin.run(
-            plugin.build_schema(
-                extract_kubeconfig,
+@functools.lru_cache(maxsize=128)
+def _decode_pem_blob(encoded: str) -> str:
+    try:
+        data = _strict_b64decode(encoded)
+    except binascii.Error:
+        # Blobs wrapped over several lines end up with whitespace in them.
+        stripped = "".join(encoded.split())
+        if stripped == encoded:
+            raise
+        data = _strict_b64decode(stripped)
+    return _pem_text(data, "decoded data")
+
+
+def _pem_text(data: bytes, description: str) -> str:
+    begin = data.find(b"-----BEGIN ")
+    if begin == -1 or data.find(b"-----END ", begin) == -1:
+        raise ValueError(f"{description} is not in PEM format")
+    return data.decode("ascii")
+
+
+def _pem_credential(
+    section: typing.Dict[str, typing.Any],
+    data_field: str,
+    file_field: str,
+    base_dir: str,
+) -> typing.Optional[str]:
+    encoded = section.get(data_field, None)
+    if encoded is not None:
+        return decode_pem(encoded, data_field)
+    path = section.get(file_field, None)
+    if path is None:
+        return None
+    path = _resolve_path(path, base_dir)
+    try:
+        return _pem_text(read_credential_file(path, file_field), "file content")
+    except ValueError as e:
+        raise KubeconfigError(f"Invalid {file_field} file {path}: {e}")
+
+
+# Directory relative credential file paths are resolved against when the location of
+# the kubeconfig is not known. This is the volume the container image declares.
+config_dir = os.environ.get("KUBECONFIG_PLUGIN_CONFIG_DIR", "/config")
+
+
+def _resolve_path(path: str, base_dir: str) -> str:
+    return os.path.join(base_dir, os.path.expanduser(path))
+
+
+def read_credential_file(path: str, field: str) -> bytes:
+    """
+    Reads a credential file referenced by the given kubeconfig field. Contents are
+    cached by path, inode, modification time and size, so unchanged files only cost
+    a stat call. The signature of the file is recorded as a dependency of the
+    extraction in progress. A missing file is recorded too, so that the result is
+    invalidated once it appears, and other read errors make the extraction
+    uncacheable.
+    """
+    dependencies = _extraction_dependencies.get()
+    try:
+        st = os.stat(path)
+        signature = (path, st.st_ino, st.st_mtime_ns, st.st_size)
+        if dependencies is not None:
+            dependencies.files.append(signature)
+        return _read_file(*signature)
+    except FileNotFoundError as e:
+        if dependencies is not None:
+            dependencies.files.append((path, 0, 0, -1))
+        raise KubeconfigError(f"Failed to read {field} file {path}: {e.strerror}")
+    except OSError as e:
+        if dependencies is not None:
+            dependencies.cacheable = False
+        raise KubeconfigError(f"Failed to read {field} file {path}: {e.strerror}")
+
+
+@functools.lru_cache(maxsize=128)
+def _read_file(path: str, inode: int, mtime_ns: int, size: int) -> bytes:
+    with open(path, "rb") as f:
+        if size == 0:
+            return b""
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+            return mapped[:]
+
+
+class ExecCredential(typing.NamedTuple):
+    """
+    This is the credential returned by an exec credential plugin.
+    """
+
+    token: typing.Optional[str]
+    client_certificate_data: typing.Optional[str]
+    client_key_data: typing.Optional[str]
+    # Expiry as a Unix timestamp, or None if the credential does not expire.
+    expiration: typing.Optional[float]
+
+
+class ExecCredentialCache:
+    """
+    This caches exec credential plugin results until their expirationTimestamp.
+    Concurrent requests for the same plugin configuration share a single plugin run.
+    """
+
+    # Credentials are refreshed this many seconds before they expire.
+    expiry_margin = 10.0
+
+    def __init__(self):
+        self.runs = 0
+        self._entries: typing.Dict[str, ExecCredential] = {}
+        self._in_flight: typing.Dict[str, typing.Any] = {}
+        self._lock = threading.Lock()
+
+    def get(self, key: str, run: typing.Callable[[], ExecCredential]) -> ExecCredential:
+        import concurrent.futures
+
+        with self._lock:
+            credential = self._entries.get(key)
+            if credential is not None and self._valid(credential):
+                return credential
+            future = self._in_flight.get(key)
+            leader = future is None
+            if leader:
+                future = concurrent.futures.Future()
+                self._in_flight[key] = future
+                self.runs += 1
+        if not leader:
+            return future.result()
+        try:
+            credential = run()
+        except BaseException as e:
+            future.set_exception(e)
+            raise
+        else:
+            future.set_result(credential)
+            return credential
+        finally:
+            with self._lock:
+                del self._in_flight[key]
+                if future.exception() is None:
+                    self._entries[key] = future.result()
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.runs = 0
+
+    def _valid(self, credential: ExecCredential) -> bool:
+        return (
+            credential.expiration is None
+            or credential.expiration - self.expiry_margin > time.time()
+        )
+
+
+exec_credential_cache = ExecCredentialCache()
+
+# Seconds an exec credential plugin may run before it is killed.
+exec_timeout = float(os.environ.get("KUBECONFIG_PLUGIN_EXEC_TIMEOUT", "60"))
+
+
+def run_exec_credential(
+    exec_config: typing.Dict[str, typing.Any],
+    cluster: typing.Dict[str, typing.Any],
+    base_dir: str,
+) -> ExecCredential:
+    """
+    Runs the exec credential plugin of a kubeconfig user, as kubectl does, and returns
+    the credential it prints. Results are cached until they expire.
+    """
+    try:
+        command = exec_config["command"]
+    except (KeyError, TypeError):
+        raise KubeconfigError("'command' field missing from user exec section")
+    # Like kubectl, commands with a path separator are relative to the kubeconfig.
+    if os.sep in command:
+        command = _resolve_path(command, base_dir)
+    args = [str(arg) for arg in exec_config.get("args", None) or []]
+    env = {}
+    for entry in exec_config.get("env", None) or []:
+        if not isinstance(entry, dict) or "name" not in entry or "value" not in entry:
+            raise KubeconfigError(
+                "'name' and 'value' fields required in user exec env entry"
+            )
+        env[str(entry["name"])] = str(entry["value"])
+    api_version = exec_config.get("apiVersion", "client.authentication.k8s.io/v1beta1")
+    exec_info = {
+        "apiVersion": api_version,
+        "kind": "ExecCredential",
+        "spec": {"interactive": False},
+    }
+    if exec_config.get("provideClusterInfo", False):
+        exec_info["spec"]["cluster"] = {
+            key: cluster[field]
+            for key, field in (
+                ("server", "server"),
+                ("tls-server-name", "tls-server-name"),
+                ("certificate-authority-data", "certificate-authority-data"),
+                ("insecure-skip-tls-verify", "insecure-skip-tls-verify"),
             )
+            if field in cluster
+        }
+    exec_info_json = json.dumps(exec_info, sort_keys=True)
+    key = hashlib.sha256(
+        json.dumps([command, args, env, exec_info_json]).encode("utf-8")
+    ).hexdigest()
+
+    dependencies = _extraction_dependencies.get()
+    if dependencies is not None:
+        dependencies.cacheable = False
+    credential = exec_credential_cache.get(
+        key, lambda: _run_exec_plugin(command, args, env, exec_info_json)
+    )
+    if dependencies is not None and credential.expiration is not None:
+        refresh = credential.expiration - exec_credential_cache.expiry_margin
+        if dependencies.expires is None or refresh < dependencies.expires:
+            dependencies.expires = refresh
+    return credential
+
+
+def _run_exec_plugin(
+    command: str, args: typing.List[str], env: typing.Dict[str, str], exec_info: str
+) -> ExecCredential:
+    import subprocess
+
+    process_env = dict(os.environ)
+    process_env.update(env)
+    process_env["KUBERNETES_EXEC_INFO"] = exec_info
+    try:
+        process = subprocess.run(
+            [command, *args],
+            env=process_env,
+            stdin=subprocess.DEVNULL,
+            capture_output=True,
+            text=True,
+            timeout=exec_timeout,
+        )
+    except (OSError, subprocess.TimeoutExpired) as e:
+        raise KubeconfigError(f"Failed to run exec credential plugin {command}: {e}")
+    if process.returncode != 0:
+        raise KubeconfigError(
+            f"Exec credential plugin {command} failed with exit code"
+            f" {process.returncode}: {process.stderr.strip()}"
+        )
+    try:
+        credential = json.loads(process.stdout)
+        if credential["kind"] != "ExecCredential":
+            raise ValueError(f"unexpected kind {credential['kind']}")
+        status = credential["status"]
+        expiration = status.get("expirationTimestamp", None)
+        if expiration is not None:
+            expiration = _parse_rfc3339(expiration)
+        result = ExecCredential(
+            token=status.get("token", None),
+            client_certificate_data=status.get("clientCertificateData", None),
+            client_key_data=status.get("clientKeyData", None),
+            expiration=expiration,
+        )
+    except (ValueError, KeyError, TypeError, AttributeError) as e:
+        raise KubeconfigError(
+            f"Exec credential plugin {command} returned an invalid ExecCredential:"
+            f" {e}"
+        )
+    if result.token is None and (
+        result.client_certificate_data is None or result.client_key_data is None
+    ):
+        raise KubeconfigError(
+            f"Exec credential plugin {command} returned neither a token nor a client"
+            " certificate and key"
+        )
+    return result
+
+
+_rfc3339_pattern = re.compile(
+    r"(\d{4}-\d{2}-\d{2})[Tt](\d{2}:\d{2}:\d{2})(?:\.(\d+))?([Zz]|[+-]\d{2}:\d{2})"
+)
+
+
+def _parse_rfc3339(value: str) -> float:
+    """
+    Returns the POSIX timestamp of an RFC 3339 date-time. Unlike fromisoformat before
+    Python 3.11, this accepts any number of fraction digits, such as the nanoseconds
+    Go writes, and keeps the first six of them.
+    """
+    match = _rfc3339_pattern.fullmatch(value)
+    if match is None:
+        raise ValueError(f"invalid RFC 3339 timestamp {value!r}")
+    date, time, fraction, offset = match.groups()
+    parsed = datetime.datetime.strptime(f"{date}T{time}", "%Y-%m-%dT%H:%M:%S")
+    if fraction:
+        parsed = parsed.replace(microsecond=int(fraction[:6].ljust(6, "0")))
+    if offset in ("Z", "z"):
+        tz = datetime.timezone.utc
+    else:
+        minutes = int(offset[1:3]) * 60 + int(offset[4:6])
+        tz = datetime.timezone(
+            datetime.timedelta(minutes=-minutes if offset[0] == "-" else minutes)
+        )
+    return parsed.replace(tzinfo=tz).timestamp()
+
+
+if sys.version_info >= (3, 11):
+
+    def _strict_b64decode(encoded: str) -> bytes:
+        return binascii.a2b_base64(encoded, strict_mode=True)
+
+else:
+    _base64_pattern = re.compile(r"[A-Za-z0-9+/]*={0,2}")
+
+    def _strict_b64decode(encoded: str) -> bytes:
+        if not _base64_pattern.fullmatch(encoded):
+            raise binascii.Error("Non-base64 digit found")
+        return binascii.a2b_base64(encoded)
+
+
+def _pool_class(executor: ExecutorType) -> type:
+    # Imported here as only the pooled modes need it and it is slow to import.
+    import concurrent.futures
+
+    if executor == ExecutorType.PROCESS:
+        return concurrent.futures.ProcessPoolExecutor
+    return concurrent.futures.ThreadPoolExecutor
+
+
+def _result_json(result: StepResult) -> str:
+    output_id, output_data = result
+    if output_id == "success":
+        serialized = kubeconfig_output_schema.serialize(output_data)
+    else:
+        serialized = kubeconfig_error_schema.serialize(output_data)
+    return json.dumps({"output_id": output_id, "output_data": serialized})
+
+
+# The steps of the plugin in schema order, as step id, module and function name. The
+# kubeconfig step is defined in this module and the others in their own modules, which
+# are only imported when the plugin schema includes their step.
+_steps = (
+    ("kubeconfig", "kubeconfig_plugin", "extract_kubeconfig"),
+    ("kubeconfig_batch", "kubeconfig_batch", "extract_kubeconfig_batch"),
+    ("kubeconfig_merged", "kubeconfig_merge", "extract_merged_kubeconfig"),
+    ("kubeconfig_all_contexts", "kubeconfig_contexts", "extract_all_contexts"),
+    ("kubeconfig_minified", "kubeconfig_minify", "minify_kubeconfig"),
+    ("kubeconfig_probe", "kubeconfig_probe", "probe_kubeconfig_connections"),
+)
+
+
+def _plugin_schema(argv: typing.List[str]) -> schema.SchemaType:
+    """
+    Builds the plugin schema for the command line arguments. Running one step, on an
+    input file or for its JSON schema, only needs that step, so the schema then only
+    includes it. Otherwise, for example for ATP and the schema output, it includes
+    every step.
+    """
+    import importlib
+
+    step_id, single_step = _step_arguments(argv)
+    steps = [step for step in _steps if single_step and step[0] == step_id] or _steps
+    return plugin.build_schema(
+        *(
+            getattr(importlib.import_module(module), function)
+            for _, module, function in steps
         )
     )
+
+
+def _plugin_arguments(argv: typing.List[str]) -> typing.List[str]:
+    """
+    Returns the arguments for plugin.run. The plugin first only had the kubeconfig
+    step, which ran without -s, so it stays the step of -f and --json-schema.
+    """
+    step_id, single_step = _step_arguments(argv)
+    if single_step and step_id is None:
+        return [*argv, "-s", "kubeconfig"]
+    return argv
+
+
+def _step_arguments(
+    argv: typing.List[str],
+) -> typing.Tuple[typing.Optional[str], bool]:
+    """
+    Returns the step id given with -s or --step, and whether the arguments run a
+    single step, on an input file given with -f or --file or with --json-schema.
+    """
+    step_id = None
+    single_step = False
+    arguments = iter(argv)
+    for argument in arguments:
+        if argument in ("-s", "--step"):
+            step_id = next(arguments, None)
+        elif argument.startswith("--step="):
+            step_id = argument.partition("=")[2]
+        elif argument in ("-f", "--file", "--json-schema"):
+            single_step = next(arguments, None) is not None
+        elif argument.startswith(("--file=", "--json-schema=")):
+            single_step = True
+    return step_id, single_step
+
+
+if __name__ == "__main__":
+    if sys.argv[1:2] == ["--build-schema-snapshot"]:
+        build_schema_snapshot(
+            sys.argv[2] if len(sys.argv) > 2 else schema_snapshot_path
+        )
+        sys.exit(0)
+    if "--jsonl" in sys.argv[1:]:
+        import kubeconfig_jsonl
+
+        sys.exit(kubeconfig_jsonl.main(sys.argv[1:]))
+    if "--watch" in sys.argv[1:]:
+        import kubeconfig_watch
+
+        sys.exit(kubeconfig_watch.main(sys.argv[1:]))
+    argv = _plugin_arguments(sys.argv[1:])
+    sys.exit(plugin.run(_plugin_schema(argv), [sys.argv[0], *argv]))
@@ -0,0 +1,419 @@
+"""
+The kubeconfig_probe step, which checks that API servers are reachable and accept
+the credentials.
+"""
+
+import base64
+import collections
+import json
+import os
+import time
+import typing
+from dataclasses import dataclass
+
+from arcaflow_plugin_sdk import schema, validation
+
+from kubeconfig_plugin import Connection, StepErrorOutput, step
+
+
+@dataclass
+class ProbeInputParams:
+    """
+    This is the input data structure for the probe step.
+    """
+
+    connections: typing.Annotated[
+        typing.List[Connection],
+        validation.min(1),
+        schema.name("Kubernetes connections"),
+        schema.description("Connections to probe, as output by the kubeconfig steps"),
+    ]
+    concurrency: typing.Annotated[
+        int,
+        validation.min(1),
+        schema.name("Concurrency"),
+        schema.description("Maximum number of requests in flight across all servers"),
+    ] = 16
+    timeout: typing.Annotated[
+        float,
+        validation.min(0.0),
+        schema.name("Timeout"),
+        schema.description("Timeout of each request in seconds"),
+    ] = 10.0
+    deadline: typing.Annotated[
+        typing.Optional[float],
+        validation.min(0.0),
+        schema.name("Deadline"),
+        schema.description(
+            "Time limit of the whole probe in seconds, by default the time the"
+            " requests take when each of them times out"
+        ),
+    ] = None
+
+
+@dataclass
+class ProbeEndpointResult:
+    """
+    This is the result of one request of a probe.
+    """
+
+    path: typing.Annotated[
+        str,
+        schema.name("Path"),
+        schema.description("Requested API path"),
+    ]
+    latency_ms: typing.Annotated[
+        float,
+        schema.name("Latency"),
+        schema.description("Time to the full response or the error in milliseconds"),
+    ]
+    status: typing.Annotated[
+        typing.Optional[int],
+        schema.name("Status"),
+        schema.description("HTTP status code, if a response was received"),
+    ] = None
+    error: typing.Annotated[
+        typing.Optional[str],
+        schema.name("Error"),
+        schema.description("Reason the request failed"),
+    ] = None
+
+
+@dataclass
+class ProbeResult:
+    """
+    This is the probe result of one connection.
+    """
+
+    host: typing.Annotated[
+        str,
+        schema.name("Server"),
+        schema.description("Kubernetes API URL"),
+    ]
+    reachable: typing.Annotated[
+        bool,
+        schema.name("Reachable"),
+        schema.description("Whether every endpoint answered with a 2xx status"),
+    ]
+    endpoints: typing.Annotated[
+        typing.List[ProbeEndpointResult],
+        schema.name("Endpoints"),
+        schema.description("Results of the /version and /readyz requests"),
+    ]
+    version: typing.Annotated[
+        typing.Optional[str],
+        schema.name("Version"),
+        schema.description("gitVersion reported by the /version endpoint"),
+    ] = None
+
+
+@dataclass
+class ProbeSuccessOutput:
+    """
+    This is the output data structure for the probe step, with one result per input
+    connection in input order.
+    """
+
+    results: typing.Annotated[
+        typing.List[ProbeResult],
+        schema.name("Results"),
+        schema.description("Per connection results in input order"),
+    ]
+
+
+probe_paths = ("/version", "/readyz")
+
+
+class _ProbeError(Exception):
+    pass
+
+
+class ProbeClient:
+    """
+    This is a minimal asyncio HTTP/1.1 client for probing Kubernetes API servers.
+    Idle keep-alive connections are pooled per server, TLS server name and
+    credentials, so connections to the same server share TLS connections. A semaphore
+    limits the requests in flight across all servers. Use it within one event loop
+    and await close when done.
+    """
+
+    def __init__(self, concurrency: int, timeout: float):
+        import asyncio
+
+        self.semaphore = asyncio.Semaphore(concurrency)
+        self.timeout = timeout
+        self.connects = 0
+        self._idle: typing.Dict[tuple, typing.List[tuple]] = collections.defaultdict(
+            list
+        )
+        self._ssl_contexts: typing.Dict[tuple, typing.Any] = {}
+
+    async def probe(self, connection: Connection) -> ProbeResult:
+        import asyncio
+
+        endpoints = await asyncio.gather(
+            *(self.get(connection, path) for path in probe_paths)
+        )
+        result = ProbeResult(
+            host=connection.host,
+            reachable=all(
+                endpoint.status is not None and 200 <= endpoint.status < 300
+                for endpoint, _ in endpoints
+            ),
+            endpoints=[endpoint for endpoint, _ in endpoints],
+        )
+        endpoint, body = endpoints[0]
+        if endpoint.status == 200:
+            try:
+                result.version = json.loads(body)["gitVersion"]
+            except (ValueError, KeyError, TypeError):
+                pass
+        return result
+
+    async def get(
+        self, connection: Connection, path: str
+    ) -> typing.Tuple[ProbeEndpointResult, bytes]:
+        """
+        Requests path from the connection's server. Failures are reported in the
+        result rather than raised.
+        """
+        import asyncio
+
+        async with self.semaphore:
+            start = time.perf_counter()
+            body = b""
+            try:
+                status, body = await asyncio.wait_for(
+                    self._get(connection, path), self.timeout
+                )
+                result = ProbeEndpointResult(path, 0.0, status=status)
+            except asyncio.TimeoutError:
+                result = ProbeEndpointResult(
+                    path, 0.0, error=f"timed out after {self.timeout}s"
+                )
+            except (OSError, EOFError, ValueError, _ProbeError) as e:
+                result = ProbeEndpointResult(
+                    path, 0.0, error=f"{type(e).__name__}: {e}"
+                )
+            result.latency_ms = (time.perf_counter() - start) * 1000
+        return result, body
+
+    async def close(self):
+        import asyncio
+
+        writers = [writer for idle in self._idle.values() for _, writer in idle]
+        self._idle.clear()
+        for writer in writers:
+            writer.close()
+        try:
+            await asyncio.wait_for(
+                asyncio.gather(
+                    *(writer.wait_closed() for writer in writers),
+                    return_exceptions=True,
+                ),
+                self.timeout,
+            )
+        except asyncio.TimeoutError:
+            # Servers that don't answer the TLS close are not waited for.
+            for writer in writers:
+                writer.transport.abort()
+
+    async def _get(self, connection: Connection, path: str) -> typing.Tuple[int, bytes]:
+        import urllib.parse
+
+        url = urllib.parse.urlsplit(connection.host)
+        if url.scheme not in ("https", "http") or not url.hostname:
+            raise ValueError(f"unsupported server URL {connection.host!r}")
+        port = url.port or (443 if url.scheme == "https" else 80)
+        pool_key = (
+            url.scheme,
+            url.hostname,
+            port,
+            connection.serverName,
+            connection.cacert,
+            connection.cert,
+            connection.key,
+        )
+        host_header = url.hostname if url.port is None else f"{url.hostname}:{port}"
+        if ":" in url.hostname:
+            host_header = f"[{url.hostname}]:{port}"
+        lines = [
+            f"GET {url.path.rstrip('/')}{path} HTTP/1.1",
+            f"Host: {host_header}",
+            "Accept: application/json, */*",
+            "User-Agent: arcaflow-plugin-kubeconfig",
+        ]
+        if connection.bearerToken:
+            lines.append(f"Authorization: Bearer {connection.bearerToken}")
+        elif connection.username is not None and connection.password is not None:
+            credentials = f"{connection.username}:{connection.password}".encode()
+            lines.append(
+                "Authorization: Basic " + base64.b64encode(credentials).decode("ascii")
+            )
+        request = ("\r\n".join(lines) + "\r\n\r\n").encode("utf-8")
+
+        idle = self._idle[pool_key]
+        while True:
+            reused = bool(idle)
+            if reused:
+                reader, writer = idle.pop()
+            else:
+                reader, writer = await self._connect(url, port, connection)
+            try:
+                writer.write(request)
+                await writer.drain()
+                status, body, keep_alive = await self._read_response(reader)
+            except (ConnectionError, EOFError):
+                writer.transport.abort()
+                # The server may have closed an idle connection, retry on a new one.
+                if reused:
+                    continue
+                raise
+            except BaseException:
+                # Aborted rather than closed, as a timed out or cancelled request
+                # won't wait for the transport to close.
+                writer.transport.abort()
+                raise
+            if keep_alive:
+                idle.append((reader, writer))
+            else:
+                writer.close()
+            return status, body
+
+    async def _connect(self, url, port: int, connection: Connection):
+        import asyncio
+
+        ssl_context = None
+        server_hostname = None
+        if url.scheme == "https":
+            ssl_context = self._ssl_context(connection)
+            server_hostname = connection.serverName or url.hostname
+        self.connects += 1
+        # open_connection aborts the transport itself when it is cancelled.
+        return await asyncio.open_connection(
+            url.hostname, port, ssl=ssl_context, server_hostname=server_hostname
+        )
+
+    def _ssl_context(self, connection: Connection):
+        key = (connection.cacert, connection.cert, connection.key)
+        context = self._ssl_contexts.get(key)
+        if context is not None:
+            return context
+        import ssl
+        import tempfile
+
+        context = ssl.create_default_context(cadata=connection.cacert)
+        if connection.cert is not None:
+            # The ssl module only loads client certificates from files.
+            with tempfile.TemporaryDirectory() as directory:
+                cert_file = os.path.join(directory, "cert.pem")
+                with open(cert_file, "w") as f:
+                    f.write(connection.cert)
+                key_file = None
+                if connection.key is not None:
+                    key_file = os.path.join(directory, "key.pem")
+                    with open(key_file, "w") as f:
+                        f.write(connection.key)
+                context.load_cert_chain(cert_file, key_file)
+        self._ssl_contexts[key] = context
+        return context
+
+    @staticmethod
+    async def _read_response(reader) -> typing.Tuple[int, bytes, bool]:
+        status_line = await reader.readline()
+        if not status_line:
+            raise ConnectionResetError("connection closed by server")
+        parts = status_line.decode("latin-1").split(None, 2)
+        if len(parts) < 2 or not parts[0].startswith("HTTP/"):
+            raise _ProbeError(f"invalid status line {status_line[:100]!r}")
+        status = int(parts[1])
+        headers = {}
+        while True:
+            line = await reader.readline()
+            if line in (b"\r\n", b"\n"):
+                break
+            if not line:
+                raise ConnectionResetError("connection closed in response headers")
+            name, _, value = line.decode("latin-1").partition(":")
+            headers[name.strip().lower()] = value.strip()
+
+        keep_alive = (
+            parts[0] != "HTTP/1.0" and headers.get("connection", "").lower() != "close"
+        )
+        if "chunked" in headers.get("transfer-encoding", "").lower():
+            chunks = []
+            while True:
+                size = int((await reader.readline()).split(b";")[0], 16)
+                if size == 0:
+                    # Skip the trailer section.
+                    while (await reader.readline()) not in (b"\r\n", b"\n", b""):
+                        pass
+                    break
+                chunks.append(await reader.readexactly(size))
+                await reader.readexactly(2)
+            body = b"".join(chunks)
+        elif "content-length" in headers:
+            body = await reader.readexactly(int(headers["content-length"]))
+        else:
+            body = await reader.read()
+            keep_alive = False
+        return status, body, keep_alive
+
+
+def probe_connections(
+    connections: typing.List[Connection],
+    concurrency: int,
+    timeout: float,
+    deadline: typing.Optional[float] = None,
+) -> typing.List[ProbeResult]:
+    """
+    Probes the /version and /readyz endpoints of every connection concurrently and
+    returns the results in input order. Without a deadline, the probe may take as
+    long as the requests take when each of them times out, plus the time to close
+    the pooled connections.
+    """
+    import asyncio
+    import math
+
+    if deadline is None:
+        rounds = math.ceil(len(connections) * len(probe_paths) / concurrency)
+        deadline = (rounds + 1) * timeout
+
+    async def probe_all():
+        client = ProbeClient(concurrency, timeout)
+        try:
+            return await asyncio.gather(
+                *(client.probe(connection) for connection in connections)
+            )
+        finally:
+            await client.close()
+
+    async def probe_within_deadline():
+        try:
+            return await asyncio.wait_for(probe_all(), deadline)
+        except asyncio.TimeoutError:
+            raise _ProbeError(f"the probe did not finish within {deadline}s")
+
+    return list(asyncio.run(probe_within_deadline()))
+
+
+@step(
+    id="kubeconfig_probe",
+    name="kubeconfig probe",
+    description=(
+        "Inputs kubernetes connections and checks that each API server is reachable"
+        " and accepts the credentials by requesting /version and /readyz"
+    ),
+    outputs={"success": ProbeSuccessOutput, "error": StepErrorOutput},
+)
+def probe_kubeconfig_connections(
+    params: ProbeInputParams,
+) -> typing.Tuple[str, typing.Union[ProbeSuccessOutput, StepErrorOutput]]:
+    print("==>> Probing kubernetes API servers ...")
+    try:
+        results = probe_connections(
+            params.connections, params.concurrency, params.timeout, params.deadline
+        )
+    except Exception as e:
+        return "error", StepErrorOutput(f"Failed to probe the connections: {e}")
+    return "success", ProbeSuccessOutput(results)
@@ -0,0 +1,251 @@
+"""
+The --watch mode of the plugin, which writes the kubeconfig step result whenever
+the connection of a mounted kubeconfig changes.
+"""
+
+import contextlib
+import hashlib
+import json
+import os
+import sys
+import threading
+import time
+import typing
+
+import kubeconfig_plugin
+from kubeconfig_plugin import (
+    Dependencies,
+    ErrorOutput,
+    FileSignature,
+    KubeconfigIndex,
+    StepResult,
+    _copy_result,
+    _dependencies_current,
+    _extract_with_dependencies,
+    _resolve_path,
+    _result_json,
+    load_kubeconfig,
+)
+
+
+class KubeconfigWatcher:
+    """
+    This watches a kubeconfig file and returns a new kubeconfig step result only when
+    the connection changes. The file is only read when its inode, modification time
+    or size changed, and only extracted again when the fingerprint of the current
+    context and its cluster and user entries changed or a file they reference did.
+    Edits to other contexts therefore cost a selective parse and no output. Changes
+    are waited for with inotify where available, and by polling every interval
+    seconds otherwise. Connections with exec credentials are also extracted again
+    when the credentials expire. Relative paths in the kubeconfig are resolved
+    against its directory.
+    """
+
+    def __init__(self, path: str, interval: float = 2.0, use_inotify: bool = True):
+        self.path = path
+        self.interval = interval
+        self.reads = 0
+        self.extractions = 0
+        self._base_dir = os.path.dirname(os.path.abspath(path))
+        self._signature: typing.Optional[FileSignature] = None
+        self._fingerprint: typing.Optional[str] = None
+        self._dependencies: Dependencies = ()
+        self._expires: typing.Optional[float] = None
+        self._result: typing.Optional[StepResult] = None
+        self._inotify = _Inotify.open(path) if use_inotify else None
+
+    def poll(self) -> typing.Optional[StepResult]:
+        """
+        Checks the file once and returns the new result if the connection or error
+        changed since the last returned result.
+        """
+        try:
+            stat = os.stat(self.path)
+        except OSError as e:
+            self._signature = self._fingerprint = None
+            return self._update(
+                ("error", ErrorOutput(f"Failed to read {self.path}: {e.strerror}"))
+            )
+        signature = (self.path, stat.st_ino, stat.st_mtime_ns, stat.st_size)
+        dependencies_current = _dependencies_current(self._dependencies) and (
+            self._expires is None or time.time() < self._expires
+        )
+        if signature == self._signature and dependencies_current:
+            return None
+        self._signature = signature
+        try:
+            with open(self.path, "r") as f:
+                kubeconfig_text = f.read()
+        except (OSError, UnicodeDecodeError) as e:
+            self._signature = self._fingerprint = None
+            return self._update(
+                ("error", ErrorOutput(f"Failed to read {self.path}: {e}"))
+            )
+        self.reads += 1
+        fingerprint = _context_fingerprint(kubeconfig_text)
+        if fingerprint == self._fingerprint and dependencies_current:
+            return None
+        self._fingerprint = fingerprint
+        self.extractions += 1
+        # The step prints a banner to stdout, which the watch output goes to.
+        with contextlib.redirect_stdout(sys.stderr):
+            result, dependencies = _extract_with_dependencies(
+                kubeconfig_text, self._base_dir
+            )
+        self._dependencies = tuple(dependencies.files)
+        self._expires = dependencies.expires
+        if self._expires is not None:
+            # Credentials that are already expired are retried every interval.
+            self._expires = max(self._expires, time.time() + self.interval)
+        return self._update(result)
+
+    def watch(
+        self, stop: typing.Optional[threading.Event] = None
+    ) -> typing.Iterator[StepResult]:
+        """
+        Yields the current result and then every changed result until stop is set.
+        """
+        while stop is None or not stop.is_set():
+            result = self.poll()
+            if result is not None:
+                yield result
+            timeout = self.interval
+            if self._expires is not None:
+                timeout = max(0.0, min(timeout, self._expires - time.time()))
+            if self._inotify is not None:
+                self._inotify.wait(timeout)
+            elif stop is not None:
+                stop.wait(timeout)
+            else:
+                time.sleep(timeout)
+
+    def close(self):
+        if self._inotify is not None:
+            self._inotify.close()
+            self._inotify = None
+
+    def _update(self, result: StepResult) -> typing.Optional[StepResult]:
+        if result == self._result:
+            return None
+        self._result = result
+        return _copy_result(result)
+
+
+def _context_fingerprint(kubeconfig_text: str) -> str:
+    """
+    Hashes the parts of a kubeconfig the kubeconfig step reads: the kind, the current
+    context and its context, cluster and user entries. Documents that cannot be
+    indexed are hashed whole, so their extraction errors are reported on change.
+    """
+    try:
+        kubeconfig = load_kubeconfig(kubeconfig_text)
+        current_context = kubeconfig.get("current-context")
+        index = KubeconfigIndex(kubeconfig, require_sections=False)
+        with contextlib.redirect_stdout(sys.stderr):
+            context_entry = index.context(current_context)
+            context = (context_entry or {}).get("context") or {}
+            relevant = [
+                kubeconfig.get("kind"),
+                current_context,
+                context_entry,
+                index.cluster(context.get("cluster")),
+                index.user(context.get("user")),
+            ]
+        data = json.dumps(relevant, sort_keys=True, default=repr)
+    except Exception:
+        data = kubeconfig_text
+    return hashlib.sha256(data.encode("utf-8")).hexdigest()
+
+
+class _Inotify:
+    """
+    This waits for changes in the directory of a file with the Linux inotify API.
+    Watching the directory also catches the file being replaced by a rename, as
+    editors and Kubernetes ConfigMap volume updates do.
+    """
+
+    # IN_MODIFY | IN_ATTRIB | IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO |
+    # IN_CREATE | IN_DELETE
+    MASK = 0x002 | 0x004 | 0x008 | 0x040 | 0x080 | 0x100 | 0x200
+
+    def __init__(self, fd: int):
+        self.fd = fd
+
+    @classmethod
+    def open(cls, path: str) -> typing.Optional["_Inotify"]:
+        """
+        Returns a watch for the directory of path, or None where inotify is not
+        available.
+        """
+        if not sys.platform.startswith("linux"):
+            return None
+        import ctypes
+
+        try:
+            libc = ctypes.CDLL(None, use_errno=True)
+            fd = libc.inotify_init1(os.O_NONBLOCK | os.O_CLOEXEC)
+        except (OSError, AttributeError):
+            return None
+        if fd < 0:
+            return None
+        directory = os.path.dirname(os.path.abspath(path))
+        if libc.inotify_add_watch(fd, os.fsencode(directory), cls.MASK) < 0:
+            os.close(fd)
+            return None
+        return cls(fd)
+
+    def wait(self, timeout: float) -> bool:
+        """
+        Waits up to timeout seconds for changes and returns whether there were any.
+        """
+        import select
+
+        readable, _, _ = select.select([self.fd], [], [], timeout)
+        if not readable:
+            return False
+        # Drain the events; the watcher checks the file itself.
+        try:
+            while os.read(self.fd, 65536):
+                pass
+        except BlockingIOError:
+            pass
+        return True
+
+    def close(self):
+        os.close(self.fd)
+
+
+def main(argv: typing.List[str]) -> int:
+    import argparse
+
+    parser = argparse.ArgumentParser(
+        description=(
+            "Watch a kubeconfig file and write the kubeconfig step result as a JSON"
+            " line whenever the connection changes."
+        )
+    )
+    parser.add_argument("--watch", required=True, metavar="FILE")
+    parser.add_argument(
+        "--interval",
+        type=float,
+        default=2.0,
+        help="Seconds between checks when inotify is not available.",
+    )
+    parser.add_argument(
+        "--poll", action="store_true", help="Poll even where inotify is available."
+    )
+    args = parser.parse_args(argv)
+    watcher = KubeconfigWatcher(
+        _resolve_path(args.watch, kubeconfig_plugin.config_dir),
+        args.interval,
+        not args.poll,
+    )
+    try:
+        for result in watcher.watch():
+            sys.stdout.write(_result_json(result) + "\n")
+            sys.stdout.flush()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        watcher.close()
+    return 0
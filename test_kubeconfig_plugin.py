@@ -1,11 +1,40 @@
 #!/usr/bin/env python3
+import base64
+import contextlib
+import datetime
+import gc
+import gzip
+import http.server
+import importlib.util
+import io
+import json
+import os
+import pickle
+import re
+import shutil
+import socket
+import ssl
+import subprocess
+import tempfile
+import threading
+import time
+import tracemalloc
+import textwrap
 import unittest
+import warnings
 import yaml
 import sys
 
 from arcaflow_plugin_sdk import plugin
 
+import kubeconfig_batch
+import kubeconfig_contexts
+import kubeconfig_jsonl
+import kubeconfig_merge
+import kubeconfig_minify
 import kubeconfig_plugin
+import kubeconfig_probe
+import kubeconfig_watch
 
 
 class KubeconfigPluginTest(unittest.TestCase):
@@ -261,6 +290,1532 @@ lB1ZGDx/ARE=
         self.assertEqual("error", result)
         self.assertIn("Failed to find server", data.error)
 
+    def test_result_cache_hit(self):
+        kubeconfig = self.get_kubeconfig_test_value("tests/test_token.yaml")
+        kubeconfig_plugin.result_cache.clear()
+        input = kubeconfig_plugin.InputParams(kubeconfig=kubeconfig)
+        first_result, first = kubeconfig_plugin.extract_kubeconfig(input)
+        second_result, second = kubeconfig_plugin.extract_kubeconfig(input)
+        self.assertEqual("success", first_result)
+        self.assertEqual("success", second_result)
+        self.assertEqual(first, second)
+        # Callers get their own copy, so mutating it must not poison the cache.
+        self.assertIsNot(first.connection, second.connection)
+        stats = kubeconfig_plugin.result_cache.stats()
+        self.assertEqual(1, stats["hits"])
+        self.assertEqual(1, stats["misses"])
+
+    def test_result_cache_caches_errors(self):
+        kubeconfig_plugin.result_cache.clear()
+        input = kubeconfig_plugin.InputParams(kubeconfig="kind: NotConfig")
+        kubeconfig_plugin.extract_kubeconfig(input)
+        result, data = kubeconfig_plugin.extract_kubeconfig(input)
+        self.assertEqual("error", result)
+        self.assertIn("not a kubeconfig file", data.error)
+        self.assertEqual(1, kubeconfig_plugin.result_cache.stats()["hits"])
+
+    def test_result_cache_eviction(self):
+        cache = kubeconfig_plugin.ResultCache(max_entries=2)
+        for i in range(3):
+            cache.put(str(i), ("error", kubeconfig_plugin.ErrorOutput(str(i))))
+        self.assertIsNone(cache.get("0"))
+        self.assertEqual("2", cache.get("2")[1].error)
+        self.assertEqual(1, cache.stats()["evictions"])
+
+        cache = kubeconfig_plugin.ResultCache(max_bytes=10)
+        cache.put("a", ("error", kubeconfig_plugin.ErrorOutput("x" * 6)))
+        cache.put("b", ("error", kubeconfig_plugin.ErrorOutput("y" * 6)))
+        self.assertIsNone(cache.get("a"))
+        self.assertEqual(6, cache.stats()["bytes"])
+
+    def test_result_cache_directory(self):
+        kubeconfig = self.get_kubeconfig_test_value("tests/test_client_cert.yaml")
+        with tempfile.TemporaryDirectory() as directory:
+            writer = kubeconfig_plugin.ResultCache(directory=directory)
+            key = writer.key(kubeconfig)
+            writer.put(key, kubeconfig_plugin._extract_kubeconfig(kubeconfig))
+            # A fresh cache, as in a separate process, finds the entry on disk.
+            reader = kubeconfig_plugin.ResultCache(directory=directory)
+            result, data = reader.get(key)
+            self.assertEqual("success", result)
+            self.assertEqual(self.EXPECTED_KEY, data.connection.key)
+            self.assertEqual(1, reader.stats()["hits"])
+
+            # Entries written with other settings or plugin sources are not used.
+            self.assertNotEqual(key, reader.key(kubeconfig, "/elsewhere"))
+            original_parse_mode = kubeconfig_plugin.parse_mode
+            kubeconfig_plugin.parse_mode = "full"
+            try:
+                self.assertNotEqual(key, reader.key(kubeconfig))
+            finally:
+                kubeconfig_plugin.parse_mode = original_parse_mode
+            original_version = kubeconfig_plugin._plugin_version
+            kubeconfig_plugin._plugin_version = lambda: "other"
+            try:
+                self.assertNotEqual(key, reader.key(kubeconfig))
+            finally:
+                kubeconfig_plugin._plugin_version = original_version
+
+    def test_result_cache_directory_limits(self):
+        with tempfile.TemporaryDirectory() as directory:
+            cache = kubeconfig_plugin.ResultCache(max_entries=2, directory=directory)
+            for i in range(3):
+                cache.put(str(i), ("error", kubeconfig_plugin.ErrorOutput(str(i))))
+                # Distinct modification times, as on filesystems with coarse clocks.
+                os.utime(os.path.join(directory, f"{i}.json"), (i, i))
+            cache.put("3", ("error", kubeconfig_plugin.ErrorOutput("3")))
+            self.assertEqual(["2.json", "3.json"], sorted(os.listdir(directory)))
+
+    def test_kubeconfig_index(self):
+        kubeconfig = {
+            "contexts": [
+                {"name": "a", "context": {"cluster": "one"}},
+                {"name": "b", "context": {"cluster": "two"}},
+                {"name": "a", "context": {"cluster": "three"}},
+            ],
+            "clusters": [{"name": "one", "cluster": {}}],
+        }
+        index = kubeconfig_plugin.KubeconfigIndex(kubeconfig)
+        self.assertEqual("two", index.context("b")["context"]["cluster"])
+        # The last entry wins, like the linear scan it replaces.
+        self.assertEqual("three", index.context("a")["context"]["cluster"])
+        self.assertIsNone(index.context("missing"))
+        self.assertEqual({"contexts": {"a"}}, index.duplicates)
+        self.assertIsNotNone(index.cluster("one"))
+        with self.assertRaises(kubeconfig_plugin.KubeconfigError) as cm:
+            index.user("admin")
+        self.assertIn("'users' section not found", str(cm.exception))
+
+    def test_unhashable_names(self):
+        kubeconfig = self.get_kubeconfig_test_value("tests/test_username.yaml")
+        # A list as the current-context is not found, as with the linear scan.
+        input = kubeconfig_plugin.InputParams(
+            kubeconfig=kubeconfig.replace(
+                "current-context: admin", "current-context: [a]"
+            )
+        )
+        result, data = kubeconfig_plugin.extract_kubeconfig(input)
+        self.assertEqual("error", result)
+        self.assertIn("Failed to find a context named ['a']", data.error)
+        # Entries named by a mapping are skipped.
+        input = kubeconfig_plugin.InputParams(
+            kubeconfig=kubeconfig.replace(
+                "- name: admin\n  user:",
+                "- name: {x: 1}\n  user: {}\n- name: admin\n  user:",
+            )
+        )
+        result, data = kubeconfig_plugin.extract_kubeconfig(input)
+        self.assertEqual("success", result)
+        self.assertEqual("admin", data.connection.username)
+        merge = kubeconfig_merge.KubeconfigMerge()
+        self.assertIsNone(merge.context(["a"]))
+
+    SELECTIVE_KUBECONFIG = """
+clusters:
+- cluster:
+    server: &server https://other:6443
+    certificate-authority-data: !!binary aGVsbG8=
+  name: other
+- name: arcaflow
+  cluster:
+    server: https://arcaflow:6443
+contexts:
+- name: admin
+  context: {cluster: arcaflow, user: admin}
+current-context: admin
+kind: Config
+users:
+- name: other
+  user: {token: other}
+- name: admin
+  user: {token: admin}
+"""
+
+    def test_selective_load(self):
+        for loader in (
+            kubeconfig_plugin._GuardedSafeLoader,
+            kubeconfig_plugin._SelectiveLoader,
+        ):
+            original_loader = kubeconfig_plugin._SelectiveLoader
+            kubeconfig_plugin._SelectiveLoader = loader
+            try:
+                loaded = kubeconfig_plugin._load_selective(self.SELECTIVE_KUBECONFIG)
+            finally:
+                kubeconfig_plugin._SelectiveLoader = original_loader
+            # Only the entries of the current context are built.
+            self.assertEqual(["arcaflow"], [c["name"] for c in loaded["clusters"]])
+            self.assertEqual(
+                [{"name": "admin", "user": {"token": "admin"}}], loaded["users"]
+            )
+            self.assertEqual("Config", loaded["kind"])
+
+    def test_selective_load_fallback(self):
+        # An alias to an anchor in a skipped entry needs the full loader.
+        kubeconfig = self.SELECTIVE_KUBECONFIG.replace(
+            "- name: arcaflow", "- name: &cluster arcaflow"
+        ).replace("cluster: arcaflow,", "cluster: *cluster,")
+        with self.assertRaises(kubeconfig_plugin._SelectiveParseError):
+            kubeconfig_plugin._load_selective(kubeconfig)
+        loaded = kubeconfig_plugin.load_kubeconfig(kubeconfig)
+        self.assertEqual(2, len(loaded["clusters"]))
+        result, data = kubeconfig_plugin._extract_kubeconfig(kubeconfig)
+        self.assertEqual("success", result)
+        self.assertEqual("https://arcaflow:6443", data.connection.host)
+
+        # Multiple documents are rejected by safe_load with the same error as before.
+        result, data = kubeconfig_plugin._extract_kubeconfig("kind: Config\n---\n")
+        self.assertEqual("error", result)
+        self.assertIn("not valid YAML", data.error)
+
+    def test_selective_matches_full(self):
+        for filename in (
+            "tests/test_token.yaml",
+            "tests/test_client_cert.yaml",
+            "tests/test_username.yaml",
+        ):
+            kubeconfig = self.get_kubeconfig_test_value(filename)
+            selective = kubeconfig_plugin._extract_kubeconfig(kubeconfig)
+            kubeconfig_plugin.parse_mode = "full"
+            try:
+                full = kubeconfig_plugin._extract_kubeconfig(kubeconfig)
+            finally:
+                kubeconfig_plugin.parse_mode = "selective"
+            self.assertEqual(full, selective)
+
+    def test_batch(self):
+        token = self.get_kubeconfig_test_value("tests/test_token.yaml")
+        username = self.get_kubeconfig_test_value("tests/test_username.yaml")
+        kubeconfigs = [token, "kind: NotConfig", username, token]
+        for executor in kubeconfig_plugin.ExecutorType:
+            kubeconfig_plugin.result_cache.clear()
+            input = kubeconfig_batch.BatchInputParams(
+                kubeconfigs=kubeconfigs, executor=executor, workers=2
+            )
+            result, data = kubeconfig_batch.extract_kubeconfig_batch(input)
+            self.assertEqual("success", result)
+            plugin.test_object_serialization(data)
+            self.assertEqual(4, len(data.results))
+            self.assertEqual(self.EXPECTED_TOKEN, data.results[0].connection.cacert)
+            self.assertIsNone(data.results[0].error)
+            self.assertIn("not a kubeconfig file", data.results[1].error)
+            self.assertIsNone(data.results[1].connection)
+            self.assertEqual("admin", data.results[2].connection.username)
+            self.assertEqual(data.results[0], data.results[3])
+            # The duplicate is only extracted once.
+            self.assertEqual(3, kubeconfig_plugin.result_cache.stats()["misses"])
+
+    def test_jsonl(self):
+        token = self.get_kubeconfig_test_value("tests/test_token.yaml")
+        username = self.get_kubeconfig_test_value("tests/test_username.yaml")
+        lines = [
+            json.dumps({"kubeconfig": token}),
+            "",
+            json.dumps({"kubeconfig": username}),
+            "not json",
+            json.dumps({"kubeconfig": "kind: NotConfig"}),
+        ]
+        for workers in (1, 3):
+            output = io.StringIO()
+            summary = kubeconfig_jsonl.run_jsonl(
+                io.StringIO("\n".join(lines) + "\n"), output, workers=workers
+            )
+            results = [json.loads(line) for line in output.getvalue().splitlines()]
+            self.assertEqual(
+                ["success", "success", "error", "error"],
+                [result["output_id"] for result in results],
+            )
+            self.assertEqual(
+                self.EXPECTED_TOKEN, results[0]["output_data"]["connection"]["cacert"]
+            )
+            self.assertEqual(
+                "admin", results[1]["output_data"]["connection"]["username"]
+            )
+            self.assertIn("Invalid input line", results[2]["output_data"]["error"])
+            self.assertIn("not a kubeconfig", results[3]["output_data"]["error"])
+            self.assertEqual(4, summary["items"])
+            self.assertLessEqual(summary["p50_ms"], summary["p99_ms"])
+
+        # Long streams keep a fixed-size sample that still tracks the percentiles.
+        reservoir = kubeconfig_jsonl.LatencyReservoir(size=1000)
+        for value in range(100000):
+            reservoir.add(value)
+        self.assertEqual(100000, reservoir.count)
+        self.assertEqual(1000, len(reservoir._samples))
+        self.assertAlmostEqual(50000, reservoir.percentile(50), delta=5000)
+        self.assertAlmostEqual(99000, reservoir.percentile(99), delta=2000)
+
+    def test_plugin_schema(self):
+        step_ids = [step_id for step_id, _, _ in kubeconfig_plugin._steps]
+        # Without an input file, for example for ATP, every step is included, as it
+        # is for unknown steps, which the SDK reports.
+        for argv in ([], ["--atp"], ["-s", "unknown", "-f", "input.yaml"]):
+            schema = kubeconfig_plugin._plugin_schema(argv)
+            self.assertEqual(step_ids, list(schema.steps))
+        for argv in (
+            ["-s", "kubeconfig_probe", "-f", "input.yaml"],
+            ["--file=input.yaml", "--step=kubeconfig_probe"],
+        ):
+            schema = kubeconfig_plugin._plugin_schema(argv)
+            self.assertEqual(["kubeconfig_probe"], list(schema.steps))
+
+        # Without -s, -f and --json-schema run the kubeconfig step, as they did when
+        # it was the only step.
+        self.assertEqual(
+            ["-f", "input.yaml", "-s", "kubeconfig"],
+            kubeconfig_plugin._plugin_arguments(["-f", "input.yaml"]),
+        )
+        for argv in (["--atp"], ["-s", "kubeconfig_probe", "-f", "input.yaml"]):
+            self.assertEqual(argv, kubeconfig_plugin._plugin_arguments(argv))
+
+        # Running the kubeconfig step does not import the modules of the other steps.
+        process = subprocess.run(
+            [
+                sys.executable,
+                "-v",
+                "kubeconfig_plugin.py",
+                "-f",
+                "tests/test_token.yaml",
+            ],
+            capture_output=True,
+            text=True,
+        )
+        self.assertEqual(0, process.returncode, process.stderr)
+        self.assertIn("output_id: success", process.stdout)
+        imported = re.findall(r"^import '(kubeconfig_\w+)'", process.stderr, re.M)
+        self.assertEqual([], imported)
+        process = subprocess.run(
+            [sys.executable, "kubeconfig_plugin.py", "--json-schema", "input"],
+            capture_output=True,
+            text=True,
+        )
+        self.assertEqual(0, process.returncode, process.stderr)
+        self.assertIn("kubeconfig_compressed", process.stdout)
+
+    def test_schema_snapshot(self):
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, "kubeconfig_plugin.schema")
+            command = [sys.executable, "kubeconfig_plugin.py"]
+            subprocess.run(command + ["--build-schema-snapshot", path], check=True)
+            expected = subprocess.run(
+                command + ["--schema"], capture_output=True, text=True, check=True
+            ).stdout
+            env = dict(os.environ, KUBECONFIG_PLUGIN_SCHEMA_SNAPSHOT=path)
+            process = subprocess.run(
+                command + ["--schema"], capture_output=True, text=True, env=env
+            )
+            self.assertEqual(0, process.returncode, process.stderr)
+            self.assertEqual("", process.stderr)
+            self.assertEqual(expected, process.stdout)
+            process = subprocess.run(
+                command + ["-s", "kubeconfig", "-f", "tests/test_token.yaml"],
+                capture_output=True,
+                text=True,
+                env=env,
+            )
+            self.assertEqual(0, process.returncode, process.stderr)
+            self.assertIn("output_id: success", process.stdout)
+
+            # Unusable snapshots are reported on stderr, which leaves the schema
+            # output intact, and the schemas are introspected instead.
+            with open(path, "rb") as f:
+                snapshot = pickle.load(f)
+            snapshot["source"] = "other"
+            for content in (pickle.dumps(snapshot), b"not a pickle"):
+                with open(path, "wb") as f:
+                    f.write(content)
+                process = subprocess.run(
+                    command + ["--schema"], capture_output=True, text=True, env=env
+                )
+                self.assertEqual(0, process.returncode, process.stderr)
+                self.assertIn("Warning: ignoring schema snapshot", process.stderr)
+                self.assertEqual(expected, process.stdout)
+
+    def test_decode_pem(self):
+        encoded = base64.b64encode(self.EXPECTED_KEY.encode()).decode()
+        kubeconfig_plugin._decode_pem_blob.cache_clear()
+        self.assertEqual(self.EXPECTED_KEY, kubeconfig_plugin.decode_pem(encoded, "f"))
+        self.assertEqual(self.EXPECTED_KEY, kubeconfig_plugin.decode_pem(encoded, "f"))
+        self.assertEqual(1, kubeconfig_plugin._decode_pem_blob.cache_info().hits)
+        self.assertIsNone(kubeconfig_plugin.decode_pem(None, "f"))
+        # Line wrapped blobs are accepted.
+        wrapped = " ".join(textwrap.wrap(encoded, 64))
+        self.assertEqual(self.EXPECTED_KEY, kubeconfig_plugin.decode_pem(wrapped, "f"))
+
+        for invalid in (
+            encoded[:-1],
+            "not*base64",
+            base64.b64encode(b"no pem framing").decode(),
+        ):
+            with self.assertRaises(kubeconfig_plugin.KubeconfigError) as cm:
+                kubeconfig_plugin.decode_pem(invalid, "client-key-data")
+            self.assertIn("Invalid client-key-data", str(cm.exception))
+
+    def test_invalid_certificate_data(self):
+        kubeconfig = self.get_kubeconfig_test_value("tests/test_token.yaml")
+        kubeconfig = kubeconfig.replace(
+            "certificate-authority-data: ", "certificate-authority-data: A"
+        )
+        result, data = kubeconfig_plugin._extract_kubeconfig(kubeconfig)
+        self.assertEqual("error", result)
+        self.assertIn("Invalid certificate-authority-data", data.error)
+
+    FILE_KUBECONFIG = """
+apiVersion: v1
+clusters:
+- cluster:
+    certificate-authority: ca.crt
+    server: https://api.nonexistent.arcalot.io:6443
+  name: arcaflow
+contexts:
+- context:
+    cluster: arcaflow
+    user: admin
+  name: admin
+current-context: admin
+kind: Config
+users:
+- name: admin
+  user:
+    client-certificate: {directory}/client.crt
+    client-key: client.key
+    tokenFile: token
+"""
+
+    def write_credential_files(self, directory):
+        for name, content in (
+            ("ca.crt", self.EXPECTED_TOKEN),
+            ("client.crt", self.EXPECTED_TOKEN),
+            ("client.key", self.EXPECTED_KEY),
+            ("token", "file-token\n"),
+        ):
+            with open(os.path.join(directory, name), "w") as f:
+                f.write(content)
+
+    def test_file_references(self):
+        with tempfile.TemporaryDirectory() as directory:
+            self.write_credential_files(directory)
+            kubeconfig = self.FILE_KUBECONFIG.format(directory=directory)
+            result, data = kubeconfig_plugin._extract_kubeconfig(kubeconfig, directory)
+            self.assertEqual("success", result)
+            self.assertEqual(self.EXPECTED_TOKEN, data.connection.cacert)
+            self.assertEqual(self.EXPECTED_TOKEN, data.connection.cert)
+            self.assertEqual(self.EXPECTED_KEY, data.connection.key)
+            self.assertEqual("file-token", data.connection.bearerToken)
+
+            # Inline data takes precedence over the file.
+            inline = kubeconfig.replace(
+                "tokenFile: token", "tokenFile: token\n    token: inline"
+            )
+            result, data = kubeconfig_plugin._extract_kubeconfig(inline, directory)
+            self.assertEqual("inline", data.connection.bearerToken)
+
+            os.remove(os.path.join(directory, "client.key"))
+            result, data = kubeconfig_plugin._extract_kubeconfig(kubeconfig, directory)
+            self.assertEqual("error", result)
+            self.assertIn("Failed to read client-key file", data.error)
+
+            with open(os.path.join(directory, "client.key"), "w") as f:
+                f.write("not a key")
+            result, data = kubeconfig_plugin._extract_kubeconfig(kubeconfig, directory)
+            self.assertEqual("error", result)
+            self.assertIn("Invalid client-key file", data.error)
+
+    def test_file_references_invalidate_cache(self):
+        original_config_dir = kubeconfig_plugin.config_dir
+        with tempfile.TemporaryDirectory() as directory:
+            kubeconfig_plugin.config_dir = directory
+            try:
+                self.write_credential_files(directory)
+                kubeconfig_plugin.result_cache.clear()
+                input = kubeconfig_plugin.InputParams(
+                    kubeconfig=self.FILE_KUBECONFIG.format(directory=directory)
+                )
+                _, data = kubeconfig_plugin.extract_kubeconfig(input)
+                self.assertEqual("file-token", data.connection.bearerToken)
+                _, data = kubeconfig_plugin.extract_kubeconfig(input)
+                self.assertEqual(1, kubeconfig_plugin.result_cache.stats()["hits"])
+
+                with open(os.path.join(directory, "token"), "w") as f:
+                    f.write("rotated-token-value")
+                _, data = kubeconfig_plugin.extract_kubeconfig(input)
+                self.assertEqual("rotated-token-value", data.connection.bearerToken)
+                stats = kubeconfig_plugin.result_cache.stats()
+                self.assertEqual(1, stats["invalidations"])
+            finally:
+                kubeconfig_plugin.config_dir = original_config_dir
+
+    def test_missing_file_invalidates_cache(self):
+        original_config_dir = kubeconfig_plugin.config_dir
+        original_directory = kubeconfig_plugin.result_cache.directory
+        with tempfile.TemporaryDirectory() as directory:
+            kubeconfig_plugin.config_dir = directory
+            kubeconfig_plugin.result_cache.directory = os.path.join(directory, "cache")
+            try:
+                self.write_credential_files(directory)
+                os.remove(os.path.join(directory, "token"))
+                kubeconfig_plugin.result_cache.clear()
+                input = kubeconfig_plugin.InputParams(
+                    kubeconfig=self.FILE_KUBECONFIG.format(directory=directory)
+                )
+                result, data = kubeconfig_plugin.extract_kubeconfig(input)
+                self.assertEqual("error", result)
+                self.assertIn("Failed to read tokenFile file", data.error)
+                # The error is cached until the file appears.
+                result, data = kubeconfig_plugin.extract_kubeconfig(input)
+                self.assertEqual("error", result)
+                self.assertEqual(1, kubeconfig_plugin.result_cache.stats()["hits"])
+
+                with open(os.path.join(directory, "token"), "w") as f:
+                    f.write("created-token")
+                result, data = kubeconfig_plugin.extract_kubeconfig(input)
+                self.assertEqual("success", result)
+                self.assertEqual("created-token", data.connection.bearerToken)
+            finally:
+                kubeconfig_plugin.config_dir = original_config_dir
+                kubeconfig_plugin.result_cache.directory = original_directory
+                kubeconfig_plugin.result_cache.clear()
+
+    EXEC_HELPER = """
+import json, os, sys, time
+with open(sys.argv[1], "a") as f:
+    f.write("run\\n")
+time.sleep(float(os.environ.get("HELPER_DELAY", "0")))
+info = json.loads(os.environ["KUBERNETES_EXEC_INFO"])
+print(json.dumps({
+    "apiVersion": info["apiVersion"],
+    "kind": "ExecCredential",
+    "status": {
+        "token": "exec-token-" + info["spec"]["cluster"]["server"],
+        "expirationTimestamp": os.environ["HELPER_EXPIRY"],
+    },
+}))
+"""
+
+    def exec_kubeconfig(self, directory, expiry, delay=0):
+        helper = os.path.join(directory, "helper.py")
+        with open(helper, "w") as f:
+            f.write(self.EXEC_HELPER)
+        return yaml.safe_dump(
+            {
+                "apiVersion": "v1",
+                "kind": "Config",
+                "current-context": "admin",
+                "clusters": [{"name": "c", "cluster": {"server": "https://s"}}],
+                "contexts": [
+                    {"name": "admin", "context": {"cluster": "c", "user": "u"}}
+                ],
+                "users": [
+                    {
+                        "name": "u",
+                        "user": {
+                            "exec": {
+                                "apiVersion": "client.authentication.k8s.io/v1",
+                                "command": sys.executable,
+                                "args": [helper, os.path.join(directory, "runs")],
+                                "env": [
+                                    {"name": "HELPER_EXPIRY", "value": expiry},
+                                    {"name": "HELPER_DELAY", "value": str(delay)},
+                                ],
+                                "provideClusterInfo": True,
+                            }
+                        },
+                    }
+                ],
+            }
+        )
+
+    def test_exec_credential(self):
+        with tempfile.TemporaryDirectory() as directory:
+            kubeconfig_plugin.exec_credential_cache.clear()
+            kubeconfig = self.exec_kubeconfig(directory, "2999-01-01T00:00:00Z")
+            for _ in range(3):
+                result, data = kubeconfig_plugin.extract_kubeconfig(
+                    kubeconfig_plugin.InputParams(kubeconfig=kubeconfig)
+                )
+                self.assertEqual("success", result)
+                self.assertEqual("exec-token-https://s", data.connection.bearerToken)
+            self.assertEqual(1, kubeconfig_plugin.exec_credential_cache.runs)
+
+            # Expired credentials are fetched again.
+            kubeconfig = self.exec_kubeconfig(directory, "2000-01-01T00:00:00Z")
+            for _ in range(2):
+                kubeconfig_plugin._extract_kubeconfig(kubeconfig)
+            self.assertEqual(3, kubeconfig_plugin.exec_credential_cache.runs)
+
+    def test_exec_credential_timestamps(self):
+        for value, expected in (
+            ("2024-01-01T00:00:00Z", 1704067200.0),
+            ("2024-01-01T00:00:00.5Z", 1704067200.5),
+            ("2024-01-01t00:00:00.123456789z", 1704067200.123456),
+            ("2024-01-01T01:30:00+01:30", 1704067200.0),
+            ("2023-12-31T23:00:00.25-01:00", 1704067200.25),
+        ):
+            self.assertAlmostEqual(
+                expected, kubeconfig_plugin._parse_rfc3339(value), places=6
+            )
+        for value in ("2024-01-01", "2024-01-01T00:00:00", "2024-01-01 00:00:00Z"):
+            with self.assertRaises(ValueError):
+                kubeconfig_plugin._parse_rfc3339(value)
+
+        with tempfile.TemporaryDirectory() as directory:
+            kubeconfig_plugin.exec_credential_cache.clear()
+            kubeconfig = self.exec_kubeconfig(
+                directory, "2999-01-01T00:00:00.123456789Z"
+            )
+            for _ in range(2):
+                result, data = kubeconfig_plugin._extract_kubeconfig(kubeconfig)
+                self.assertEqual("success", result)
+            self.assertEqual(1, kubeconfig_plugin.exec_credential_cache.runs)
+
+    def test_exec_credential_env(self):
+        with tempfile.TemporaryDirectory() as directory:
+            kubeconfig = self.exec_kubeconfig(directory, "2999-01-01T00:00:00Z")
+            kubeconfig = kubeconfig.replace("value: '0'", "not-value: '0'")
+            result, data = kubeconfig_plugin._extract_kubeconfig(kubeconfig)
+            self.assertEqual("error", result)
+            self.assertIn("'name' and 'value' fields required", data.error)
+
+    def test_exec_credential_single_flight(self):
+        with tempfile.TemporaryDirectory() as directory:
+            kubeconfig_plugin.exec_credential_cache.clear()
+            kubeconfig = self.exec_kubeconfig(
+                directory, "2999-01-01T00:00:00Z", delay=0.3
+            )
+            results = []
+            threads = [
+                threading.Thread(
+                    target=lambda: results.append(
+                        kubeconfig_plugin._extract_kubeconfig(kubeconfig)
+                    )
+                )
+                for _ in range(5)
+            ]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+            self.assertEqual(["success"] * 5, [result for result, _ in results])
+            with open(os.path.join(directory, "runs")) as f:
+                self.assertEqual(1, len(f.readlines()))
+
+    def test_exec_credential_failure(self):
+        kubeconfig_plugin.exec_credential_cache.clear()
+        kubeconfig = self.get_kubeconfig_test_value("tests/test_username.yaml")
+        kubeconfig = kubeconfig.replace(
+            "username: admin",
+            "exec:\n      command: "
+            + sys.executable
+            + "\n      args: ['-c', 'raise SystemExit(3)']",
+        ).replace("password: test", "")
+        result, data = kubeconfig_plugin._extract_kubeconfig(kubeconfig)
+        self.assertEqual("error", result)
+        self.assertIn("failed with exit code 3", data.error)
+
+    def test_merged(self):
+        first = yaml.safe_dump(
+            {
+                "current-context": "admin",
+                "contexts": [
+                    {"name": "admin", "context": {"cluster": "a", "user": "admin"}}
+                ],
+                "clusters": [{"name": "a", "cluster": {"server": "https://first"}}],
+            }
+        )
+        second = yaml.safe_dump(
+            {
+                "apiVersion": "v1",
+                "kind": "Config",
+                "current-context": "other",
+                "contexts": [
+                    {"name": "admin", "context": {"cluster": "b", "user": "admin"}}
+                ],
+                "clusters": [{"name": "a", "cluster": {"server": "https://second"}}],
+                "users": [{"name": "admin", "user": {"token": "second"}}],
+            }
+        )
+        input = kubeconfig_merge.MergedInputParams(kubeconfigs=[first, second])
+        result, data = kubeconfig_merge.extract_merged_kubeconfig(input)
+        self.assertEqual("success", result)
+        # The first fragment defining a name or current-context wins.
+        self.assertEqual("https://first", data.connection.host)
+        self.assertEqual("second", data.connection.bearerToken)
+
+        merge = kubeconfig_merge.KubeconfigMerge()
+        fragments = [
+            kubeconfig_merge._load_fragment(text, "test", None)
+            for text in (first, second)
+        ]
+        self.assertEqual(2, merge.update(fragments))
+        self.assertEqual(0, merge.update(fragments))
+        changed = kubeconfig_merge._load_fragment(
+            first.replace("https://first", "https://changed"), "test", None
+        )
+        self.assertEqual(1, merge.update([changed, fragments[1]]))
+        self.assertEqual("https://changed", merge.cluster("a")["cluster"]["server"])
+        self.assertEqual(1, merge.update([fragments[1], fragments[1]]))
+        self.assertEqual("https://second", merge.cluster("a")["cluster"]["server"])
+        self.assertIsNone(merge.cluster("b"))
+
+    def test_merged_paths(self):
+        with tempfile.TemporaryDirectory() as directory:
+            self.write_credential_files(directory)
+            users = os.path.join(directory, "users.yaml")
+            with open(users, "w") as f:
+                yaml.safe_dump(
+                    {"users": [{"name": "admin", "user": {"tokenFile": "token"}}]}, f
+                )
+            cluster = self.get_kubeconfig_test_value("tests/test_token.yaml")
+            cluster = cluster.replace("- name: admin", "- name: unused")
+            with open(os.path.join(directory, "cluster.yaml"), "w") as f:
+                f.write(cluster)
+            original_config_dir = kubeconfig_plugin.config_dir
+            kubeconfig_plugin.config_dir = directory
+            try:
+                input = kubeconfig_merge.MergedInputParams(
+                    kubeconfig_paths=os.pathsep.join(
+                        ["missing.yaml", "cluster.yaml", users]
+                    )
+                )
+                result, data = kubeconfig_merge.extract_merged_kubeconfig(input)
+                self.assertEqual("success", result)
+                self.assertEqual(self.EXPECTED_TOKEN, data.connection.cacert)
+                self.assertEqual("file-token", data.connection.bearerToken)
+
+                input = kubeconfig_merge.MergedInputParams(
+                    kubeconfig_paths="missing.yaml"
+                )
+                result, data = kubeconfig_merge.extract_merged_kubeconfig(input)
+                self.assertEqual("error", result)
+                self.assertIn("None of the kubeconfig files", data.error)
+
+                # Files outside of the config volume are rejected, whether they
+                # exist or not.
+                secret = os.path.join(os.path.dirname(directory), "secret.yaml")
+                for path in (secret, "../secret.yaml", "/nonexistent"):
+                    input = kubeconfig_merge.MergedInputParams(
+                        kubeconfig_paths=os.pathsep.join(["cluster.yaml", path])
+                    )
+                    result, data = kubeconfig_merge.extract_merged_kubeconfig(input)
+                    self.assertEqual("error", result)
+                    self.assertIn(f"kubeconfig_paths {path} is outside", data.error)
+            finally:
+                kubeconfig_plugin.config_dir = original_config_dir
+
+    def test_all_contexts(self):
+        ca = base64.b64encode(self.EXPECTED_TOKEN.encode()).decode()
+        key = base64.b64encode(self.EXPECTED_KEY.encode()).decode()
+        clusters = "".join(
+            f"- name: cluster-{i}\n"
+            f"  cluster: {{server: 'https://{i}:6443',"
+            f" certificate-authority-data: {ca}}}\n"
+            for i in range(3)
+        )
+        kubeconfig = (
+            f"kind: Config\ncurrent-context: context-1\nclusters:\n{clusters}"
+            "contexts:\n"
+            "- {name: context-0, context: {cluster: cluster-0, user: token}}\n"
+            "- {name: context-1, context: {cluster: cluster-1, user: cert}}\n"
+            "- {name: context-2, context: {cluster: cluster-2, user: missing}}\n"
+            "users:\n"
+            "- {name: token, user: {token: secret}}\n"
+            f"- {{name: cert, user: {{client-certificate-data: {ca},"
+            f" client-key-data: {key}}}}}\n"
+        )
+        input = kubeconfig_contexts.AllContextsInputParams(kubeconfig=kubeconfig)
+        result, data = kubeconfig_contexts.extract_all_contexts(input)
+        self.assertEqual("success", result)
+        plugin.test_object_serialization(data)
+        self.assertEqual("context-1", data.current_context)
+        self.assertEqual(
+            ["context-0", "context-1", "context-2"],
+            [connection.context for connection in data.contexts],
+        )
+        first, second, third = data.contexts
+        self.assertEqual("https://0:6443", first.host)
+        self.assertEqual("secret", first.bearerToken)
+        # The shared CA, also used as client certificate, is stored once.
+        self.assertEqual(2, len(data.blobs))
+        self.assertEqual(first.cacert_id, second.cacert_id)
+        self.assertEqual(first.cacert_id, second.cert_id)
+        self.assertEqual(self.EXPECTED_TOKEN, data.blobs[first.cacert_id])
+        self.assertEqual(self.EXPECTED_KEY, data.blobs[second.key_id])
+        self.assertIsNone(third.host)
+        self.assertIn("Failed to find a user named missing", third.error)
+        self.assertFalse(hasattr(first, "__dict__"))
+
+        input = kubeconfig_contexts.AllContextsInputParams(kubeconfig="kind: NotConfig")
+        result, data = kubeconfig_contexts.extract_all_contexts(input)
+        self.assertEqual("error", result)
+        self.assertIn("not a kubeconfig file", data.error)
+
+    def test_input_variants(self):
+        kubeconfig = self.get_kubeconfig_test_value("tests/test_token.yaml")
+        expected = kubeconfig_plugin.extract_kubeconfig(
+            kubeconfig_plugin.InputParams(kubeconfig=kubeconfig)
+        )
+        self.assertEqual("success", expected[0])
+
+        compressed = base64.b64encode(gzip.compress(kubeconfig.encode())).decode()
+        input = kubeconfig_plugin.InputParams(
+            kubeconfig_compressed="\n".join(textwrap.wrap(compressed, 76))
+        )
+        self.assertEqual(expected, kubeconfig_plugin.extract_kubeconfig(input))
+        # The inputs pass the step schema without an inline kubeconfig.
+        kubeconfig_plugin.kubeconfig_input_schema.validate(input)
+
+        for compressed, error in (
+            ("bm90IGNvbXByZXNzZWQ=", "not gzip or zstd"),
+            (base64.b64encode(gzip.compress(b"kind: Config")[:-6]).decode(), "Failed"),
+            (base64.b64encode(gzip.compress(b"\xff\xfe")).decode(), "Failed"),
+        ):
+            input = kubeconfig_plugin.InputParams(kubeconfig_compressed=compressed)
+            result, data = kubeconfig_plugin.extract_kubeconfig(input)
+            self.assertEqual("error", result)
+            self.assertIn(error, data.error)
+
+        saved = kubeconfig_plugin.config_dir
+        with tempfile.TemporaryDirectory() as directory:
+            kubeconfig_plugin.config_dir = directory
+            try:
+                with open(os.path.join(directory, "kubeconfig"), "w") as f:
+                    f.write(kubeconfig)
+                input = kubeconfig_plugin.InputParams(kubeconfig_path="kubeconfig")
+                self.assertEqual(expected, kubeconfig_plugin.extract_kubeconfig(input))
+
+                input = kubeconfig_plugin.InputParams(kubeconfig_path="missing")
+                result, data = kubeconfig_plugin.extract_kubeconfig(input)
+                self.assertIn("Failed to read kubeconfig file", data.error)
+
+                # Paths outside of the config volume are rejected, also via links.
+                os.symlink("/etc/passwd", os.path.join(directory, "link"))
+                for path in ("/etc/passwd", "../etc/passwd", "link"):
+                    input = kubeconfig_plugin.InputParams(kubeconfig_path=path)
+                    result, data = kubeconfig_plugin.extract_kubeconfig(input)
+                    self.assertEqual("error", result)
+                    self.assertIn(f"kubeconfig_path {path} is outside of", data.error)
+
+                # Oversized files fail on their size, before they are decoded.
+                with open(os.path.join(directory, "large"), "wb") as f:
+                    f.write(b"\xff" * 101)
+                saved_limits = kubeconfig_plugin.load_limits
+                kubeconfig_plugin.load_limits = saved_limits._replace(max_bytes=100)
+                try:
+                    input = kubeconfig_plugin.InputParams(kubeconfig_path="large")
+                    result, data = kubeconfig_plugin.extract_kubeconfig(input)
+                finally:
+                    kubeconfig_plugin.load_limits = saved_limits
+                self.assertEqual("error", result)
+                self.assertIn("101 bytes, more than the limit of 100", data.error)
+
+                # Relative credential paths resolve against the file's directory.
+                nested = os.path.join(directory, "nested")
+                os.mkdir(nested)
+                self.write_credential_files(nested)
+                with open(os.path.join(nested, "kubeconfig"), "w") as f:
+                    f.write(self.FILE_KUBECONFIG.format(directory="."))
+                input = kubeconfig_plugin.InputParams(
+                    kubeconfig_path="nested/kubeconfig"
+                )
+                result, data = kubeconfig_plugin.extract_kubeconfig(input)
+                self.assertEqual("success", result)
+                self.assertEqual("file-token", data.connection.bearerToken)
+            finally:
+                kubeconfig_plugin.config_dir = saved
+
+        for input in (
+            kubeconfig_plugin.InputParams(),
+            kubeconfig_plugin.InputParams(kubeconfig=kubeconfig, kubeconfig_path="a"),
+        ):
+            result, data = kubeconfig_plugin.extract_kubeconfig(input)
+            self.assertEqual("error", result)
+            self.assertIn("Exactly one of", data.error)
+
+    @unittest.skipUnless(importlib.util.find_spec("zstandard"), "needs the zstd extra")
+    def test_zstd_input(self):
+        import zstandard
+
+        kubeconfig = self.get_kubeconfig_test_value("tests/test_token.yaml")
+        expected = kubeconfig_plugin.extract_kubeconfig(
+            kubeconfig_plugin.InputParams(kubeconfig=kubeconfig)
+        )
+        compressed = zstandard.ZstdCompressor().compress(kubeconfig.encode())
+        input = kubeconfig_plugin.InputParams(
+            kubeconfig_compressed=base64.b64encode(compressed).decode()
+        )
+        self.assertEqual(expected, kubeconfig_plugin.extract_kubeconfig(input))
+
+        # Frames without a content size are decompressed as a stream too.
+        writer = io.BytesIO()
+        with zstandard.ZstdCompressor().stream_writer(writer, closefd=False) as f:
+            f.write(kubeconfig.encode())
+        self.assertEqual(
+            kubeconfig,
+            kubeconfig_plugin.decompress_kubeconfig(
+                base64.b64encode(writer.getvalue()).decode()
+            ),
+        )
+
+        saved = kubeconfig_plugin.max_decompressed_chars
+        kubeconfig_plugin.max_decompressed_chars = 100
+        try:
+            input = kubeconfig_plugin.InputParams(
+                kubeconfig_compressed=base64.b64encode(compressed).decode()
+            )
+            result, data = kubeconfig_plugin.extract_kubeconfig(input)
+            self.assertEqual("error", result)
+            self.assertIn("more than 100 characters", data.error)
+        finally:
+            kubeconfig_plugin.max_decompressed_chars = saved
+
+    def test_minified(self):
+        with tempfile.TemporaryDirectory() as directory:
+            self.write_credential_files(directory)
+            kubeconfig = self.FILE_KUBECONFIG.format(directory=directory)
+            # Add an unrelated context to be dropped.
+            kubeconfig = kubeconfig.replace(
+                "contexts:\n",
+                "contexts:\n- {name: other, context: {cluster: other, user: other}}\n",
+            )
+            expected = kubeconfig_plugin._extract_kubeconfig(kubeconfig, directory)
+            saved = kubeconfig_plugin.config_dir
+            kubeconfig_plugin.config_dir = directory
+            try:
+                input = kubeconfig_minify.MinifyInputParams(kubeconfig=kubeconfig)
+                result, data = kubeconfig_minify.minify_kubeconfig(input)
+            finally:
+                kubeconfig_plugin.config_dir = saved
+        self.assertEqual("success", result)
+        plugin.test_object_serialization(data)
+
+        minified = yaml.safe_load(data.kubeconfig)
+        self.assertEqual("admin", minified["current-context"])
+        self.assertEqual(["admin"], [c["name"] for c in minified["contexts"]])
+        self.assertEqual(["arcaflow"], [c["name"] for c in minified["clusters"]])
+        user = minified["users"][0]["user"]
+        self.assertEqual("file-token", user["token"])
+        self.assertNotIn("tokenFile", user)
+        self.assertNotIn("client-key", user)
+        self.assertNotIn("*", data.kubeconfig)
+        # The minified kubeconfig needs no files and extracts to the same connection.
+        self.assertEqual(
+            expected, kubeconfig_plugin._extract_kubeconfig(data.kubeconfig)
+        )
+
+        input = kubeconfig_minify.MinifyInputParams(
+            kubeconfig=self.SELECTIVE_KUBECONFIG.replace(
+                "current-context: admin", "current-context: missing"
+            )
+        )
+        result, data = kubeconfig_minify.minify_kubeconfig(input)
+        self.assertEqual("error", result)
+        self.assertIn("Failed to find a context named missing", data.error)
+
+    @staticmethod
+    def billion_laughs(section=None):
+        """
+        Returns a kubeconfig with nine levels of nine aliases each, which expands to
+        nine to the ninth nodes, at the top level or in the given section.
+        """
+        lines = [
+            '- &a0 ["lol", "lol", "lol", "lol", "lol", "lol", "lol", "lol", "lol"]'
+        ]
+        for level in range(1, 10):
+            aliases = ", ".join([f"*a{level - 1}"] * 9)
+            lines.append(f"- &a{level} [{aliases}]")
+        if section is None:
+            return "laughs:\n" + "\n".join(lines) + "\nkind: Config\n"
+        entries = "\n".join("  " + line for line in lines)
+        return textwrap.dedent("""
+            kind: Config
+            current-context: admin
+            contexts:
+            - {name: admin, context: {cluster: arcaflow, user: admin}}
+            clusters:
+            - {name: arcaflow, cluster: {server: "https://arcaflow:6443"}}
+            users:
+            - name: admin
+              user: {token: admin}
+            """) + f"{section}:\n- name: laughs\n  laughs:\n{entries}\n"
+
+    def assert_bounded(self, function):
+        tracemalloc.start()
+        start = time.perf_counter()
+        try:
+            result = function()
+        finally:
+            elapsed = time.perf_counter() - start
+            _, peak = tracemalloc.get_traced_memory()
+            tracemalloc.stop()
+        self.assertLess(elapsed, 5)
+        self.assertLess(peak, 20 * 1024 * 1024)
+        return result
+
+    def test_alias_bombs(self):
+        for kubeconfig in (
+            self.billion_laughs(),
+            # Aliases in skipped sections make the selective parser fall back.
+            self.billion_laughs("users"),
+            self.billion_laughs("contexts"),
+        ):
+            input = kubeconfig_plugin.InputParams(kubeconfig=kubeconfig)
+            result, data = self.assert_bounded(
+                lambda: kubeconfig_plugin.extract_kubeconfig(input)
+            )
+            self.assertEqual("error", result)
+            self.assertIn("aliases expand to more than the limit", data.error)
+
+        input = kubeconfig_contexts.AllContextsInputParams(
+            kubeconfig=self.billion_laughs("clusters")
+        )
+        result, data = self.assert_bounded(
+            lambda: kubeconfig_contexts.extract_all_contexts(input)
+        )
+        self.assertIn("aliases expand to more than the limit", data.error)
+
+        input = kubeconfig_merge.MergedInputParams(
+            kubeconfigs=[self.billion_laughs("users")]
+        )
+        result, data = self.assert_bounded(
+            lambda: kubeconfig_merge.extract_merged_kubeconfig(input)
+        )
+        self.assertIn("aliases expand to more than the limit", data.error)
+
+        input = kubeconfig_plugin.InputParams(
+            kubeconfig="kind: Config\nloop: &loop [*loop]\n"
+        )
+        result, data = kubeconfig_plugin.extract_kubeconfig(input)
+        self.assertIn("recursive alias *loop", data.error)
+
+    def test_load_limits(self):
+        nested = "[" * 100000 + "]" * 100000
+        for kubeconfig in (
+            f"kind: Config\ncurrent-context: admin\nnested: {nested}\n",
+            f"kind: Config\ncurrent-context: admin\nusers: {nested}\n",
+        ):
+            # libyaml's composer would crash the interpreter on these.
+            input = kubeconfig_plugin.InputParams(kubeconfig=kubeconfig)
+            result, data = self.assert_bounded(
+                lambda: kubeconfig_plugin.extract_kubeconfig(input)
+            )
+            self.assertIn("nested deeper than the limit of 100 levels", data.error)
+            input = kubeconfig_contexts.AllContextsInputParams(kubeconfig=kubeconfig)
+            result, data = kubeconfig_contexts.extract_all_contexts(input)
+            self.assertIn("nested deeper than the limit of 100 levels", data.error)
+
+        kubeconfig = self.get_kubeconfig_test_value("tests/test_token.yaml")
+        saved = kubeconfig_plugin.load_limits
+        try:
+            for limits, error in (
+                (saved._replace(max_bytes=100), "bytes, more than the limit of 100"),
+                (saved._replace(max_nodes=10), "more than the limit of 10 nodes"),
+                (saved._replace(max_depth=3), "deeper than the limit of 3 levels"),
+            ):
+                kubeconfig_plugin.load_limits = limits
+                for mode in ("selective", "full"):
+                    kubeconfig_plugin.parse_mode = mode
+                    result, data = kubeconfig_plugin._extract_kubeconfig(kubeconfig)
+                    self.assertEqual("error", result)
+                    self.assertIn(error, data.error)
+        finally:
+            kubeconfig_plugin.load_limits = saved
+            kubeconfig_plugin.parse_mode = "selective"
+
+    def test_json_input(self):
+        kubeconfigs = [
+            self.get_kubeconfig_test_value(f"tests/{name}.yaml")
+            for name in ("test_token", "test_client_cert", "test_username")
+        ]
+        json_inputs = [
+            json.dumps(yaml.safe_load(kubeconfig)) for kubeconfig in kubeconfigs
+        ]
+        for json_input in json_inputs:
+            self.assertIsNotNone(kubeconfig_plugin._load_json(json_input))
+        numeric = (
+            '{"kind": "Config", "current-context": 1e3,'
+            ' "contexts": [{"name": "1e3", "context": {"cluster": "c", "user": "u"}}],'
+            ' "clusters": [{"name": "c", "cluster": {"server": "https://s"}}],'
+            ' "users": [{"name": "u", "user": {"token": "%s"}}]}'
+        )
+        # Documents that JSON and YAML read differently, or that YAML rejects.
+        invalid = [
+            '{"kind": "Config",}',
+            '{"kind": "Config", "current-context": "admin", "contexts": [}',
+            " {" + "[" * 200 + "]" * 200 + "}",
+            json.dumps({"kind": "Config", "nested": [[[[[[]]]]]] * 2}),
+            numeric % "t",
+            (numeric % "t").replace("1e3", "1.5e+3"),
+            numeric % "\\ud83d\\ude00",
+            numeric % "\x7f",
+            numeric % "\u0085",
+            numeric.replace('"name": "c",', '"name"\n: "c",') % "t",
+            numeric.replace('"name": "c",', '"%s": 1, "name": "c",' % ("k" * 1100))
+            % "t",
+            json.dumps(json.loads(numeric % "t"), indent="\t"),
+        ]
+        saved_limits = kubeconfig_plugin.load_limits
+        saved_start = kubeconfig_plugin._json_object_start
+        try:
+            for decoder in ("orjson", "json"):
+                kubeconfig_plugin._json_decoder.cache_clear()
+                if decoder == "json":
+                    sys.modules["orjson"] = None
+                for kubeconfig, json_input in zip(kubeconfigs, json_inputs):
+                    self.assertEqual(
+                        kubeconfig_plugin._extract_kubeconfig(kubeconfig),
+                        kubeconfig_plugin._extract_kubeconfig(json_input),
+                    )
+                kubeconfig_plugin.load_limits = saved_limits._replace(max_depth=6)
+                json_results = [
+                    kubeconfig_plugin._extract_kubeconfig(kubeconfig)
+                    for kubeconfig in invalid
+                ]
+                # Without the fast path, the YAML loader reports the same errors.
+                kubeconfig_plugin._json_object_start = re.compile("(?!)")
+                yaml_results = [
+                    kubeconfig_plugin._extract_kubeconfig(kubeconfig)
+                    for kubeconfig in invalid
+                ]
+                kubeconfig_plugin._json_object_start = saved_start
+                kubeconfig_plugin.load_limits = saved_limits
+                self.assertEqual(yaml_results, json_results)
+                self.assertEqual(
+                    "error", json_results[3][0], "depth limit must be enforced"
+                )
+                self.assertEqual("success", json_results[4][0])
+        finally:
+            sys.modules.pop("orjson", None)
+            kubeconfig_plugin._json_decoder.cache_clear()
+            kubeconfig_plugin._json_object_start = saved_start
+            kubeconfig_plugin.load_limits = saved_limits
+
+    def test_connection_fingerprint(self):
+        kubeconfig = self.get_kubeconfig_test_value("tests/test_token.yaml")
+        fingerprints = []
+        for text in (
+            kubeconfig,
+            # Other contexts and unrelated fields do not change the fingerprint.
+            kubeconfig.replace("name: arcaflow-plugins/", "name: other/"),
+            kubeconfig.replace("sha256~2Z70", "sha256~3Z70"),
+            kubeconfig.replace("https://api.", "https://api2."),
+            self.get_kubeconfig_test_value("tests/test_client_cert.yaml"),
+        ):
+            result, data = kubeconfig_plugin._extract_kubeconfig(text)
+            self.assertEqual("success", result)
+            connection = data.connection
+            self.assertRegex(connection.fingerprint, "^[0-9a-f]{64}$")
+            self.assertEqual(
+                connection.fingerprint,
+                kubeconfig_plugin.connection_fingerprint(connection),
+            )
+            fingerprints.append(connection.fingerprint)
+        self.assertEqual(fingerprints[0], fingerprints[1])
+        self.assertEqual(4, len(set(fingerprints)))
+
+        input = kubeconfig_contexts.AllContextsInputParams(kubeconfig=kubeconfig)
+        result, data = kubeconfig_contexts.extract_all_contexts(input)
+        self.assertEqual("success", result)
+        self.assertEqual(fingerprints[0], data.contexts[0].fingerprint)
+
+    def test_connection_pool(self):
+        class Client:
+            def __init__(self, connection):
+                self.connection = connection
+                self.closed = False
+
+            def close(self):
+                self.closed = True
+
+        pool = kubeconfig_plugin.ConnectionPool(Client, max_entries=2)
+        first = kubeconfig_plugin.Connection(host="https://a", bearerToken="x")
+        second = kubeconfig_plugin.Connection(host="https://a", bearerToken="y")
+        third = kubeconfig_plugin.Connection(host="https://b", bearerToken="x")
+        client = pool.get(first)
+        same = kubeconfig_plugin.Connection(host="https://a", bearerToken="x")
+        self.assertIs(client, pool.get(same))
+        other = pool.get(second)
+        self.assertIsNot(client, other)
+        self.assertEqual((1, 2), (pool.hits, pool.misses))
+        pool.get(first)
+        # The least recently used client is evicted and closed.
+        pool.get(third)
+        self.assertTrue(other.closed)
+        self.assertFalse(client.closed)
+        self.assertEqual(2, len(pool))
+        pool.discard(first)
+        self.assertTrue(client.closed)
+        remaining = pool.get(third)
+        pool.close()
+        self.assertTrue(remaining.closed)
+        self.assertEqual(0, len(pool))
+
+        # Slow client creation blocks neither other fingerprints nor callers of the
+        # same fingerprint, which share the one creation.
+        created = []
+        release = threading.Event()
+
+        def slow_factory(connection):
+            created.append(connection.host)
+            if connection.host == "https://slow":
+                release.wait(5)
+            return Client(connection)
+
+        pool = kubeconfig_plugin.ConnectionPool(slow_factory)
+        fast = pool.get(first)
+        slow = kubeconfig_plugin.Connection(host="https://slow")
+        results = []
+        threads = [
+            threading.Thread(target=lambda: results.append(pool.get(slow)))
+            for _ in range(3)
+        ]
+        for thread in threads:
+            thread.start()
+        try:
+            for _ in range(500):
+                if "https://slow" in created:
+                    break
+                time.sleep(0.01)
+            self.assertIs(fast, pool.get(first))
+            self.assertEqual(1, len(pool))
+        finally:
+            release.set()
+            for thread in threads:
+                thread.join()
+        self.assertEqual(["https://a", "https://slow"], created)
+        self.assertEqual(3, len(results))
+        self.assertTrue(all(result is results[0] for result in results))
+
+        def failing_factory(connection):
+            raise OSError("handshake failed")
+
+        pool = kubeconfig_plugin.ConnectionPool(failing_factory)
+        with self.assertRaises(OSError):
+            pool.get(first)
+        self.assertEqual(0, len(pool))
+
+    def test_metrics(self):
+        kubeconfig = self.get_kubeconfig_test_value("tests/test_client_cert.yaml")
+        kubeconfig_plugin.result_cache.clear()
+        input = kubeconfig_plugin.InputParams(kubeconfig=kubeconfig, metrics=True)
+        result, data = kubeconfig_plugin.extract_kubeconfig(input)
+        self.assertEqual("success", result)
+        plugin.test_object_serialization(data)
+        self.assertEqual(
+            {"input", "cache_lookup", "load", "resolve", "credentials", "serialize"},
+            set(data.metrics.phases),
+        )
+        self.assertEqual(len(kubeconfig), data.metrics.input_bytes)
+        self.assertGreater(data.metrics.output_bytes, len(self.EXPECTED_KEY))
+        self.assertIsNone(data.metrics.profile)
+
+        # A cached result only reports the input, lookup and serialization.
+        result, data = kubeconfig_plugin.extract_kubeconfig(input)
+        self.assertEqual(
+            {"input", "cache_lookup", "serialize"}, set(data.metrics.phases)
+        )
+
+        # Uninstrumented invocations have no metrics.
+        input = kubeconfig_plugin.InputParams(kubeconfig=kubeconfig)
+        result, data = kubeconfig_plugin.extract_kubeconfig(input)
+        self.assertIsNone(data.metrics)
+
+    def test_profile(self):
+        kubeconfig = self.get_kubeconfig_test_value("tests/test_token.yaml")
+        for mode, expected in (
+            (kubeconfig_plugin.ProfileMode.CPROFILE, "function calls"),
+            (kubeconfig_plugin.ProfileMode.TRACEMALLOC, "Peak traced memory"),
+        ):
+            input = kubeconfig_plugin.InputParams(kubeconfig=kubeconfig, profile=mode)
+            result, data = kubeconfig_plugin.extract_kubeconfig(input)
+            self.assertEqual("success", result)
+            self.assertIn(expected, data.metrics.profile)
+            self.assertIn("load", data.metrics.phases)
+
+        input = kubeconfig_plugin.InputParams(
+            kubeconfig="kind: NotConfig", metrics=True
+        )
+        result, data = kubeconfig_plugin.extract_kubeconfig(input)
+        self.assertEqual("error", result)
+        plugin.test_object_serialization(data)
+        self.assertIn("serialize", data.metrics.phases)
+
+        # Only the error output of the kubeconfig step has the metrics.
+        steps = kubeconfig_plugin._plugin_schema([]).steps
+        for step_id, step_schema in steps.items():
+            properties = list(step_schema.outputs["error"].schema.properties)
+            if step_id == "kubeconfig":
+                self.assertEqual(["error", "metrics"], properties)
+            else:
+                self.assertEqual(["error"], properties)
+
+    @contextlib.contextmanager
+    def probe_server(self, directory):
+        """
+        Runs a local HTTPS stand-in for an API server with a certificate for
+        kubernetes.test, which is also the only accepted client certificate.
+        """
+        cert_file = os.path.join(directory, "server.crt")
+        key_file = os.path.join(directory, "server.key")
+        subprocess.run(
+            [
+                "openssl",
+                "req",
+                "-x509",
+                "-newkey",
+                "rsa:2048",
+                "-nodes",
+                "-days",
+                "1",
+                "-subj",
+                "/CN=kubernetes.test",
+                "-addext",
+                "subjectAltName=DNS:kubernetes.test",
+                "-keyout",
+                key_file,
+                "-out",
+                cert_file,
+            ],
+            check=True,
+            capture_output=True,
+        )
+        connections = []
+
+        class Handler(http.server.BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def setup(self):
+                super().setup()
+                connections.append(self.connection.getpeercert())
+
+            def do_GET(self):
+                authorized = (
+                    self.headers.get("Authorization") == "Bearer secret"
+                    or self.connection.getpeercert()
+                )
+                if not authorized:
+                    status, body = 401, b'{"kind": "Status"}'
+                elif self.path == "/version":
+                    status, body = 200, b'{"gitVersion": "v1.28.3"}'
+                elif self.path == "/readyz":
+                    status, body = 200, b"ok"
+                else:
+                    status, body = 404, b"not found"
+                self.send_response(status)
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass
+
+        context = ssl.SSLContext(ssl.PROTOCOL_TLS_SERVER)
+        context.load_cert_chain(cert_file, key_file)
+        context.load_verify_locations(cert_file)
+        context.verify_mode = ssl.CERT_OPTIONAL
+        server = http.server.ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        server.socket = context.wrap_socket(server.socket, server_side=True)
+        thread = threading.Thread(target=server.serve_forever, daemon=True)
+        thread.start()
+        try:
+            with open(cert_file) as f:
+                cert = f.read()
+            with open(key_file) as f:
+                key = f.read()
+            host = f"https://127.0.0.1:{server.server_address[1]}"
+            yield host, cert, key, connections
+        finally:
+            server.shutdown()
+            server.server_close()
+
+    @unittest.skipUnless(shutil.which("openssl"), "needs openssl")
+    def test_probe(self):
+        with tempfile.TemporaryDirectory() as directory, self.probe_server(
+            directory
+        ) as (host, cert, key, connections), socket.socket() as silent:
+            silent.bind(("127.0.0.1", 0))
+            silent.listen()
+            closed = socket.socket()
+            closed.bind(("127.0.0.1", 0))
+            closed_port = closed.getsockname()[1]
+            closed.close()
+
+            token = kubeconfig_plugin.Connection(
+                host=host,
+                serverName="kubernetes.test",
+                cacert=cert,
+                bearerToken="secret",
+            )
+            input = kubeconfig_probe.ProbeInputParams(
+                connections=[
+                    token,
+                    kubeconfig_plugin.Connection(
+                        host=host,
+                        serverName="kubernetes.test",
+                        cacert=cert,
+                        cert=cert,
+                        key=key,
+                    ),
+                    kubeconfig_plugin.Connection(
+                        host=host, serverName="kubernetes.test", cacert=cert
+                    ),
+                    # Without the server name the certificate does not match.
+                    kubeconfig_plugin.Connection(
+                        host=host, cacert=cert, bearerToken="secret"
+                    ),
+                    kubeconfig_plugin.Connection(
+                        host=f"https://127.0.0.1:{closed_port}", cacert=cert
+                    ),
+                    kubeconfig_plugin.Connection(
+                        host=f"https://127.0.0.1:{silent.getsockname()[1]}",
+                        cacert=cert,
+                    ),
+                ],
+                timeout=1.0,
+            )
+            with warnings.catch_warnings(record=True) as caught:
+                warnings.simplefilter("always", ResourceWarning)
+                result, data = kubeconfig_probe.probe_kubeconfig_connections(input)
+                gc.collect()
+            # Timed out and pooled connections are all closed.
+            self.assertEqual([], [str(warning.message) for warning in caught])
+            self.assertEqual("success", result)
+            plugin.test_object_serialization(data)
+            self.assertEqual(
+                [True, True, False, False, False, False],
+                [probe.reachable for probe in data.results],
+            )
+            self.assertEqual("v1.28.3", data.results[0].version)
+            self.assertEqual(
+                ["/version", "/readyz"],
+                [endpoint.path for endpoint in data.results[0].endpoints],
+            )
+            self.assertEqual(200, data.results[1].endpoints[1].status)
+            self.assertEqual(401, data.results[2].endpoints[0].status)
+            self.assertIn(
+                "CERTIFICATE_VERIFY_FAILED", data.results[3].endpoints[0].error
+            )
+            self.assertIsNone(data.results[4].endpoints[0].status)
+            self.assertIn("timed out", data.results[5].endpoints[0].error)
+            for probe in data.results:
+                for endpoint in probe.endpoints:
+                    self.assertGreater(endpoint.latency_ms, 0)
+            self.assertTrue(any(connections))
+
+            # With one request in flight, connections are reused from the pool.
+            del connections[:]
+            results = kubeconfig_probe.probe_connections([token, token], 1, 5.0)
+            self.assertTrue(all(probe.reachable for probe in results))
+            self.assertEqual(1, len(connections))
+
+            # The deadline bounds the whole probe, whatever the request timeout.
+            input = kubeconfig_probe.ProbeInputParams(
+                connections=[input.connections[-1]], timeout=30.0, deadline=0.2
+            )
+            result, data = kubeconfig_probe.probe_kubeconfig_connections(input)
+            self.assertEqual("error", result)
+            self.assertIn("did not finish within 0.2s", data.error)
+
+    def test_watch(self):
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, "kubeconfig")
+
+            def write(kubeconfig):
+                with open(path, "w") as f:
+                    f.write(kubeconfig)
+
+            write(self.SELECTIVE_KUBECONFIG)
+            watcher = kubeconfig_watch.KubeconfigWatcher(path, use_inotify=False)
+            result, data = watcher.poll()
+            self.assertEqual("success", result)
+            self.assertEqual("admin", data.connection.bearerToken)
+            self.assertIsNone(watcher.poll())
+            self.assertEqual(1, watcher.reads)
+
+            # Edits to other entries are read but not extracted or emitted.
+            write(self.SELECTIVE_KUBECONFIG.replace("token: other", "token: changed"))
+            self.assertIsNone(watcher.poll())
+            self.assertEqual((2, 1), (watcher.reads, watcher.extractions))
+
+            write(self.SELECTIVE_KUBECONFIG.replace("token: admin", "token: changed"))
+            result, data = watcher.poll()
+            self.assertEqual("changed", data.connection.bearerToken)
+
+            os.unlink(path)
+            result, data = watcher.poll()
+            self.assertEqual("error", result)
+            self.assertIn("Failed to read", data.error)
+            self.assertIsNone(watcher.poll())
+            write(self.SELECTIVE_KUBECONFIG)
+            result, data = watcher.poll()
+            self.assertEqual("admin", data.connection.bearerToken)
+
+            # Relative paths are resolved against the kubeconfig's directory.
+            self.write_credential_files(directory)
+            write(self.FILE_KUBECONFIG.format(directory="."))
+            result, data = watcher.poll()
+            self.assertEqual("success", result)
+            self.assertEqual("file-token", data.connection.bearerToken)
+
+            # With inotify, changes are picked up long before the interval.
+            watcher = kubeconfig_watch.KubeconfigWatcher(path, interval=30)
+            if watcher._inotify is None:
+                watcher.close()
+                return
+            results = []
+            stop = threading.Event()
+
+            def watch():
+                for result in watcher.watch(stop):
+                    results.append(result)
+
+            thread = threading.Thread(target=watch)
+            thread.start()
+            try:
+                for _ in range(100):
+                    if results:
+                        break
+                    time.sleep(0.01)
+                write(self.SELECTIVE_KUBECONFIG.replace("token: admin", "token: new"))
+                for _ in range(500):
+                    if len(results) > 1:
+                        break
+                    time.sleep(0.01)
+            finally:
+                stop.set()
+                write(self.SELECTIVE_KUBECONFIG)
+                thread.join()
+                watcher.close()
+            self.assertEqual(2, len(results))
+            self.assertEqual("new", results[1][1].connection.bearerToken)
+
+    def test_watch_exec_expiry(self):
+        with tempfile.TemporaryDirectory() as directory:
+            kubeconfig_plugin.exec_credential_cache.clear()
+            # Credentials are refreshed expiry_margin seconds before they expire.
+            expiration = int(time.time()) + 2
+            expiry = datetime.datetime.fromtimestamp(
+                expiration, datetime.timezone.utc
+            ).strftime("%Y-%m-%dT%H:%M:%SZ")
+            path = os.path.join(directory, "kubeconfig")
+            with open(path, "w") as f:
+                f.write(self.exec_kubeconfig(directory, expiry))
+            cache = kubeconfig_plugin.exec_credential_cache
+            cache.expiry_margin = expiration - time.time() - 1.0
+            watcher = kubeconfig_watch.KubeconfigWatcher(
+                path, interval=0.05, use_inotify=False
+            )
+            try:
+                result, data = watcher.poll()
+                self.assertEqual("exec-token-https://s", data.connection.bearerToken)
+                self.assertIsNone(watcher.poll())
+                self.assertEqual((1, 1), (watcher.extractions, cache.runs))
+                time.sleep(max(0.0, watcher._expires - time.time()) + 0.05)
+                # The same token comes back, so nothing is emitted.
+                self.assertIsNone(watcher.poll())
+                self.assertEqual((2, 2), (watcher.extractions, cache.runs))
+            finally:
+                del cache.expiry_margin
+                watcher.close()
+
 
 if __name__ == "__main__":
     unittest.main()